@@ -261,6 +261,9 @@ def list_options_specs():
     yield OptionSpec(section, "ui_url", validator=v.url)
     yield OptionSpec(section, "address", default="0.0.0.0", validator=v.address)
     yield OptionSpec(section, "port", validator=v.port, default=2345)
+    yield OptionSpec(section, "web_workers", default=4, validator=v.positive)
+    yield OptionSpec(section, "worker_max_tasks", default=100, validator=int)
+    yield OptionSpec(section, "worker_max_rss", default=256, validator=int)
     yield OptionSpec(
         section, "ssl_cert_file", default=OptionSpec.REQUIRED, validator=v.file_
     )
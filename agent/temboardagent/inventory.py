@@ -1,3 +1,4 @@
+import ipaddress
 import logging
 import os
 import platform
@@ -7,6 +8,35 @@ from .command import exec_command
 from .tools import to_bytes, which
 
 logger = logging.getLogger(__name__)
+# Parsed /proc files, keyed by path. Values are (raw content, parsed).
+_proc_cache = {}
+# Network file system types, excluded like df --local does.
+REMOTE_FSTYPES = (
+    "afs",
+    "ceph",
+    "cifs",
+    "coda",
+    "fuse.sshfs",
+    "glusterfs",
+    "lustre",
+    "ncpfs",
+    "nfs",
+    "nfs4",
+    "smb3",
+    "smbfs",
+)
+
+
+def parse_proc_cached(path, parse):
+    # Parse a /proc file, reusing previous result if contents is unchanged.
+    with open(path) as fo:
+        raw = fo.read()
+    cached = _proc_cache.get(path)
+    if cached and cached[0] == raw:
+        return cached[1]
+    parsed = parse(raw)
+    _proc_cache[path] = raw, parsed
+    return parsed
 
 
 class Inventory:
@@ -92,6 +122,13 @@ class SysInfo(Inventory):
 
     def _ip_addresses_linux(self):
         """Find the host's IP addresses."""
+        try:
+            return parse_proc_cached(
+                "/proc/net/fib_trie", parse_fib_trie
+            ) + parse_proc_cached("/proc/net/if_inet6", parse_if_inet6)
+        except OSError as e:
+            logger.debug("Falling back to ip command: %s", e)
+
         addrs = []
         try:
             ip = which("ip")
@@ -133,55 +170,24 @@ class SysInfo(Inventory):
     def _file_systems_linux(self):
         logger.debug("Inspecting file systems.")
         fs = []
-        (rc, out, err) = exec_command([which("df"), "--local", "-k"])
-        lines = out.splitlines()
-        # Remove header
-        del lines[0]
-        dev = None
-        for line in lines:
-            cols = line.decode("utf-8").split()
-            # Skip rootfs which is redundant on Debian
-            if cols[0] == "rootfs":
-                logger.debug("Ignoring rootfs mount point.")
-                continue
-
-            # Output of df can be multiline when the name of the
-            # device is too large
-            if len(cols) in (1, 6):
-                dev = cols.pop(0)
-
-            if not cols:
-                # Multi-line output, skip to next line for next fields.
-                continue
-
-            # cols is now always [total, used, avail, use%, mount_point].
-            total, used, _, _, mount_point = cols
-
-            # Skip docker volumes.
-            if dev in ("devtmpfs", "overlay", "shm", "tmpfs"):
-                logger.debug("Ignoring device %s as %s.", dev, mount_point)
-                continue
-
-            if dev.startswith("/dev/loop"):
-                logger.debug("Ignoring loopback device %s.", dev)
+        for mount in parse_proc_cached("/proc/self/mountinfo", parse_mountinfo):
+            try:
+                st = os.statvfs(mount["mount_point"])
+            except OSError as e:
+                logger.debug("Ignoring mount point %s: %s", mount["mount_point"], e)
                 continue
 
-            # Skip basic FHS directories.
-            _, top_level_dir = mount_point.split("/", 2)[:2]
-            if top_level_dir in ("dev", "proc", "run", "sys"):
-                logger.debug("Ignoring mount point %s.", mount_point)
+            # Skip pseudo file systems like df does.
+            if not st.f_blocks:
                 continue
 
-            logger.debug("Found filesystem %s at %s.", dev, mount_point)
             fs.append(
-                {
-                    "mount_point": mount_point,
-                    "device": dev,
-                    "total": int(total) * 1024,
-                    "used": int(used) * 1024,
-                }
+                dict(
+                    mount,
+                    total=st.f_blocks * st.f_frsize,
+                    used=(st.f_blocks - st.f_bfree) * st.f_frsize,
+                )
             )
-            dev = None
         return fs
 
     def mount_points(self):
@@ -205,6 +211,88 @@ class SysInfo(Inventory):
             realpath = os.path.dirname(realpath)
 
 
+def parse_fib_trie(raw):
+    # Extract local IPv4 addresses from /proc/net/fib_trie.
+    addrs = []
+    last = None
+    for line in raw.splitlines():
+        line = line.strip()
+        if line.startswith("|-- "):
+            last = line[4:]
+        elif line == "/32 host LOCAL" and last not in addrs:
+            addrs.append(last)
+    return addrs
+
+
+def parse_if_inet6(raw):
+    # Extract global IPv6 addresses from /proc/net/if_inet6.
+    addrs = []
+    for line in raw.splitlines():
+        cols = line.split()
+        if len(cols) < 6 or cols[3] != "00":  # Global scope only.
+            continue
+        addr = ipaddress.IPv6Address(bytes.fromhex(cols[0])).compressed
+        if addr not in addrs:
+            addrs.append(addr)
+    return addrs
+
+
+def parse_mountinfo(raw):
+    # List local file systems from /proc/self/mountinfo, like df --local.
+    # Fields are documented in proc(5).
+    mounts = {}
+    devices = {}
+    for line in raw.splitlines():
+        left, _, right = line.partition(" - ")
+        left, right = left.split(), right.split()
+        if len(left) < 5 or len(right) < 2:
+            continue
+        devno, root, mount_point = left[2], left[3], unescape_mount(left[4])
+        fstype, dev = right[0], unescape_mount(right[1])
+
+        if fstype in REMOTE_FSTYPES or dev == "rootfs":
+            continue
+
+        # Skip docker volumes.
+        if dev in ("devtmpfs", "overlay", "shm", "tmpfs"):
+            logger.debug("Ignoring device %s as %s.", dev, mount_point)
+            continue
+
+        if dev.startswith("/dev/loop"):
+            logger.debug("Ignoring loopback device %s.", dev)
+            continue
+
+        # Skip basic FHS directories.
+        _, top_level_dir = mount_point.split("/", 2)[:2]
+        if top_level_dir in ("dev", "proc", "run", "sys"):
+            logger.debug("Ignoring mount point %s.", mount_point)
+            continue
+
+        # Keep a single mount point per device, like df: prefer the mount of
+        # the device root over bind mounts, then the shortest mount point.
+        rank = len(root), len(mount_point)
+        other = devices.get(devno)
+        if other and other[0] <= rank:
+            continue
+        if other:
+            mounts.pop(other[1], None)
+        devices[devno] = rank, mount_point
+        # Last mount over a mount point wins.
+        mounts.pop(mount_point, None)
+        mounts[mount_point] = dict(mount_point=mount_point, device=dev)
+
+    for mount in mounts.values():
+        logger.debug(
+            "Found filesystem %s at %s.", mount["device"], mount["mount_point"]
+        )
+    return list(mounts.values())
+
+
+def unescape_mount(value):
+    # Mount points escape space, tab, newline and backslash as octal.
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), value)
+
+
 class PgInfo(Inventory):
     def __init__(self, db_conn):
         self.db_conn = db_conn
@@ -1,12 +1,11 @@
-import json
 import logging
 import time
 from datetime import datetime
 
 from bottle import HTTPError, default_app, request, response
-from temboardtoolkit import taskmanager
+from temboardtoolkit import frames, taskmanager
 from temboardtoolkit.configuration import OptionSpec
-from temboardtoolkit.validators import commalist
+from temboardtoolkit.validators import commaintdict, commalist, positive
 
 from ... import __version__ as __VERSION__
 from ...tools import now, validate_parameters
@@ -30,11 +29,9 @@ def get_metrics():
     app = default_app().temboard
     response.headers["Content-Type"] = "text/plain; version=0.0.4"
 
-    rows = db.get_metrics(app.config.temboard.home, "monitoring.db")
-    if not rows:
+    data = db.get_last_metric(app.config.temboard.home, "monitoring.db")
+    if not data:
         return "# EOF\n"
-    ((_, data),) = rows
-    data = json.loads(data)
     db.use_current_for_delta_metrics(data)
     lines = format_open_metrics_lines(generate_samples(data))
     return "\n".join(lines)
@@ -50,6 +47,9 @@ def get_monitoring():
     returned records to N, the query parameter 'limit' can be used and set to
     N. 'limit' default value is 50, meaning that the maximum number of record
     set this API returns by default is 50.
+
+    With query parameter 'format=frames', stored compressed records are
+    streamed as is, see temboardtoolkit.frames.
     """
 
     # Default values
@@ -75,15 +75,14 @@ def get_monitoring():
         validate_parameters(request.query, [("limit", T_LIMIT, False)])
         limit = int(request.query["limit"])
 
-    out = []
     h, n = app.config.temboard.home, "monitoring.db"
-    for _, metrics in db.get_metrics(h, n, limit, start_timestamp):
-        metrics = json.loads(metrics)
-        # Dropping current value, use /metrics to get them.
-        db.drop_current_for_delta_metrics(metrics)
-        out.append(metrics)
+    # Stored points have no current value, use /metrics to get them.
+    history = db.iter_history_frames(h, n, limit, start_timestamp)
     response.set_header("X-TemBoard-Discover-ETag", app.discover.etag)
-    return out
+    if "frames" == request.query.get("format"):
+        response.content_type = frames.CONTENT_TYPE
+        return (frames.pack(kind, blob) for kind, blob in history)
+    return list(db.merge_history_frames(history))
 
 
 @bottle.get("/config")
@@ -109,9 +108,16 @@ def monitoring_collector_worker(app):
     logger.debug("Load the probes to run.")
     probes = load_probes(config.monitoring, config.temboard.home)
 
+    durations = {}
     with app.postgres.dbpool() as pool:
         instance = instance_info(pool, app.config.monitoring.dbnames, discover)
-        data = run_probes(probes, pool, [instance])
+        data = run_probes(
+            probes,
+            pool,
+            [instance],
+            max_workers=config.monitoring.max_parallel_probes,
+            durations=durations,
+        )
 
     # Prepare and send output
     output = dict(
@@ -119,6 +125,8 @@ def monitoring_collector_worker(app):
         hostinfo=system_info,
         instances=remove_passwords([instance]),
         data=data,
+        # Wall time in seconds of each probe.
+        probe_durations=durations,
         version=__VERSION__,
     )
     logger.debug("Add data to metrics table.")
@@ -166,6 +174,8 @@ class MonitoringPlugin:
         OptionSpec(s, "dbnames", default="*", validator=commalist),
         OptionSpec(s, "scheduler_interval", default=60, validator=int),
         OptionSpec(s, "probes", default="*", validator=commalist),
+        OptionSpec(s, "max_parallel_probes", default=4, validator=positive),
+        OptionSpec(s, "probes_intervals", default="", validator=commaintdict),
     ]
     del s
 
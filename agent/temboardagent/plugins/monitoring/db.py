@@ -1,9 +1,12 @@
 import json
 import os
 import sqlite3
+from contextlib import closing
+from copy import deepcopy
 from textwrap import dedent
 from time import time as current_time
 
+from temboardtoolkit import frames
 from temboardtoolkit.utils import JSONEncoder
 
 
@@ -16,7 +19,13 @@ def bootstrap(path, dbname):
     delta values with potentially old data resulting with outliers.
 
     metrics table is used to queued collected data before they are pushed to
-    temboard server.
+    temboard server. Points are stored zlib-compressed, without current value
+    of delta metrics. Host and instance informations are stored in inventory
+    table, only when they change. last_metric table keeps the full latest
+    point for /metrics.
+
+    probe_runs table keeps the last output of probes running less often than
+    each collect. Like last_measures, it is purged when the agent starts.
     """
 
     with sqlite3.connect(os.path.join(path, dbname)) as conn:
@@ -31,27 +40,111 @@ def bootstrap(path, dbname):
                 )
             """)
         )
+        c.execute("DROP TABLE IF EXISTS probe_runs")
+        c.execute(
+            dedent("""
+                CREATE TABLE probe_runs (
+                    name TEXT PRIMARY KEY,
+                    time REAL,
+                    data TEXT
+                )
+            """)
+        )
+        c.execute("PRAGMA table_info(metrics)")
+        legacy = [row[1] for row in c.fetchall()] == ["time", "data"]
+        if legacy:
+            c.execute("ALTER TABLE metrics RENAME TO legacy_metrics")
+
         c.execute(
             dedent("""
                 CREATE TABLE IF NOT EXISTS metrics (
                     time REAL PRIMARY KEY,
-                    data TEXT
+                    data BLOB,
+                    inventory REAL
                 )
             """)
         )
+        c.execute(
+            dedent("""
+                CREATE TABLE IF NOT EXISTS inventory (
+                    time REAL PRIMARY KEY,
+                    data BLOB
+                )
+            """)
+        )
+        c.execute(
+            dedent("""
+                CREATE TABLE IF NOT EXISTS last_metric (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    time REAL,
+                    data BLOB
+                )
+            """)
+        )
+
+        if legacy:
+            # Convert JSON points queued by previous agent version.
+            c.execute("SELECT time, data FROM legacy_metrics ORDER BY time")
+            point = None
+            for time, data in c.fetchall():
+                point = json.loads(data)
+                insert_metric(conn, time, point)
+            if point:
+                # Serve newest queued point on /metrics until next collect.
+                set_last_metric(conn, time, point)
+            c.execute("DROP TABLE legacy_metrics")
 
 
 def add_metric(path, dbname, time, data):
     with sqlite3.connect(os.path.join(path, dbname)) as conn:
+        insert_metric(conn, time, data)
+        set_last_metric(conn, time, data)
         c = conn.cursor()
-        c.execute(
-            "INSERT INTO metrics VALUES(?, ?)",
-            (time, json.dumps(data, cls=JSONEncoder)),
-        )
         # When data are pulled from temboard server, we need to keep 6 hours of
         # data history for recovery.
         time_limit = current_time() - (60 * 60 * 6)
         c.execute("DELETE FROM metrics WHERE time < ?", (time_limit,))
+        # Keep inventory referenced by remaining points, and the latest one.
+        c.execute(
+            dedent("""
+                DELETE FROM inventory
+                WHERE time < COALESCE(
+                    (SELECT MIN(inventory) FROM metrics),
+                    (SELECT MAX(time) FROM inventory)
+                )
+            """)
+        )
+
+
+def insert_metric(conn, time, data):
+    # Split inventory from point. Store inventory only if it changed since
+    # previous point.
+    point = deepcopy(data)
+    inventory = frames.compress(
+        dict(hostinfo=point.pop("hostinfo"), instances=point.pop("instances"))
+    )
+    drop_current_for_delta_metrics(point)
+
+    c = conn.cursor()
+    c.execute("SELECT time, data FROM inventory ORDER BY time DESC LIMIT 1")
+    row = c.fetchone()
+    if row and row[1] == inventory:
+        inventory_time = row[0]
+    else:
+        inventory_time = time
+        c.execute("INSERT OR REPLACE INTO inventory VALUES(?, ?)", (time, inventory))
+
+    c.execute(
+        "INSERT INTO metrics VALUES(?, ?, ?)",
+        (time, frames.compress(point), inventory_time),
+    )
+
+
+def set_last_metric(conn, time, data):
+    conn.execute(
+        "INSERT OR REPLACE INTO last_metric VALUES(1, ?, ?)",
+        (time, frames.compress(data)),
+    )
 
 
 def delete_metric(path, dbname, time):
@@ -60,50 +153,102 @@ def delete_metric(path, dbname, time):
         c.execute("DELETE FROM metrics WHERE time = ?", (time,))
 
 
-def get_metrics(path, dbname, limit=50, start_timestamp=None):
-    query = "SELECT time, data FROM metrics"
+def get_last_metric(path, dbname):
+    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+        c = conn.cursor()
+        c.execute("SELECT data FROM last_metric")
+        row = c.fetchone()
+    if row:
+        return frames.decompress(row[0])
+
+
+def iter_history_frames(path, dbname, limit=50, start_timestamp=None):
+    # Yield stored compressed points as frames, without decoding them. An
+    # inventory frame (I) precedes the first point frame (P) referencing it.
+    query = dedent("""\
+    SELECT m.data, m.inventory, i.data
+    FROM metrics AS m
+    JOIN inventory AS i ON i.time = m.inventory
+    """)
     args = ()
     if start_timestamp:
-        query += " WHERE time >= ?"
+        query += " WHERE m.time >= ?"
         args += (start_timestamp,)
     else:
         # By default we want only the most recent record. This could be
         # achieved in a most elegant an simple way, but we want to keep the
         # same logic wheter or not start_timestamp is in use.
-        query += " WHERE time >= (SELECT MAX(time) FROM metrics)"
+        query += " WHERE m.time >= (SELECT MAX(time) FROM metrics)"
 
-    query += " ORDER BY time ASC"
+    query += " ORDER BY m.time ASC"
 
     if limit:
         query += " LIMIT ?"
         args += (limit,)
 
-    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+    with closing(sqlite3.connect(os.path.join(path, dbname))) as conn:
         c = conn.cursor()
         c.execute(query, args)
+        last_inventory = None
+        for point, inventory_time, inventory in c:
+            if inventory_time != last_inventory:
+                yield b"I", inventory
+                last_inventory = inventory_time
+            yield b"P", point
+
+
+def merge_history_frames(frames_):
+    # Rebuild complete points from inventory and point frames.
+    inventory = None
+    for kind, blob in frames_:
+        if kind == b"I":
+            inventory = frames.decompress(blob)
+        else:
+            yield dict(frames.decompress(blob), **inventory)
+
+
+def get_last_measures(path, dbname):
+    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+        c = conn.cursor()
+        c.execute("SELECT time, key, data FROM last_measures")
         return c.fetchall()
 
 
-def get_last_measure(path, dbname, key):
+def upsert_last_measures(path, dbname, measures):
+    # measures is a list of (time, key, data) tuples. Write them all in a
+    # single transaction to avoid one commit per delta key.
     with sqlite3.connect(os.path.join(path, dbname)) as conn:
         c = conn.cursor()
-        c.execute("SELECT time, data FROM last_measures WHERE key = ?", (key,))
-        return c.fetchone()
+        c.executemany(
+            "INSERT OR REPLACE INTO last_measures VALUES(?, ?, ?)",
+            [
+                (time, key, json.dumps(data, cls=JSONEncoder))
+                for time, key, data in measures
+            ],
+        )
+
+
+def get_probe_runs(path, dbname):
+    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+        c = conn.cursor()
+        c.execute("SELECT name, time, data FROM probe_runs")
+        return {
+            name: dict(time=time, data=json.loads(data))
+            for name, time, data in c.fetchall()
+        }
 
 
-def upsert_last_measure(path, dbname, time, key, data):
+def upsert_probe_runs(path, dbname, runs):
+    # runs is a list of (name, time, data) tuples.
     with sqlite3.connect(os.path.join(path, dbname)) as conn:
         c = conn.cursor()
-        try:
-            c.execute(
-                "INSERT INTO last_measures VALUES(?, ?, ?)",
-                (time, key, json.dumps(data, cls=JSONEncoder)),
-            )
-        except sqlite3.IntegrityError:
-            c.execute(
-                "UPDATE last_measures SET time = ?, data = ? WHERE key = ?",
-                (time, json.dumps(data, cls=JSONEncoder), key),
-            )
+        c.executemany(
+            "INSERT OR REPLACE INTO probe_runs VALUES(?, ?, ?)",
+            [
+                (name, time, json.dumps(data, cls=JSONEncoder))
+                for name, time, data in runs
+            ],
+        )
 
 
 def drop_current_for_delta_metrics(metrics):
@@ -1,9 +1,12 @@
+import functools
 import json
 import logging
 import os
 import re
+import threading
 import time
-from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, suppress
 
 import psycopg2
 from psycopg2.extensions import parse_dsn
@@ -21,6 +24,8 @@ logger = logging.getLogger(__package__)
 def load_probes(options, home):
     """Give a list of probe objects, ready to run."""
 
+    runs = db.get_probe_runs(home, "monitoring.db")
+    intervals = options.get("probes_intervals") or {}
     # All probes classes names start with "probe_", search for
     # classes and get an object
     probes = []
@@ -34,74 +39,173 @@ def load_probes(options, home):
         ):
             o = eval(c + "(options)")
             o.set_home(home)
+            o.interval = intervals.get(o.get_name(), o.interval)
+            o.last_run = runs.get(o.get_name())
             probes.append(o)
             logger.debug("Loaded probe: %s.", o.get_name())
 
     return probes
 
 
-def run_probes(probes, pool, instances, delta=True):
-    """Execute the probes."""
+def run_probes(probes, pool, instances, delta=True, max_workers=1, durations=None):
+    """Execute the probes.
+
+    Database level probes run on up to max_workers databases concurrently.
+    If durations is a dict, it is filled with wall time in seconds of each
+    probe.
+    """
 
     now = utcnow()
     logger.debug("Running probes at %s.", now.isoformat())
     # Output is a mapping of probe names with lists. Each probe returns
     # a list of dicts(metric -> value).
     output = {}
+    if not probes:
+        return output
 
-    for p in probes:
-        out = []
-        if delta is False:
-            p.delta_key = None
-            p.delta_columns = None
-
-        if p.level == "host":
-            if not p.check():
-                continue
-            logger.debug("Running host probe %s.", p.get_name())
-            try:
-                out = p.run()
-            except Exception as e:
-                logger.error("Probe failure: %s", e)
-                continue
+    # All probes share the same home, thus the same last measures.
+    store = DeltaStore(probes[0].home)
+    store.load()
+
+    # Output of probes with an interval, to reuse in next collects.
+    runs = []
+
+    with ThreadPoolExecutor(max_workers, thread_name_prefix="probe") as executor:
+        for p in probes:
+            out = []
+            start = time.monotonic()
+            p.delta_store = store
+            if delta is False:
+                p.delta_key = None
+                p.delta_columns = None
+
+            due = p.is_due(time.time())
+            if not due:
+                if p.level != "host" and not instances[0]["available"]:
+                    continue
+                logger.debug("Reusing last output of probe %s.", p.get_name())
+                out = [dict(record) for record in p.last_run["data"]]
+            elif p.level == "host":
+                if not p.check():
+                    continue
+                logger.debug("Running host probe %s.", p.get_name())
+                try:
+                    out = p.run()
+                except Exception as e:
+                    logger.error("Probe failure: %s", e)
+                    continue
+                finally:
+                    store.elapsed += store.pop_elapsed()
 
-        else:
-            if p.level not in ("instance", "database"):
-                raise Exception("Unknown probe level: %s", p.level)
+            else:
+                if p.level not in ("instance", "database"):
+                    raise Exception("Unknown probe level: %s", p.level)
 
-            (i,) = instances  # We are now mono-instance
-            if not i["available"]:
-                continue
+                (i,) = instances  # We are now mono-instance
+                if not i["available"]:
+                    continue
 
-            if not p.check(i["version_num"]):
-                logger.warning(
-                    "Unsupported PostgreSQL version for probe %s.", p.get_name()
-                )
-                continue
+                if not p.check(i["version_num"]):
+                    logger.warning(
+                        "Unsupported PostgreSQL version for probe %s.", p.get_name()
+                    )
+                    continue
 
-            logger.debug("Running %s probe %s.", p.level, p.get_name())
-            if p.level == "instance":
-                dbnames = [i["database"]]
-            else:
-                dbnames = [db["dbname"] for db in i["dbnames"]]
+                logger.debug("Running %s probe %s.", p.level, p.get_name())
+                if p.level == "instance":
+                    dbnames = [i["database"]]
+                else:
+                    dbnames = [db["dbname"] for db in i["dbnames"]]
 
-            for dbname in dbnames:
-                conninfo = dict(i, dbname=dbname)
+                run = functools.partial(run_database_probe, p, pool, i)
                 try:
-                    out += p.run(pool.getconn(dbname=dbname), conninfo)
+                    for rows, elapsed in executor.map(run, dbnames):
+                        out += rows
+                        store.elapsed += elapsed
                 except Exception as e:
                     logger.error("Probe failure: %s", e)
                     raise
-                    continue
 
-        for record in out:
-            record["datetime"] = now
-        output[p.get_name()] = out
-
-    logger.debug("Finished probes run.")
+            for record in out:
+                record["datetime"] = now
+            output[p.get_name()] = out
+            if p.interval and due:
+                runs.append((p.get_name(), time.time(), out))
+            if durations is not None and due:
+                durations[p.get_name()] = time.monotonic() - start
+
+    store.flush()
+    if runs:
+        db.upsert_probe_runs(store.home, store.dbname, runs)
+    logger.debug("Finished probes run. Delta bookkeeping took %.3fs.", store.elapsed)
     return output
 
 
+def run_database_probe(probe, pool, instance, dbname):
+    # Each database has its own connection, thus a single thread at a time.
+    # Returns rows and seconds spent on deltas, for the calling thread to
+    # merge.
+    conninfo = dict(instance, dbname=dbname)
+    rows = probe.run(pool.getconn(dbname=dbname), conninfo)
+    return rows, probe.delta_store.pop_elapsed()
+
+
+class DeltaStore:
+    """Keeps last measures of delta probes in memory during a collect.
+
+    Last measures are loaded once from monitoring.db and written back in a
+    single transaction at the end of the collect.
+    """
+
+    def __init__(self, home, dbname="monitoring.db"):
+        self.home = home
+        self.dbname = dbname
+        self.measures = {}
+        self.dirty = set()
+        # Seconds spent loading, computing and flushing deltas. Updated only
+        # by the thread running probes. Probe threads accumulate time spent
+        # computing deltas in thread local storage, see pop_elapsed().
+        self.elapsed = 0.0
+        self.local = threading.local()
+
+    def load(self):
+        start = time.monotonic()
+        for t, key, data in db.get_last_measures(self.home, self.dbname):
+            self.measures[key] = dict(time=t, data=json.loads(data))
+        self.elapsed += time.monotonic() - start
+
+    def get(self, key):
+        return self.measures.get(key)
+
+    def track(self, seconds):
+        self.local.elapsed = getattr(self.local, "elapsed", 0.0) + seconds
+
+    def pop_elapsed(self):
+        # Returns and resets time spent on deltas by current thread.
+        elapsed = getattr(self.local, "elapsed", 0.0)
+        self.local.elapsed = 0.0
+        return elapsed
+
+    def set(self, time, key, data):
+        self.measures[key] = dict(time=time, data=data)
+        self.dirty.add(key)
+
+    def flush(self):
+        if not self.dirty:
+            return
+        start = time.monotonic()
+        db.upsert_last_measures(
+            self.home,
+            self.dbname,
+            [
+                (self.measures[k]["time"], k, self.measures[k]["data"])
+                for k in sorted(self.dirty)
+            ],
+        )
+        self.dirty.clear()
+        self.elapsed += time.monotonic() - start
+
+
 def parse_primary_conninfo(pci):
     # Parse primary_conninfo string picked up from recovery.conf file
     m = re.match(r".*primary_conninfo\s*=\s*\'(.*)\'[^\']*$", pci)
@@ -194,9 +298,13 @@ class Probe:
     # Optionnal name of the probe
     name = None
     # Previous measures used for compute delta
-    last_measure = {}
-    last_measure_time = {}
     home = None
+    # In-memory last measures, shared by all probes of a collect.
+    delta_store = None
+    # Minimum seconds between two runs. None means each collect.
+    interval = None
+    # Last time and output of the probe, for probes with an interval.
+    last_run = None
 
     def __init__(self, options):
         pass
@@ -212,6 +320,13 @@ class Probe:
     def set_home(self, home):
         self.home = home
 
+    def is_due(self, now):
+        """Whether the probe must run or reuse its last output."""
+        if not self.interval or not self.last_run:
+            return True
+        # Tolerate collect scheduling jitter.
+        return now - self.last_run["time"] >= self.interval * 0.95
+
     def get_name(self):
         """Computes the name of the probe."""
         # Let the plugin overwrite the name
@@ -227,12 +342,10 @@ class Probe:
         return None
 
     def get_last_measure(self, key):
-        row = db.get_last_measure(self.home, "monitoring.db", key)
-        if row:
-            return dict(time=row[0], data=json.loads(row[1]))
+        return self.delta_store.get(key)
 
     def upsert_last_measure(self, time, key, data):
-        db.upsert_last_measure(self.home, "monitoring.db", time, key, data)
+        self.delta_store.set(time, key, data)
 
     def delta(self, key, current_values):
         """
@@ -246,6 +359,7 @@ class Probe:
             a tuple of the time interval of the delta in seconds and a
             dict a delta with the same keys as the input.
         """
+        start = time.monotonic()
         current_time = time.time()
         store_key = self.get_name() + key
         last_measure = self.get_last_measure(store_key)
@@ -266,6 +380,7 @@ class Probe:
 
         # Update/insert last measure for next delta calculation
         self.upsert_last_measure(current_time, store_key, current_values)
+        self.delta_store.track(time.monotonic() - start)
 
         return delta
 
@@ -377,6 +492,11 @@ class SqlProbe(Probe):
                 e,
                 exc_info=True,
             )
+        finally:
+            if self.timeout:
+                # Don't leak timeout to other probes sharing the connection.
+                with suppress(Exception):
+                    conn.execute("RESET statement_timeout;")
         return output
 
     def run(self, conn, conninfo):
@@ -835,6 +955,7 @@ class probe_heap_bloat(SqlProbe):
     # Heap bloat estimation probe
     # Query coming from https://github.com/ioguix/pgsql-bloat-estimation/
     level = "database"
+    interval = 600
     sql = """
 SELECT current_database() AS dbname,
   SUM(bloat_size)::FLOAT/SUM(bs*tblpages)::FLOAT*100 AS ratio
@@ -888,6 +1009,7 @@ class probe_btree_bloat(SqlProbe):
     # Btree index bloat estimation probe
     timeout = 30
     level = "database"
+    interval = 600
     sql = """
 SELECT
   current_database() AS dbname,
@@ -1,10 +1,12 @@
 import logging
+from numbers import Number
 
-from bottle import HTTPError, default_app
+from bottle import HTTPError, default_app, request
 from temboardtoolkit.configuration import OptionSpec
 
 from ...tools import now
 from ...web.app import CustomBottle
+from . import db
 
 bottle = CustomBottle()
 logger = logging.getLogger(__name__)
@@ -23,7 +25,13 @@ JOIN pg_database ON pgss.dbid = pg_database.oid
 
 @bottle.get("/")
 def get_statements(pgpool):
-    """Return a snapshot of latest statistics of executed SQL statements"""
+    """Return a snapshot of latest statistics of executed SQL statements
+
+    With cursor query parameter, as returned by previous snapshot, returns only
+    entries whose counters changed since then and query text of entries
+    unknown at that time. Otherwise, or if cursor is obsolete, returns all
+    entries with full flag. Per database totals are computed on all entries.
+    """
     app = default_app().temboard
     config = app.config
     dbname = config.statements.dbname
@@ -45,8 +53,94 @@ def get_statements(pgpool):
             "Failed to get pg_stat_statements data on database %s: %s", dbname, e
         )
         raise HTTPError(500, e)
-    else:
-        return {"snapshot_datetime": snapshot_datetime, "data": data}
+
+    generation, snapshot, changes = db.record_snapshot(
+        config.temboard.home,
+        "statements.db",
+        {entry_key(row): entry_signature(row) for row in data},
+    )
+    since = parse_cursor(request.query.get("cursor"), generation, snapshot)
+    return {
+        "snapshot_datetime": snapshot_datetime,
+        "cursor": "%s-%s" % (generation, snapshot),
+        "full": since is None,
+        "databases": sum_by_database(data),
+        "data": list(filter_changes(data, changes, since)),
+    }
+
+
+def entry_key(row):
+    # Since PostgreSQL 14, a query has distinct entries when executed at top
+    # level and nested in a function.
+    return "%s:%s:%s:%s" % (
+        row["queryid"],
+        row["dbid"],
+        row["userid"],
+        row.get("toplevel"),
+    )
+
+
+def entry_signature(row):
+    # Any execution or planning increments these counters.
+    return repr(
+        (
+            row["calls"],
+            row.get("plans"),
+            row.get("total_exec_time", row.get("total_time")),
+            row.get("total_plan_time"),
+            row.get("toplevel"),
+        )
+    )
+
+
+def parse_cursor(cursor, generation, snapshot):
+    # Returns snapshot number of cursor or None if a full snapshot is required.
+    if not cursor:
+        return None
+    cursor_generation, _, since = cursor.partition("-")
+    if cursor_generation != generation:
+        logger.debug("Cursor generation %s is obsolete.", cursor_generation)
+        return None
+    try:
+        since = int(since)
+    except ValueError:
+        logger.debug("Invalid cursor %s.", cursor)
+        return None
+    if since >= snapshot:
+        return None
+    return since
+
+
+def filter_changes(data, changes, since):
+    for row in data:
+        if since is None:
+            yield row
+            continue
+        first_seen, changed_at = changes[entry_key(row)]
+        if changed_at <= since:
+            continue
+        if first_seen <= since:
+            row = dict(row)
+            del row["query"]
+        yield row
+
+
+def sum_by_database(data):
+    # Sum cumulative counters of all entries, ignoring ids and statistics like
+    # min_exec_time or stddev_plan_time.
+    databases = {}
+    for row in data:
+        total = databases.setdefault(
+            row["dbid"], dict(dbid=row["dbid"], datname=row["datname"])
+        )
+        for k, v in row.items():
+            if k in ("userid", "dbid", "queryid") or k.startswith(
+                ("min_", "max_", "mean_", "stddev_")
+            ):
+                continue
+            if isinstance(v, Number) and not isinstance(v, bool):
+                total[k] = total.get(k, 0) + v
+    return list(databases.values())
 
 
 class StatementsPlugin:
@@ -59,5 +153,8 @@ class StatementsPlugin:
         self.app = app
         self.app.config.add_specs(self.option_specs)
 
+    def bootstrap(self):
+        db.bootstrap(self.app.config.temboard.home, "statements.db")
+
     def load(self):
         default_app().mount("/statements", bottle)
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import uuid
+from textwrap import dedent
+
+
+def bootstrap(path, dbname):
+    """Create SQLite3 database model to track changes of pg_stat_statements
+    entries between snapshots.
+
+    entries table keeps a signature of the counters of each entry at last
+    snapshot, the snapshot which first returned the entry and the last
+    snapshot where counters changed. meta table keeps the last snapshot number
+    and a generation token.
+
+    Tables are recreated when the agent starts. The new generation invalidates
+    cursors of clients, which get a full snapshot on next pull.
+    """
+
+    with sqlite3.connect(os.path.join(path, dbname)) as conn:
+        c = conn.cursor()
+        c.execute("DROP TABLE IF EXISTS meta")
+        c.execute(
+            dedent("""
+                CREATE TABLE meta (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    generation TEXT,
+                    snapshot INTEGER
+                )
+            """)
+        )
+        c.execute("INSERT INTO meta VALUES (1, ?, 0)", (uuid.uuid4().hex[:12],))
+        c.execute("DROP TABLE IF EXISTS entries")
+        c.execute(
+            dedent("""
+                CREATE TABLE entries (
+                    key TEXT PRIMARY KEY,
+                    signature TEXT,
+                    first_seen INTEGER,
+                    changed_at INTEGER
+                )
+            """)
+        )
+
+
+def record_snapshot(path, dbname, entries):
+    """Record a snapshot of pg_stat_statements entries.
+
+    entries is a dict of entry key to counters signature. Returns generation,
+    new snapshot number and a dict of entry key to (first_seen, changed_at)
+    snapshot numbers. Entries missing from snapshot are forgotten.
+    """
+    with sqlite3.connect(os.path.join(path, dbname), isolation_level=None) as conn:
+        c = conn.cursor()
+        # Serialize concurrent pulls.
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute("SELECT generation, snapshot + 1 FROM meta")
+            generation, snapshot = c.fetchone()
+            c.execute("SELECT key, signature, first_seen, changed_at FROM entries")
+            known = {key: row for key, *row in c.fetchall()}
+
+            changes = {}
+            upserts = []
+            for key, signature in entries.items():
+                old_signature, first_seen, changed_at = known.pop(
+                    key, (None, snapshot, snapshot)
+                )
+                if old_signature != signature:
+                    changed_at = snapshot
+                    upserts.append((key, signature, first_seen, changed_at))
+                changes[key] = first_seen, changed_at
+
+            c.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", upserts)
+            c.executemany("DELETE FROM entries WHERE key = ?", ((k,) for k in known))
+            c.execute("UPDATE meta SET snapshot = ?", (snapshot,))
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        else:
+            c.execute("COMMIT")
+
+    return generation, snapshot, changes
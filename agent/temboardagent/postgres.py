@@ -9,6 +9,7 @@
 
 import logging
 import re
+import threading
 from contextlib import closing
 from time import sleep
 
@@ -72,12 +73,12 @@ class Postgres:
     def dbpool(self):
         return DBConnectionPool(self)
 
-    def pool(self):
+    def pool(self, maxconn=2):
         return ConnectionPool(
             app=self.app,
             observers=self.connection_lost_observers,
             minconn=1,
-            maxconn=2,
+            maxconn=maxconn,
             **self.pqvars(),
         )
 
@@ -218,11 +219,13 @@ class ConnectionPool(ThreadedConnectionPool):
 class DBConnectionPool:
     # Pool one connection per database.
     #
-    # Not thread-safe.
+    # getconn() is thread-safe, but a connection must be used by one thread
+    # at a time. closeall() and auto_reconnect() are not thread-safe.
 
     def __init__(self, postgres):
         self.postgres = postgres
         self.pool = dict()
+        self.lock = threading.Lock()
 
     def getconn(self, dbname=None):
         dbname = dbname or self.postgres.dbname
@@ -231,7 +234,11 @@ class DBConnectionPool:
             logger.debug("Opening connection to db %s.", dbname)
             pqvars = self.postgres.pqvars(dbname=dbname)
             conn = retry_connect(connect, self.postgres.app, **pqvars)
-            self.pool[dbname] = conn
+            with self.lock:
+                pooled = self.pool.setdefault(dbname, conn)
+            if pooled is not conn:  # Another thread won the race.
+                conn.close()
+                conn = pooled
 
         return conn
 
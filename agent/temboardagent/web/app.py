@@ -3,6 +3,7 @@ import functools
 import inspect
 import json
 import logging
+import threading
 from datetime import timedelta
 
 from bottle import (
@@ -31,6 +32,7 @@ def create_app(temboard):
     app.add_hook("before_request", before_request_log)
     app.uninstall(True)
     # First declared, first executed.
+    app.install(StatsPlugin())
     app.install(JSONPlugin())
     app.install(SignaturePlugin())
     app.install(PostgresPlugin())
@@ -67,21 +69,41 @@ def before_request_log():
     logger.debug("New web request: %s %s", request.method, request.path)
 
 
+class StatsPlugin:
+    # Tell request handler the route rule for per-route HTTP stats.
+    def apply(self, callback, route):
+        @functools.wraps(callback)
+        def wrapper(*a, **kw):
+            handler = request.environ.get("temboard.request_handler")
+            if handler:
+                # script_name holds the plugin mount prefix like /monitoring/.
+                prefix = request.script_name.rstrip("/")
+                handler.route = f"{route.method} {prefix}{route.rule}"
+            return callback(*a, **kw)
+
+        return wrapper
+
+
 class PostgresPlugin:
     def __init__(self):
         self._pool = None
-        self._dbpool = None
+        # One DBConnectionPool per HTTP thread.
+        self._dbpools = threading.local()
 
     @property
     def dbpool(self):
-        if not self._dbpool:
-            self._dbpool = default_app().temboard.postgres.dbpool()
-        return self._dbpool
+        dbpool = getattr(self._dbpools, "dbpool", None)
+        if not dbpool:
+            dbpool = default_app().temboard.postgres.dbpool()
+            self._dbpools.dbpool = dbpool
+        return dbpool
 
     @property
     def pool(self):
         if not self._pool:
-            self._pool = default_app().temboard.postgres.pool()
+            app = default_app().temboard
+            # One connection per HTTP thread, plus one spare for reconnect.
+            self._pool = app.postgres.pool(maxconn=app.config.temboard.web_workers + 1)
         return self._pool
 
     def apply(self, callback, route):
@@ -92,8 +114,7 @@ class PostgresPlugin:
         @functools.wraps(callback)
         def wrapper(*a, **kw):
             if "pgpool" in wanted:
-                # dbpool is not threadsafe! But wsgiref simple server is
-                # not threaded.
+                # dbpool is not threadsafe! Each HTTP thread has its own.
                 kw["pgpool"] = self.dbpool
 
             # Assume callbacks idempotence.
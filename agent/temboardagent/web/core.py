@@ -57,6 +57,12 @@ def notifications():
     return list(NotificationMgmt.get_last_n(config, -1))
 
 
+@get("/stats")
+def get_stats():
+    server = default_app().temboard.httpd.server
+    return dict(workers=server.workers, **server.stats.as_dict())
+
+
 @get("/status", skip=["signature"])
 def get_status(pgconn):
     app = default_app().temboard
@@ -1,7 +1,15 @@
 import logging
+import queue
 import ssl
+import threading
+import time
 from socket import error as SocketError
-from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, make_server
+from wsgiref.simple_server import (
+    ServerHandler,
+    WSGIRequestHandler,
+    WSGIServer,
+    make_server,
+)
 
 from bottle import debug, default_app
 from temboardtoolkit import syncio
@@ -23,12 +31,21 @@ class HTTPDService(syncio.Service):
             bottle = default_app()
             debug(self.app.debug)
 
+            workers = self.app.config.temboard.web_workers
+            if workers > 1:
+                logger.debug("Serving HTTP requests with %s threads.", workers)
+                server_class = ThreadPoolWSGIServer
+            else:
+                server_class = CustomWSGIServer
+
             self.server = make_server(
                 self.app.config.temboard.address,
                 self.app.config.temboard.port,
                 app=bottle,
+                server_class=server_class,
                 handler_class=CustomWSGIRequestHandler,
             )
+            self.server.start_workers(workers)
         except SocketError as e:
             raise UserError(f"Failed to start HTTPS server: {e}.")
         try:
@@ -58,7 +75,10 @@ class HTTPDService(syncio.Service):
                 )
             )
 
-            self.server.socket = ctx.wrap_socket(self.server.socket, server_side=True)
+            # Handshake in serving thread, see process_request_now().
+            self.server.socket = ctx.wrap_socket(
+                self.server.socket, server_side=True, do_handshake_on_connect=False
+            )
         except Exception as e:
             raise UserError(f"Failed to setup SSL: {e}.")
         self.server.timeout = 1
@@ -74,13 +94,150 @@ class HTTPDService(syncio.Service):
         self.server.handle_request()
 
 
+class WebStats:
+    # Thread-safe per-route latency and request queue counters.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.queued = 0
+        self.max_queued = 0
+        self.active = 0
+
+    def enqueue(self):
+        with self.lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+    def dequeue(self):
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+
+    def done(self, route, elapsed):
+        with self.lock:
+            self.active -= 1
+            if route is None:
+                return
+            stats = self.routes.setdefault(
+                route, dict(count=0, total_ms=0.0, max_ms=0.0)
+            )
+            stats["count"] += 1
+            stats["total_ms"] += elapsed
+            stats["max_ms"] = max(stats["max_ms"], elapsed)
+
+    def as_dict(self):
+        with self.lock:
+            return dict(
+                queued=self.queued,
+                max_queued=self.max_queued,
+                active=self.active,
+                routes={
+                    route: dict(stats, avg_ms=stats["total_ms"] / stats["count"])
+                    for route, stats in self.routes.items()
+                },
+            )
+
+
+class CustomWSGIServer(WSGIServer):
+    # Serves one request at a time, in the main thread.
+
+    workers = 1
+    # Seconds to wait for client TLS handshake.
+    handshake_timeout = 10
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self.stats = WebStats()
+
+    def start_workers(self, workers):
+        pass
+
+    def process_request(self, request, client_address):
+        self.stats.enqueue()
+        self.process_request_now(request, client_address)
+
+    def process_request_now(self, request, client_address):
+        self.stats.dequeue()
+        try:
+            if not self.handshake(request, client_address):
+                return
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def handshake(self, request, client_address):
+        # TLS handshake is deferred from accept() so that a slow or broken
+        # client does not block the main thread accepting connections.
+        if not isinstance(request, ssl.SSLSocket):
+            return True
+        try:
+            # Don't let a silent client hold the thread forever.
+            request.settimeout(self.handshake_timeout)
+            request.do_handshake()
+            request.settimeout(None)
+        except OSError as e:
+            logger.debug("TLS handshake with %s failed: %s", client_address[0], e)
+            self.stats.done(None, 0)
+            return False
+        return True
+
+
+class ThreadPoolWSGIServer(CustomWSGIServer):
+    # Accept connections in main thread and serve them from a fixed set of
+    # threads. Accepted connections wait in a queue for an idle thread.
+
+    def start_workers(self, workers):
+        self.workers = workers
+        self.requests = queue.Queue()
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(
+                target=self.serve_requests, name="web-%d" % i, daemon=True
+            )
+            t.start()
+            self.threads.append(t)
+
+    def process_request(self, request, client_address):
+        self.stats.enqueue()
+        self.requests.put((request, client_address))
+
+    def serve_requests(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            self.process_request_now(*item)
+
+    def server_close(self):
+        for _ in self.threads:
+            self.requests.put(None)
+        for t in self.threads:
+            t.join()
+        super().server_close()
+
+
 class CustomWSGIRequestHandler(WSGIRequestHandler):
+    def handle(self):
+        self.start = time.monotonic()
+        self.route = None
+        try:
+            super().handle()
+        finally:
+            elapsed = (time.monotonic() - self.start) * 1000
+            self.server.stats.done(self.route, elapsed)
+
     def get_environ(self):
         env = super().get_environ()
 
         # Save raw PATH_INFO for signature computation.
         path, _, _ = self.path.partition("?")
         env["RAW_PATH_INFO"] = path
+        # Backpointer for StatsPlugin to set the route of the request.
+        # wsgiref copies environ before calling app.
+        env["temboard.request_handler"] = self
 
         return env
 
@@ -96,6 +253,6 @@ class CustomWSGIRequestHandler(WSGIRequestHandler):
             self.command,  # Method
             self.path,
             self.address_string(),
-            "-",  # Not timed.
+            "%.2fms" % ((time.monotonic() - self.start) * 1000),
             size,
         )
@@ -5,3 +5,26 @@ def test_version():
     version = parse(__version__)
 
     assert "Version" == version.__class__.__name__
+
+
+def test_web_stats():
+    from temboardagent.web.service import WebStats
+
+    stats = WebStats()
+    stats.enqueue()
+    stats.enqueue()
+    stats.dequeue()
+    assert 1 == stats.queued
+    assert 1 == stats.active
+    stats.done("GET /status", 10.0)
+    stats.dequeue()
+    stats.done("GET /status", 30.0)
+
+    data = stats.as_dict()
+    assert 0 == data["queued"]
+    assert 2 == data["max_queued"]
+    assert 0 == data["active"]
+    route = data["routes"]["GET /status"]
+    assert 2 == route["count"]
+    assert 30.0 == route["max_ms"]
+    assert 20.0 == route["avg_ms"]
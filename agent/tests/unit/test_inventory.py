@@ -0,0 +1,87 @@
+from textwrap import dedent
+
+
+def test_parse_mountinfo():
+    from temboardagent.inventory import parse_mountinfo
+
+    raw = dedent("""\
+    23 28 0:22 / /proc rw,relatime - proc proc rw
+    25 28 0:6 / /dev rw,relatime - devtmpfs devtmpfs rw,size=3066496k
+    28 1 252:0 / / rw,relatime shared:1 - ext4 /dev/vda rw
+    29 28 252:16 / /var/lib/postgresql rw,relatime - xfs /dev/vdb rw
+    30 28 252:16 /backup /mnt/my\\040backup rw,relatime - xfs /dev/vdb rw
+    31 28 0:50 / /srv rw,relatime - nfs4 server:/export rw
+    32 28 7:0 / /snap/core rw,relatime - squashfs /dev/loop0 ro
+    33 28 0:30 / /var/lib/docker/overlay - overlay overlay rw
+    """)
+
+    mounts = parse_mountinfo(raw)
+
+    assert [
+        dict(mount_point="/", device="/dev/vda"),
+        dict(mount_point="/var/lib/postgresql", device="/dev/vdb"),
+    ] == mounts
+
+    raw = "30 28 252:16 / /mnt/my\\040backup rw - xfs /dev/vdb rw\n"
+    ((mount),) = parse_mountinfo(raw)
+    assert "/mnt/my backup" == mount["mount_point"]
+
+
+def test_parse_fib_trie():
+    from temboardagent.inventory import parse_fib_trie
+
+    raw = dedent("""\
+    Main:
+      +-- 0.0.0.0/0 3 0 5
+         |-- 0.0.0.0
+            /0 universe UNICAST
+         +-- 127.0.0.0/8 2 0 2
+            +-- 127.0.0.0/31 1 0 0
+               |-- 127.0.0.0
+                  /8 host LOCAL
+               |-- 127.0.0.1
+                  /32 host LOCAL
+            |-- 127.255.255.255
+               /32 link BROADCAST
+         +-- 192.0.2.0/24 2 0 2
+               |-- 192.0.2.2
+                  /32 host LOCAL
+    Local:
+         +-- 127.0.0.0/8 2 0 2
+               |-- 127.0.0.1
+                  /32 host LOCAL
+    """)
+
+    assert ["127.0.0.1", "192.0.2.2"] == parse_fib_trie(raw)
+
+
+def test_parse_if_inet6():
+    from temboardagent.inventory import parse_if_inet6
+
+    raw = dedent("""\
+    00000000000000000000000000000001 01 80 10 80       lo
+    fd000000000000000000000000000002 04 40 00 82     eth0
+    fe8000000000000000fc00fffe000001 04 40 20 80     eth0
+    """)
+
+    assert ["fd00::2"] == parse_if_inet6(raw)
+
+
+def test_parse_proc_cached(tmp_path):
+    from temboardagent.inventory import parse_proc_cached
+
+    path = tmp_path / "mountinfo"
+    path.write_text("a")
+    calls = []
+
+    def parse(raw):
+        calls.append(raw)
+        return raw.upper()
+
+    assert "A" == parse_proc_cached(str(path), parse)
+    assert "A" == parse_proc_cached(str(path), parse)
+    assert ["a"] == calls
+
+    path.write_text("b")
+    assert "B" == parse_proc_cached(str(path), parse)
+    assert ["a", "b"] == calls
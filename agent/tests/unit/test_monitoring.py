@@ -402,3 +402,167 @@ def test_open_metrics_from_data():
     assert "node_procs_blocked 0\n" in text
     assert "node_procs_running 6\n" in text
     assert "xnode_procs_total 2500\n" in text
+
+
+def test_delta_store(tmp_path):
+    from temboardagent.plugins.monitoring import db
+    from temboardagent.plugins.monitoring.probes import DeltaStore, Probe
+
+    db.bootstrap(str(tmp_path), "monitoring.db")
+
+    store = DeltaStore(str(tmp_path))
+    store.load()
+    probe = Probe(options=None)
+    probe.name = "xacts"
+    probe.delta_store = store
+
+    delta = probe.delta("main", dict(n_commit=10))
+    assert "measure_interval" not in delta
+    assert delta["current"] == dict(n_commit=10)
+
+    delta = probe.delta("main", dict(n_commit=15))
+    assert delta["n_commit"] == 5
+    assert store.dirty == {"xactsmain"}
+    assert db.get_last_measures(str(tmp_path), "monitoring.db") == []
+    # Delta time is tracked per thread, merged by caller.
+    assert store.pop_elapsed() > 0
+    assert store.pop_elapsed() == 0
+
+    store.flush()
+    assert not store.dirty
+    assert store.elapsed > 0
+
+    store = DeltaStore(str(tmp_path))
+    store.load()
+    assert store.get("xactsmain")["data"] == dict(n_commit=15)
+
+
+def test_metrics_queue(tmp_path):
+    from time import time
+
+    from temboardagent.plugins.monitoring import db
+
+    home = str(tmp_path)
+    now = time()
+    db.bootstrap(home, "monitoring.db")
+    db.add_metric(home, "monitoring.db", now - 120, deepcopy(temboard_data))
+    db.add_metric(home, "monitoring.db", now - 60, deepcopy(temboard_data))
+    changed = deepcopy(temboard_data)
+    changed["hostinfo"]["ip_addresses"].append("10.0.0.1")
+    db.add_metric(home, "monitoring.db", now, changed)
+
+    frames = list(db.iter_history_frames(home, "monitoring.db", start_timestamp=1))
+    assert [b"I", b"P", b"P", b"I", b"P"] == [kind for kind, _ in frames]
+
+    rows = list(db.merge_history_frames(frames))
+    assert 3 == len(rows)
+    assert rows[0]["hostinfo"] == temboard_data["hostinfo"]
+    assert "10.0.0.1" in rows[2]["hostinfo"]["ip_addresses"]
+    assert rows[0]["instances"] == temboard_data["instances"]
+    assert "current" not in rows[0]["data"]["xacts"][0]
+
+    # Without start, only the latest point.
+    frames = list(db.iter_history_frames(home, "monitoring.db"))
+    assert [b"I", b"P"] == [kind for kind, _ in frames]
+
+    last = db.get_last_metric(home, "monitoring.db")
+    assert "current" in last["data"]["xacts"][0]
+
+
+def test_metrics_queue_legacy(tmp_path):
+    import json
+    import os
+    import sqlite3
+
+    from temboardagent.plugins.monitoring import db
+
+    home = str(tmp_path)
+    with sqlite3.connect(os.path.join(home, "monitoring.db")) as conn:
+        conn.execute("CREATE TABLE metrics (time REAL PRIMARY KEY, data TEXT)")
+        conn.execute(
+            "INSERT INTO metrics VALUES(?, ?)", (1000.0, json.dumps(temboard_data))
+        )
+
+    db.bootstrap(home, "monitoring.db")
+
+    frames = db.iter_history_frames(home, "monitoring.db", start_timestamp=1)
+    (row,) = db.merge_history_frames(frames)
+    assert row["hostinfo"] == temboard_data["hostinfo"]
+    assert temboard_data == db.get_last_metric(home, "monitoring.db")
+
+
+def test_run_probes_parallel(tmp_path):
+    import time
+
+    from temboardagent.plugins.monitoring import db
+    from temboardagent.plugins.monitoring.probes import SqlProbe, run_probes
+
+    db.bootstrap(str(tmp_path), "monitoring.db")
+
+    class probe_dummy(SqlProbe):
+        level = "database"
+
+        def run(self, conn, conninfo):
+            time.sleep(0.1)
+            return [dict(dbname=conninfo["dbname"])]
+
+    class Pool:
+        def getconn(self, dbname=None):
+            return None
+
+    probe = probe_dummy(options=None)
+    probe.set_home(str(tmp_path))
+    instance = dict(
+        available=True,
+        version_num=150000,
+        database="postgres",
+        dbnames=[dict(dbname="db%d" % i) for i in range(8)],
+    )
+    durations = {}
+
+    start = time.monotonic()
+    data = run_probes([probe], Pool(), [instance], max_workers=8, durations=durations)
+    elapsed = time.monotonic() - start
+
+    assert ["db%d" % i for i in range(8)] == [r["dbname"] for r in data["dummy"]]
+    assert elapsed < 0.5
+    assert 0.1 <= durations["dummy"] < 0.5
+
+
+def test_run_probes_interval(tmp_path):
+    from temboardagent.plugins.monitoring import db
+    from temboardagent.plugins.monitoring.probes import SqlProbe, run_probes
+
+    home = str(tmp_path)
+    db.bootstrap(home, "monitoring.db")
+    calls = []
+
+    class probe_dummy(SqlProbe):
+        level = "instance"
+        interval = 600
+
+        def run(self, conn, conninfo):
+            calls.append(conninfo["dbname"])
+            return [dict(dbname=conninfo["dbname"], value=len(calls))]
+
+    class Pool:
+        def getconn(self, dbname=None):
+            return None
+
+    instance = dict(available=True, version_num=150000, database="postgres")
+    probe = probe_dummy(options=None)
+    probe.set_home(home)
+    data = run_probes([probe], Pool(), [instance])
+    assert 1 == data["dummy"][0]["value"]
+
+    probe.last_run = db.get_probe_runs(home, "monitoring.db")["dummy"]
+    data = run_probes([probe], Pool(), [instance])
+    assert 1 == len(calls)
+    assert 1 == data["dummy"][0]["value"]
+    assert "datetime" in data["dummy"][0]
+
+    probe.last_run["time"] -= 600
+    data = run_probes([probe], Pool(), [instance])
+    assert 2 == data["dummy"][0]["value"]
+
+    assert {} == run_probes([], Pool(), [instance])
@@ -0,0 +1,81 @@
+def test_statements_cursor(tmp_path):
+    from temboardagent.plugins.statements import (
+        db,
+        entry_key,
+        entry_signature,
+        filter_changes,
+        parse_cursor,
+        sum_by_database,
+    )
+
+    def snapshot(data):
+        return db.record_snapshot(
+            str(tmp_path),
+            "statements.db",
+            {entry_key(row): entry_signature(row) for row in data},
+        )
+
+    def row(queryid, calls, dbid=1, toplevel=True):
+        return dict(
+            queryid=queryid,
+            dbid=dbid,
+            datname="db%s" % dbid,
+            userid=10,
+            query="SELECT %s" % queryid,
+            calls=calls,
+            total_exec_time=calls * 1.5,
+            mean_exec_time=1.5,
+            toplevel=toplevel,
+        )
+
+    db.bootstrap(str(tmp_path), "statements.db")
+
+    data = [row(1, 1), row(2, 1), row(3, 1, dbid=2)]
+    generation, snapshot1, changes = snapshot(data)
+    assert 1 == snapshot1
+    cursor = "%s-%s" % (generation, snapshot1)
+    assert parse_cursor(None, generation, snapshot1) is None
+    assert list(filter_changes(data, changes, None)) == data
+
+    # 1 executed again, 3 evicted, 4 is new.
+    data = [row(1, 2), row(2, 1), row(4, 1)]
+    _, snapshot2, changes = snapshot(data)
+    since = parse_cursor(cursor, generation, snapshot2)
+    assert snapshot1 == since
+    rows = list(filter_changes(data, changes, since))
+    assert [1, 4] == [r["queryid"] for r in rows]
+    assert "query" not in rows[0]
+    assert "SELECT 4" == rows[1]["query"]
+
+    # Client missed previous snapshot: changes since its cursor are sent again.
+    data = [row(1, 2), row(2, 1), row(4, 1)]
+    _, snapshot3, changes = snapshot(data)
+    rows = list(filter_changes(data, changes, parse_cursor(cursor, generation, 3)))
+    assert [1, 4] == [r["queryid"] for r in rows]
+    rows = list(filter_changes(data, changes, snapshot2))
+    assert [] == rows
+
+    # Same query executed at top level and nested in a function.
+    data = [row(1, 2), row(1, 1, toplevel=False), row(2, 1), row(4, 1)]
+    _, snapshot4, changes = snapshot(data)
+    assert 4 == len(changes)
+    rows = list(filter_changes(data, changes, snapshot3))
+    assert [(1, False)] == [(r["queryid"], r["toplevel"]) for r in rows]
+    assert "SELECT 1" == rows[0]["query"]
+    data = [row(1, 2), row(1, 2, toplevel=False), row(2, 1), row(4, 1)]
+    _, _, changes = snapshot(data)
+    rows = list(filter_changes(data, changes, snapshot4))
+    assert [(1, False)] == [(r["queryid"], r["toplevel"]) for r in rows]
+    assert "query" not in rows[0]
+
+    # Agent restart invalidates cursors.
+    db.bootstrap(str(tmp_path), "statements.db")
+    generation2, snapshot, _ = snapshot(data)
+    assert generation2 != generation
+    assert parse_cursor(cursor, generation2, snapshot) is None
+
+    databases = sum_by_database([row(1, 2), row(2, 1), row(3, 1, dbid=2)])
+    assert [
+        dict(dbid=1, datname="db1", calls=3, total_exec_time=4.5),
+        dict(dbid=2, datname="db2", calls=1, total_exec_time=1.5),
+    ] == databases
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#
+# Measure monitoring metrics ingestion throughput in temBoard repository.
+#
+# Compares the legacy point by point INSERT and commit with the bulk
+# ingestion used by the collector. Synthetic points are attached to a
+# dedicated host and instance, dropped at the end.
+#
+#     $ dev/bin/bench-metrics-insert.py postgresql://temboard@0.0.0.0:5432/temboard
+#
+
+import logging
+import sys
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+from sqlalchemy import create_engine
+from temboardui.model import Session
+from temboardui.plugins.monitoring.model import db
+from temboardui.plugins.monitoring.tools import group_metric_rows, insert_metrics
+
+logger = logging.getLogger("bench-metrics-insert")
+HOSTNAME = "bench-metrics-insert.invalid"
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark metrics ingestion.")
+    parser.add_argument("dsn", help="SQLAlchemy URL of temBoard repository.")
+    parser.add_argument("--points", type=int, default=100)
+    parser.add_argument("--databases", type=int, default=30)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)1.1s: %(message)s")
+    session = Session(bind=create_engine(args.dsn))
+    host_id, instance_id = setup(session)
+    try:
+        start = datetime.now(timezone.utc) - timedelta(days=1)
+        points = generate_points(
+            host_id, instance_id, start, args.points, args.databases
+        )
+        legacy = bench_legacy(session, points)
+
+        start += timedelta(minutes=args.points)
+        points = generate_points(
+            host_id, instance_id, start, args.points, args.databases
+        )
+        bulk = bench_bulk(session, points)
+    finally:
+        teardown(session, host_id, instance_id)
+
+    logger.info("Legacy: %d rows in %.3fs, %.0f rows/s.", *legacy)
+    logger.info("Bulk: %d rows in %.3fs, %.0f rows/s.", *bulk)
+    logger.info("Speedup: x%.1f.", bulk[2] / legacy[2])
+
+
+def bench_legacy(session, points):
+    # One INSERT and one commit per row, as before bulk ingestion.
+    count = 0
+    start = perf_counter()
+    for point in points:
+        for name, rows in group_metric_rows([point]).items():
+            for row in rows:
+                db.insert_metric_rows(session, name, [row])
+                session.commit()
+                count += 1
+    elapsed = perf_counter() - start
+    return count, elapsed, count / elapsed
+
+
+def bench_bulk(session, points):
+    start = perf_counter()
+    count = insert_metrics(session, points)
+    session.commit()
+    elapsed = perf_counter() - start
+    return count, elapsed, count / elapsed
+
+
+def setup(session):
+    host_id = session.execute(
+        "INSERT INTO monitoring.hosts (hostname, os, os_version)"
+        " VALUES (:hostname, 'Linux', 'bench') RETURNING host_id",
+        dict(hostname=HOSTNAME),
+    ).scalar()
+    instance_id = session.execute(
+        "INSERT INTO monitoring.instances"
+        " (host_id, port, local_name, version, version_num, data_directory)"
+        " VALUES (:host_id, 5432, 'bench', '16.0', 160000, '/bench')"
+        " RETURNING instance_id",
+        dict(host_id=host_id),
+    ).scalar()
+    session.commit()
+    return host_id, instance_id
+
+
+def teardown(session, host_id, instance_id):
+    session.rollback()
+    for table in db.METRICS:
+        level, _ = db.METRICS[table]
+        column, id_ = (
+            ("host_id", host_id) if level == "host" else ("instance_id", instance_id)
+        )
+        session.execute(
+            f"DELETE FROM monitoring.metric_{table}_current WHERE {column} = :id",
+            dict(id=id_),
+        )
+    session.execute(
+        "DELETE FROM monitoring.instances WHERE instance_id = :id", dict(id=instance_id)
+    )
+    session.execute(
+        "DELETE FROM monitoring.hosts WHERE host_id = :id", dict(id=host_id)
+    )
+    session.commit()
+
+
+def generate_points(host_id, instance_id, start, count, databases):
+    points = []
+    for i in range(count):
+        dt = (start + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S +0000")
+        common = dict(datetime=dt, measure_interval=60.0)
+        dbnames = ["db%03d" % n for n in range(databases)]
+        data = dict(
+            sessions=[
+                dict(
+                    common,
+                    dbname=d,
+                    active=i,
+                    waiting=0,
+                    idle=3,
+                    idle_in_xact=0,
+                    idle_in_xact_aborted=0,
+                    fastpath=0,
+                    disabled=0,
+                    no_priv=0,
+                )
+                for d in dbnames
+            ],
+            xacts=[dict(common, dbname=d, n_commit=i, n_rollback=0) for d in dbnames],
+            blocks=[
+                dict(common, dbname=d, blks_read=i, blks_hit=i, hitmiss_ratio=0.9)
+                for d in dbnames
+            ],
+            db_size=[dict(common, dbname=d, size=8 << 20) for d in dbnames],
+            temp_files_size_delta=[dict(common, dbname=d, size=0) for d in dbnames],
+            vacuum_analyze=[
+                dict(
+                    common,
+                    dbname=d,
+                    n_vacuum=0,
+                    n_analyze=0,
+                    n_autovacuum=i,
+                    n_autoanalyze=i,
+                )
+                for d in dbnames
+            ],
+            cpu=[
+                dict(
+                    common,
+                    cpu="cpu%d" % n,
+                    time_user=i,
+                    time_system=i,
+                    time_idle=i,
+                    time_iowait=0,
+                    time_steal=0,
+                )
+                for n in range(4)
+            ],
+            loadavg=[dict(common, load1=0.1, load5=0.2, load15=0.3)],
+            filesystems_size=[
+                dict(common, mount_point="/", used=1 << 30, total=8 << 30, device="sda")
+            ],
+        )
+        points.append((host_id, instance_id, data, None))
+    return points
+
+
+if __name__ == "__main__":
+    sys.exit(main())
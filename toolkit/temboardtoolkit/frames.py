@@ -0,0 +1,41 @@
+# Binary framing of compressed JSON documents.
+#
+# Used to stream stored documents from agent to UI without decoding them.
+# Each frame is a one byte kind, a 4 bytes big-endian payload length and a
+# zlib-compressed JSON payload.
+#
+import json
+import struct
+import zlib
+
+from .utils import JSONEncoder
+
+CONTENT_TYPE = "application/x-temboard-frames"
+HEADER = struct.Struct("!cI")
+
+
+def compress(data):
+    return zlib.compress(json.dumps(data, cls=JSONEncoder).encode("utf-8"))
+
+
+def decompress(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def pack(kind, blob):
+    return HEADER.pack(kind, len(blob)) + blob
+
+
+def iter_frames(fo):
+    # Yields (kind, blob) tuples read from a file-like object.
+    while True:
+        header = fo.read(HEADER.size)
+        if not header:
+            break
+        if len(header) < HEADER.size:
+            raise ValueError("Truncated frame header.")
+        kind, size = HEADER.unpack(header)
+        blob = fo.read(size)
+        if len(blob) < size:
+            raise ValueError("Truncated frame payload.")
+        yield kind, blob
@@ -2,6 +2,7 @@ import http.client
 import json
 import logging
 import ssl
+import threading
 from datetime import datetime, timezone
 from time import time
 from urllib.error import HTTPError
@@ -12,6 +13,45 @@ from .utils import ensure_bytes
 
 logger = logging.getLogger(LastnameFilter.root + ".http")
 
+# Process-wide SSL contexts per CA file and TLS sessions per host and port.
+# Sharing them saves loading CA and a full TLS handshake on each connection.
+_ssl_contexts = {}
+_tls_sessions = {}
+_lock = threading.Lock()
+
+
+def get_ssl_context(ca_cert_file=None):
+    with _lock:
+        ctx = _ssl_contexts.get(ca_cert_file)
+        if ctx is None:
+            ctx = ssl.create_default_context(cafile=ca_cert_file)
+            if ca_cert_file:
+                ctx.verify_mode = ssl.CERT_REQUIRED
+            else:
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl.CERT_NONE
+            _ssl_contexts[ca_cert_file] = ctx
+        return ctx
+
+
+class ResumingHTTPSConnection(http.client.HTTPSConnection):
+    # Resume TLS session of previous connection to the same host and port.
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        key = (self.host, self.port, id(self._context))
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=self.host, session=_tls_sessions.get(key)
+        )
+
+    def getresponse(self):
+        sock = self.sock
+        response = super().getresponse()
+        # With TLS 1.3, session ticket is available after first read.
+        if sock is not None and sock.session is not None:
+            _tls_sessions[(self.host, self.port, id(self._context))] = sock.session
+        return response
+
 
 class TemboardHTTPError(TemboardError):
     def __init__(self, response):
@@ -48,13 +88,25 @@ class TemboardClient:
         )
 
     def __init__(self, host, port, ca_cert_file=None, scheme="https"):
-        """If ca_cert_file is None, HTTPS connection is unverified."""
+        """If ca_cert_file is None, HTTPS connection is unverified.
+
+        Connection is kept open and reused for next request if server allows
+        it. Read the whole response before sending another request.
+        """
         self.scheme = scheme
         self.host = host
         self.port = port
         self.ca_cert_file = ca_cert_file
         self._ssl_context = None
         self._cookies = set()
+        self._conn = None
+        self._response = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
 
     def __repr__(self):
         return "<{} {}://{}:{} {}>".format(
@@ -68,14 +120,59 @@ class TemboardClient:
     @property
     def ssl_context(self):
         if self._ssl_context is None:
-            self._ssl_context = ssl.create_default_context(cafile=self.ca_cert_file)
-            if self.ca_cert_file:
-                self._ssl_context.verify_mode = ssl.CERT_REQUIRED
-            else:
-                self._ssl_context.check_hostname = False
-                self._ssl_context.verify_mode = ssl.CERT_NONE
+            self._ssl_context = get_ssl_context(self.ca_cert_file)
         return self._ssl_context
 
+    def close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+        self._response = None
+
+    def connect(self):
+        if "https" == self.scheme:
+            conn = ResumingHTTPSConnection(
+                self.host, self.port, context=self.ssl_context, timeout=30
+            )
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        conn.response_class = TemboardResponse
+        return conn
+
+    def send(self, method, path, body, headers):
+        # Reuse opened connection. Retry once on a fresh connection if server
+        # closed it meanwhile.
+        if self._response and not self._response.isclosed():
+            # Previous response is not consumed.
+            self.close()
+        reused = self._conn is not None
+        if not reused:
+            self._conn = self.connect()
+
+        try:
+            self._conn.request(method, path, body, headers)
+            response = self._conn.getresponse()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            self.close()
+            if not reused:
+                raise
+            logger.debug(
+                "Connection to %s:%s lost. Reconnecting.", self.host, self.port
+            )
+            self._conn = self.connect()
+            self._conn.request(method, path, body, headers)
+            response = self._conn.getresponse()
+        except Exception:
+            self.close()
+            raise
+
+        if response.will_close:
+            # http.client already closed its socket.
+            self._conn = None
+        else:
+            self._response = response
+        return response
+
     def request(self, method, path, headers=None, body=None):
         hostport = f"{self.host}:{self.port}"
         fullurl = f"{self.scheme}://{hostport}{path}"
@@ -95,21 +192,12 @@ class TemboardClient:
         if body is not None:
             body = ensure_bytes(body)
 
-        if "https" == self.scheme:
-            conn = http.client.HTTPSConnection(
-                self.host, self.port, context=self.ssl_context, timeout=30
-            )
-        else:
-            conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
-        conn.response_class = TemboardResponse
-
         if self.log_headers:
             for name, value in sorted(headers.items()):
                 logger.debug(">>> %s: %s", name, value)
 
         start_time = time()
-        conn.request(method, path, body, headers)
-        response = conn.getresponse()
+        response = self.send(method, path, body, headers)
         duration = time() - start_time
         response.path = path
 
@@ -78,10 +78,13 @@ class TaskListSQLite3Engine:
             raise StorageEngineError("Could not insert task.")
 
     def update(self, task):
+        self.update_many([task])
+
+    def update_many(self, tasks):
         try:
             with self.conn:
                 c = self.conn.cursor()
-                c.execute(
+                c.executemany(
                     dedent("""
                         UPDATE tasks
                         SET
@@ -95,17 +98,20 @@ class TaskListSQLite3Engine:
                           expire = ?
                         WHERE id = ?
                     """),
-                    (
-                        task.worker_name,
-                        datetime_to_epoch(task.start_datetime),
-                        datetime_to_epoch(task.stop_datetime),
-                        task.status,
-                        str(task.output) if task.output else None,
-                        json.dumps(task.options),
-                        task.redo_interval or 0,
-                        task.expire or 0,
-                        task.id,
-                    ),
+                    [
+                        (
+                            task.worker_name,
+                            datetime_to_epoch(task.start_datetime),
+                            datetime_to_epoch(task.stop_datetime),
+                            task.status,
+                            str(task.output) if task.output else None,
+                            json.dumps(task.options),
+                            task.redo_interval or 0,
+                            task.expire or 0,
+                            task.id,
+                        )
+                        for task in tasks
+                    ],
                 )
         except sqlite3.Error as e:
             logger.exception(str(e))
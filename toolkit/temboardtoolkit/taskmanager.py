@@ -1,5 +1,6 @@
 import errno
 import functools
+import heapq
 import logging
 import os.path
 import signal
@@ -56,6 +57,37 @@ def ensure_str(value):
     return value
 
 
+def epoch(dt):
+    # Same second resolution as task list storage.
+    return int((dt - datetime(1970, 1, 1)).total_seconds())
+
+
+def next_due(task):
+    # Returns epoch when Scheduler.schedule() has to handle task, or None.
+    # Storage compares with strict inequality, hence the extra second.
+    ended = TASK_STATUS_DONE | TASK_STATUS_FAILED | TASK_STATUS_ABORTED
+    if task.status & TASK_STATUS_DEFAULT and task.start_datetime:
+        return epoch(task.start_datetime) + 1
+    if task.redo_interval:
+        if task.status & ended and task.start_datetime:
+            return epoch(task.start_datetime) + task.redo_interval + 1
+    elif task.status & (ended | TASK_STATUS_CANCELED) and task.stop_datetime:
+        # Purge.
+        return epoch(task.stop_datetime) + (task.expire or 0) + 1
+
+
+def reset_signals():
+    signal.signal(signal.SIGABRT, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def read_rss():
+    # Resident set size of current process, in bytes.
+    with open("/proc/self/statm") as fo:
+        return int(fo.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
 def make_worker_definition(function, pool_size):
     return {
         "name": function.__name__,
@@ -140,6 +172,11 @@ class TaskList:
                 raise Exception("Task attribute %s does not exist" % k)
             setattr(task, k, v)
         self.engine.update(task)
+        return task
+
+    def update_many(self, tasks):
+        # Store tasks in a single transaction.
+        self.engine.update_many(tasks)
 
     def rm(self, id):
         self.engine.delete(id)
@@ -199,6 +236,12 @@ class Scheduler:
         self.last_schedule = 0
         self.last_vacuum = 0
         self.select_timeout = None
+        # Heap of (epoch, task id) when a task needs scheduling or purge.
+        # Entries may be stale, schedule() checks task list anyway.
+        self.due = []
+        # Schedule anyway at this interval, in case task list is modified
+        # by another process.
+        self.sweep_interval = 60
 
     def set_context(self, key, val):
         self.context[key] = val
@@ -255,9 +298,26 @@ class Scheduler:
         # TODO
         # self.sync_bootstrap_options()
         self.select_timeout = 1
+        self.due = []
+        if self.task_list:
+            for task in self.task_list.list():
+                self.push_due(task)
+
+    def push_due(self, task):
+        due = next_due(task)
+        if due is not None:
+            heapq.heappush(self.due, (due, task.id))
+
+    def next_wakeup(self):
+        wakeup = min(self.last_schedule + self.sweep_interval, self.last_vacuum + 3600)
+        if self.due:
+            wakeup = min(wakeup, self.due[0][0])
+        return wakeup
 
     def serve1(self):
-        # wait for I/O on Listener and event Queue
+        # wait for I/O on Listener and event Queue, or the next deadline.
+        # Return at least each select_timeout to handle signals.
+        timeout = min(self.select_timeout, max(0, self.next_wakeup() - time.time()))
         try:
             fds, _, _ = select(
                 [
@@ -266,7 +326,7 @@ class Scheduler:
                 ],
                 [],
                 [],
-                self.select_timeout,
+                timeout,
             )
         except SelectError as e:
             errno_, message = e.args
@@ -287,9 +347,13 @@ class Scheduler:
                 elif fd == self.event_queue._reader.fileno():
                     self.handle_event_queue_message()
 
-        if self.last_schedule < (time.time() - 1):
+        now = time.time()
+        due = self.due and self.due[0][0] <= now
+        if due or self.last_schedule <= now - self.sweep_interval:
+            while self.due and self.due[0][0] <= now:
+                heapq.heappop(self.due)
             self.schedule()
-            self.last_schedule = time.time()
+            self.last_schedule = now
 
         if self.last_vacuum < (time.time() - 3600):
             self.task_list.engine.vacuum()
@@ -319,7 +383,7 @@ class Scheduler:
         if self.shutdown:
             return
 
-        to_do = self.task_list.list_to_do(TASK_STATUS_DEFAULT, now)
+        to_do = list(self.task_list.list_to_do(TASK_STATUS_DEFAULT, now))
 
         for task in to_do:
             task.status = TASK_STATUS_SCHEDULED
@@ -327,17 +391,12 @@ class Scheduler:
             if self.trace:
                 logger.debug("Pushing task %s to the worker queue.", task.id)
 
-            try:
-                self.task_list.update(id=task.id, status=task.status)
-            except StorageEngineError as e:
-                logger.error(str(e))
-            else:
-                self.task_queue.put(task, False)
-
-        to_redo = self.task_list.list_to_do(
-            (TASK_STATUS_DONE | TASK_STATUS_FAILED | TASK_STATUS_ABORTED),
-            now,
-            redo=True,
+        to_redo = list(
+            self.task_list.list_to_do(
+                (TASK_STATUS_DONE | TASK_STATUS_FAILED | TASK_STATUS_ABORTED),
+                now,
+                redo=True,
+            )
         )
 
         for task in to_redo:
@@ -348,24 +407,25 @@ class Scheduler:
 
             logger.debug("Pushing task %s to the worker queue.", task.id)
 
-            try:
-                self.task_list.update(
-                    id=task.id,
-                    status=task.status,
-                    start_datetime=task.start_datetime,
-                    stop_datetime=task.stop_datetime,
-                    output=task.output,
-                )
-            except StorageEngineError as e:
-                logger.error(str(e))
-            else:
-                self.task_queue.put(task, False)
+        tasks = to_do + to_redo
+        if not tasks:
+            return
+
+        try:
+            self.task_list.update_many(tasks)
+        except StorageEngineError as e:
+            logger.error(str(e))
+            return
+
+        for task in tasks:
+            self.task_queue.put(task, False)
 
     def handle_message(self, message):
         if message.type == MSG_TYPE_TASK_NEW:
             # New task
             try:
                 task_id = self.task_list.push(message.content)
+                self.push_due(message.content)
                 return Message(MSG_TYPE_RESP, {"id": task_id})
             except KeyError:
                 return Message(MSG_TYPE_ERROR, {"error": "Task id already exists"})
@@ -383,7 +443,7 @@ class Scheduler:
                 if t.status & TASK_STATUS_CANCELED:
                     status = t.status
 
-                self.task_list.update(
+                t = self.task_list.update(
                     t.id,
                     status=status,
                     output=message.content.get("output", None),
@@ -393,6 +453,7 @@ class Scheduler:
                 logger.error(str(e))
                 return Message(MSG_TYPE_ERROR, {"error": str(e)})
             else:
+                self.push_due(t)
                 return Message(MSG_TYPE_RESP, {"id": t.id})
 
         elif message.type == MSG_TYPE_TASK_LIST:
@@ -412,7 +473,7 @@ class Scheduler:
             # task cancellation
             # first, we need to change its status and stop_datetime
             try:
-                self.task_list.update(
+                t = self.task_list.update(
                     message.content["task_id"],
                     status=TASK_STATUS_CANCELED,
                     stop_datetime=datetime.utcnow(),
@@ -420,6 +481,7 @@ class Scheduler:
             except StorageEngineError as e:
                 logger.error(str(e))
             else:
+                self.push_due(t)
                 # send the cancelation order to WP
                 t = Task(id=message.content["task_id"], status=TASK_STATUS_CANCELED)
                 self.task_queue.put(t)
@@ -529,12 +591,20 @@ class SchedulerService(syncio.Service):
 
 class WorkerPool:
     trace = False
+    # When max_tasks is set, worker processes are kept alive and serve up to
+    # max_tasks tasks, or until their RSS exceeds max_rss bytes. Otherwise, a
+    # new process is forked for each task.
+    max_tasks = 0
+    max_rss = 0
+    # Stop worker process idle for this amount of seconds.
+    idle_timeout = 300
 
     def __init__(self, task_queue, event_queue):
         self.thread = None
         self.task_queue = task_queue
         self.event_queue = event_queue
         self.workers = {}
+        self.retired = []
         self.perf = None
 
     def _abort_job(self, task_id):
@@ -612,37 +682,74 @@ class WorkerPool:
 
     def exec_worker(self, module, function, out, *args, **kws):
         # Function wrapper around worker function
-        try:
-            # Reset signal handlers.
-            signal.signal(signal.SIGABRT, signal.SIG_DFL)
-            signal.signal(signal.SIGINT, signal.SIG_DFL)
-            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        reset_signals()
+        fun = getattr(sys.modules[module], function)
+        modfun = f"{module}.{fun.__name__}"
+        proctitle.set("task %s" % (modfun))
+        perf = PerfCounters.setup(service="task", task=modfun)
+        if perf:
+            perf.schedule()
 
-            fun = getattr(sys.modules[module], function)
+        message = self.run_task(fun, modfun, *args, **kws)
+        if message:
+            out.put(message)
+        if perf:
+            perf.run()
 
-            modfun = f"{module}.{fun.__name__}"
-            logger.debug("Starting new job. task=%s", modfun)
+    def serve_worker(self, module, function, tasks, out):
+        # Persistent worker process main loop. Executes tasks until parent
+        # sends None or process has to be recycled.
+        reset_signals()
+        fun = getattr(sys.modules[module], function)
+        modfun = f"{module}.{fun.__name__}"
+        proctitle.set("worker %s" % (modfun))
+        perf = PerfCounters.setup(service="worker", task=modfun)
+        if perf:
+            perf.schedule()
+
+        count = 0
+        while True:
+            item = tasks.get()
+            if item is None:
+                break
+            task_id, options = item
             proctitle.set("task %s" % (modfun))
-            perf = PerfCounters.setup(service="task", task=modfun)
-            if perf:
-                perf.schedule()
+            message = self.run_task(fun, modfun, **(options or {}))
+            count += 1
+
+            recycle = count >= self.max_tasks
+            if self.max_rss and read_rss() > self.max_rss:
+                logger.debug("Worker memory exceeds %s bytes.", self.max_rss)
+                recycle = True
+            out.put((task_id, message, recycle))
+            if recycle:
+                logger.debug("Recycling worker after %s tasks. task=%s", count, modfun)
+                break
+            proctitle.set("worker %s" % (modfun))
+
+        if perf:
+            perf.run()
 
+    def run_task(self, fun, modfun, *args, **kws):
+        # Execute worker function. Returns a Message or None if interrupted.
+        try:
+            logger.debug("Starting new job. task=%s", modfun)
             res = fun(*args, **kws)
-            # Put function result into output queue as a Message
-            out.put(Message(MSG_TYPE_RESP, res))
             logger.debug("Job done. task=%s", modfun)
+            return Message(MSG_TYPE_RESP, res)
         except UserError as e:
             logger.critical("%s. task=%s", e, modfun)
         except Exception as e:
             e = Exception(f"{type(e)}: {e}")
-            out.put(Message(MSG_TYPE_ERROR, e))
             logger.exception("%s. task=%s", e, modfun)
+            return Message(MSG_TYPE_ERROR, e)
         except KeyboardInterrupt:
             logger.info("Interrupted. task=%s", modfun)
-        if perf:
-            perf.run()
 
     def start_jobs(self):
+        if self.max_tasks:
+            return self.start_prefork_jobs()
+
         # Execute Tasks
         for name, worker in self.workers.items():
             while len(self.workers[name]["pool"]) < worker["pool_size"]:
@@ -673,57 +780,159 @@ class WorkerPool:
                 except IndexError:
                     break
 
+    def start_prefork_jobs(self):
+        # Dispatch queued tasks to idle worker processes, spawning new
+        # processes up to pool size.
+        for name, worker in self.workers.items():
+            while worker["queue"]:
+                for job in worker["pool"]:
+                    if job["id"] is None:
+                        break
+                else:
+                    if len(worker["pool"]) >= worker["pool_size"]:
+                        break
+                    job = self.spawn_worker(worker)
+
+                t = worker["queue"].pop()
+                job["id"] = t.id
+                job["in"].put((t.id, t.options))
+                # Update task status
+                self.event_queue.put(
+                    Message(
+                        MSG_TYPE_TASK_STATUS,
+                        {"task_id": t.id, "status": TASK_STATUS_DOING},
+                    )
+                )
+
+    def spawn_worker(self, worker):
+        tasks = Queue()
+        out = Queue()
+        p = Process(
+            target=self.serve_worker,
+            args=(worker["module"], worker["function"], tasks, out),
+        )
+        p.start()
+
+        if self.perf:
+            self.perf["fork"] += 1
+
+        job = {"id": None, "process": p, "in": tasks, "out": out, "idle": time.time()}
+        worker["pool"].append(job)
+        return job
+
+    def retire(self, worker, job):
+        worker["pool"].remove(job)
+        self.retired.append(job)
+
+    def recycle(self):
+        # Stop persistent worker processes once they are idle.
+        for worker in self.workers.values():
+            for job in worker["pool"][:]:
+                if "in" not in job:
+                    continue
+                if job["id"] is None:
+                    job["in"].put(None)
+                    self.retire(worker, job)
+                else:
+                    job["recycle"] = True
+
+    def check_prefork_jobs(self):
+        now = time.time()
+        for name, worker in self.workers.items():
+            for job in worker["pool"][:]:
+                # Check process state before reading output: a dead process
+                # has flushed its output queue.
+                alive = job["process"].is_alive()
+                try:
+                    task_id, message_out, recycle = job["out"].get(False)
+                except Empty:
+                    pass
+                else:
+                    self.end_task(task_id, message_out, 0)
+                    job["id"] = None
+                    job["idle"] = now
+                    if recycle or not alive:
+                        self.retire(worker, job)
+                    elif job.get("recycle"):
+                        job["in"].put(None)
+                        self.retire(worker, job)
+                    continue
+
+                if not alive:
+                    # Process killed or crashed while executing a task.
+                    if job["id"] is not None:
+                        self.end_task(job["id"], None, job["process"].exitcode)
+                        job["id"] = None
+                    self.retire(worker, job)
+                elif job["id"] is None and now - job["idle"] > self.idle_timeout:
+                    if self.trace:
+                        logger.debug("Stopping idle worker %s.", name)
+                    job["in"].put(None)
+                    self.retire(worker, job)
+
+        for job in self.retired[:]:
+            if not job["process"].is_alive():
+                job["process"].join()
+                job["in"].close()
+                job["out"].close()
+                self.retired.remove(job)
+
+    def end_task(self, task_id, message_out, exitcode):
+        if self.trace:
+            logger.debug("Job %s terminated.", task_id)
+            logger.debug("Job output : %s" % message_out)
+
+        # Let's build the message we'll have to send to scheduler for the
+        # update of task's status.
+        task_stop_dt = datetime.utcnow()
+        if exitcode == 0:
+            if message_out and message_out.type[0] == MSG_TYPE_RESP:
+                task_status = TASK_STATUS_DONE
+            else:
+                # when an exception is raised from the worker function
+                task_status = TASK_STATUS_FAILED
+        elif exitcode < 0:
+            # process killed
+            task_status = TASK_STATUS_ABORTED
+        else:
+            task_status = TASK_STATUS_FAILED
+        task_output = None
+        if message_out:
+            task_output = message_out.content
+
+        # Update task status
+        self.event_queue.put(
+            Message(
+                MSG_TYPE_TASK_STATUS,
+                {
+                    "task_id": task_id,
+                    "status": task_status,
+                    "output": task_output,
+                    "stop_datetime": task_stop_dt,
+                },
+            )
+        )
+
     def check_jobs(self):
+        if self.max_tasks:
+            return self.check_prefork_jobs()
+
         # Check jobs process state for each worker
         for name, worker in self.workers.items():
             for job in worker["pool"]:
                 if not job["process"].is_alive():
                     # Dead process case
-                    if self.trace:
-                        logger.debug("Job %s terminated.", job["id"])
                     try:
                         # Fetch the message from job's output queue
                         message_out = job["out"].get(False)
                     except Empty:
                         message_out = None
-                    if self.trace:
-                        logger.debug("Job output : %s" % message_out)
                     # Close job's output queue
                     job["out"].close()
                     # join the process
                     job["process"].join()
 
-                    # Let's build the message we'll have to send to scheduler
-                    # for the update of task's status.
-                    task_stop_dt = datetime.utcnow()
-                    if job["process"].exitcode == 0:
-                        if message_out and message_out.type[0] == MSG_TYPE_RESP:
-                            task_status = TASK_STATUS_DONE
-                        else:
-                            # when an exception is raised from the worker
-                            # function
-                            task_status = TASK_STATUS_FAILED
-                    elif job["process"].exitcode < 0:
-                        # process killed
-                        task_status = TASK_STATUS_ABORTED
-                    else:
-                        task_status = TASK_STATUS_FAILED
-                    task_output = None
-                    if message_out:
-                        task_output = message_out.content
-
-                    # Update task status
-                    self.event_queue.put(
-                        Message(
-                            MSG_TYPE_TASK_STATUS,
-                            {
-                                "task_id": job["id"],
-                                "status": task_status,
-                                "output": task_output,
-                                "stop_datetime": task_stop_dt,
-                            },
-                        )
-                    )
+                    self.end_task(job["id"], message_out, job["process"].exitcode)
 
                     # Finally, remove the job from the pool
                     self.workers[name]["pool"].remove(job)
@@ -731,16 +940,21 @@ class WorkerPool:
     def abort_jobs(self):
         # abort all running jobs
         for name, worker in self.workers.items():
-            for job in worker["pool"]:
-                process = job.get("process")
-                if process.is_alive():
-                    process.terminate()
-                    logger.debug("Job %s has been terminated" % job["id"])
-                    # Close job's output queue
-                    job["out"].close()
-                    # join the process
-                    process.join()
-                    self.workers[name]["pool"].remove(job)
+            for job in worker["pool"][:]:
+                self.retire(worker, job)
+
+        for job in self.retired:
+            process = job.get("process")
+            if process.is_alive():
+                process.terminate()
+                logger.debug("Job %s has been terminated" % job["id"])
+            # Close job's queues
+            job["out"].close()
+            if "in" in job:
+                job["in"].close()
+            # join the process
+            process.join()
+        self.retired[:] = []
 
 
 class WorkerSet(list):
@@ -812,7 +1026,12 @@ class WorkerPoolService(syncio.Service):
 
     # interface for toolkit.app
     def apply_config(self):
-        pass
+        config = self.app.config.temboard
+        self.worker_pool.max_tasks = config.get("worker_max_tasks", 0)
+        self.worker_pool.max_rss = config.get("worker_max_rss", 0) * 1024 * 1024
+        # Persistent workers must not execute tasks with previous
+        # configuration.
+        self.worker_pool.recycle()
 
     def create_task_function_app_wrapper(self, function):
         @functools.wraps(function)
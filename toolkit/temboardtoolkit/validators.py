@@ -156,6 +156,20 @@ def commalist(raw):
     return list(filter(None, [w.strip() for w in raw.split(",")]))
 
 
+def commaintdict(raw):
+    # Parse comma separated name=integer pairs like "a=1,b=2".
+    if isinstance(raw, dict):
+        return raw
+
+    out = {}
+    for item in commalist(raw):
+        name, sep, value = item.partition("=")
+        if not sep or not name.strip():
+            raise ValueError("%s is not name=value" % item)
+        out[name.strip()] = int(value)
+    return out
+
+
 def nday(raw):
     nday = int(raw)
 
@@ -165,6 +179,15 @@ def nday(raw):
     return nday
 
 
+def positive(raw):
+    value = int(raw)
+
+    if value < 1:
+        raise ValueError("Must be at least 1")
+
+    return value
+
+
 def url(raw):
     url = urlparse(raw)
     if not url.scheme.startswith("http"):
@@ -0,0 +1,45 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = []
+
+    def setup(self):
+        super().setup()
+        self.connections.append(self.client_address)
+
+    def do_GET(self):
+        body = b'{"path": "%s"}' % self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *a):
+        pass
+
+
+def test_client_keepalive():
+    from temboardtoolkit.http import TemboardClient
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        port = server.server_address[1]
+        with TemboardClient("127.0.0.1", port, scheme="http") as client:
+            assert {"path": "/a"} == client.get("/a").json()
+            assert {"path": "/b"} == client.get("/b").json()
+            # Unread response does not break next request.
+            client.get("/c")
+            assert {"path": "/d"} == client.get("/d").json()
+        assert client._conn is None
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # /a and /b share the same connection. /d reconnects.
+    assert 2 == len(KeepAliveHandler.connections)
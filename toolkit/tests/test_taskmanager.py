@@ -0,0 +1,192 @@
+import os
+import time
+
+
+def getpid_worker(value):
+    return os.getpid(), value
+
+
+def run_pool(pool, tasks, timeout=10):
+    # Serve pool until all tasks ended, returns status messages by task id.
+    from temboardtoolkit.taskmanager import TASK_STATUS_DOING
+
+    for t in tasks:
+        pool.workers[t.worker_name]["queue"].appendleft(t)
+
+    ended = {}
+    deadline = time.time() + timeout
+    while len(ended) < len(tasks):
+        assert time.time() < deadline, "Tasks timed out."
+        pool.start_jobs()
+        pool.check_jobs()
+        while not pool.event_queue.empty():
+            message = pool.event_queue.get()
+            if message.content["status"] != TASK_STATUS_DOING:
+                ended[message.content["task_id"]] = message.content
+        time.sleep(0.01)
+    return ended
+
+
+def test_worker_pool_prefork(mocker):
+    mocker.patch("temboardtoolkit.taskmanager.proctitle.set")
+    from temboardtoolkit.taskmanager import (
+        TASK_STATUS_DONE,
+        Queue,
+        Task,
+        WorkerPool,
+        make_worker_definition,
+    )
+
+    pool = WorkerPool(Queue(), Queue())
+    pool.max_tasks = 3
+    pool.add(make_worker_definition(getpid_worker, pool_size=1))
+
+    tasks = [
+        Task(id=str(i), worker_name="getpid_worker", options=dict(value=i))
+        for i in range(4)
+    ]
+    try:
+        ended = run_pool(pool, tasks)
+    finally:
+        pool.abort_jobs()
+
+    assert all(e["status"] == TASK_STATUS_DONE for e in ended.values())
+    pids = [ended[str(i)]["output"][0] for i in range(4)]
+    assert [0, 1, 2, 3] == [ended[str(i)]["output"][1] for i in range(4)]
+    # Three tasks in the same process, then recycle.
+    assert pids[0] == pids[1] == pids[2]
+    assert pids[3] != pids[0]
+    assert os.getpid() not in pids
+
+
+def test_worker_pool_prefork_exit(mocker):
+    mocker.patch("temboardtoolkit.taskmanager.proctitle.set")
+    from temboardtoolkit.taskmanager import (
+        TASK_STATUS_DOING,
+        TASK_STATUS_DONE,
+        Empty,
+        Queue,
+        Task,
+        WorkerPool,
+        make_worker_definition,
+    )
+
+    class LateQueue:
+        # Output is flushed while worker exits, just after being polled.
+
+        def __init__(self, queue, process):
+            self.queue = queue
+            self.process = process
+
+        def get(self, block):
+            if self.process.is_alive():
+                self.process.join()
+                raise Empty()
+            return self.queue.get(block)
+
+        def close(self):
+            self.queue.close()
+
+    pool = WorkerPool(Queue(), Queue())
+    pool.max_tasks = 1
+    pool.add(make_worker_definition(getpid_worker, pool_size=1))
+    worker = pool.workers["getpid_worker"]
+    worker["queue"].appendleft(
+        Task(id="0", worker_name="getpid_worker", options=dict(value=0))
+    )
+    try:
+        pool.start_jobs()
+        (job,) = worker["pool"]
+        job["out"] = LateQueue(job["out"], job["process"])
+        while worker["pool"]:
+            pool.check_jobs()
+    finally:
+        pool.abort_jobs()
+
+    statuses = []
+    while not statuses or statuses[-1] == TASK_STATUS_DOING:
+        statuses.append(pool.event_queue.get(timeout=5).content["status"])
+    assert TASK_STATUS_DONE == statuses[-1]
+
+
+def test_worker_pool_fork(mocker):
+    mocker.patch("temboardtoolkit.taskmanager.proctitle.set")
+    from temboardtoolkit.taskmanager import (
+        TASK_STATUS_DONE,
+        Queue,
+        Task,
+        WorkerPool,
+        make_worker_definition,
+    )
+
+    pool = WorkerPool(Queue(), Queue())
+    pool.add(make_worker_definition(getpid_worker, pool_size=1))
+
+    tasks = [
+        Task(id=str(i), worker_name="getpid_worker", options=dict(value=i))
+        for i in range(2)
+    ]
+    ended = run_pool(pool, tasks)
+
+    assert all(e["status"] == TASK_STATUS_DONE for e in ended.values())
+    assert ended["0"]["output"][0] != ended["1"]["output"][0]
+
+
+def test_next_due():
+    from datetime import datetime
+
+    from temboardtoolkit.taskmanager import (
+        TASK_STATUS_DEFAULT,
+        TASK_STATUS_DOING,
+        TASK_STATUS_DONE,
+        Task,
+        epoch,
+        next_due,
+    )
+
+    start = datetime(2024, 1, 1)
+    stop = datetime(2024, 1, 1, 0, 1)
+    task = Task(start_datetime=start, status=TASK_STATUS_DEFAULT)
+    assert epoch(start) + 1 == next_due(task)
+
+    task = Task(start_datetime=start, status=TASK_STATUS_DOING, redo_interval=60)
+    assert next_due(task) is None
+
+    task.status = TASK_STATUS_DONE
+    assert epoch(start) + 61 == next_due(task)
+
+    task = Task(start_datetime=start, stop_datetime=stop, status=TASK_STATUS_DONE)
+    assert epoch(stop) + 3601 == next_due(task)
+
+
+def test_scheduler_due(mocker):
+    from datetime import datetime, timedelta
+    from queue import Queue
+
+    from temboardtoolkit.tasklist.sqlite3_engine import TaskListSQLite3Engine
+    from temboardtoolkit.taskmanager import TASK_STATUS_SCHEDULED, Scheduler, Task
+
+    scheduler = Scheduler(address=None, authkey=None)
+    scheduler.task_list_engine = TaskListSQLite3Engine(":memory:")
+    scheduler.task_queue = Queue()
+    scheduler.setup_task_list()
+    now = datetime.utcnow()
+    scheduler.task_list.push(
+        Task(id="past", worker_name="w", start_datetime=now - timedelta(seconds=5))
+    )
+    scheduler.task_list.push(
+        Task(id="future", worker_name="w", start_datetime=now + timedelta(hours=1))
+    )
+    mocker.patch("temboardtoolkit.taskmanager.Listener")
+    scheduler.setup()
+
+    assert ["past", "future"] == [id_ for _, id_ in sorted(scheduler.due)]
+    # Wake up right now for past task.
+    assert scheduler.next_wakeup() <= time.time()
+
+    scheduler.schedule()
+
+    task = scheduler.task_queue.get_nowait()
+    assert "past" == task.id
+    assert scheduler.task_queue.empty()
+    assert TASK_STATUS_SCHEDULED == scheduler.task_list.get("past").status
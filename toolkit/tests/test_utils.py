@@ -64,3 +64,22 @@ def test_ensure_str():
 
     assert type(ensure_str("toto")) is str
     assert type(ensure_str(b"toto")) is str
+
+
+def test_frames():
+    from io import BytesIO
+
+    import pytest
+    from temboardtoolkit import frames
+
+    blob = frames.compress(dict(a=1))
+    stream = BytesIO(frames.pack(b"I", blob) + frames.pack(b"P", frames.compress([])))
+
+    (kind, blob), (kind2, blob2) = frames.iter_frames(stream)
+    assert b"I" == kind
+    assert dict(a=1) == frames.decompress(blob)
+    assert b"P" == kind2
+    assert [] == frames.decompress(blob2)
+
+    with pytest.raises(ValueError):
+        list(frames.iter_frames(BytesIO(frames.pack(b"P", blob)[:-1])))
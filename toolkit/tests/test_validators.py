@@ -73,6 +73,18 @@ def test_commalist():
     assert ["a", "b"] == v.commalist("a,,b")
 
 
+def test_commaintdict():
+    assert {} == v.commaintdict("")
+    assert dict(a=1, b=20) == v.commaintdict("a=1, b = 20,")
+    assert dict(a=1) == v.commaintdict(dict(a=1))
+
+    with pytest.raises(ValueError):
+        v.commaintdict("a")
+
+    with pytest.raises(ValueError):
+        v.commaintdict("a=b")
+
+
 def test_loglevel():
     assert "DEBUG" == v.loglevel("DEBUG")
     assert "INFO" == v.loglevel("info")
@@ -115,6 +127,13 @@ def test_nday():
     assert type(v.nday("1")) is int
 
 
+def test_positive():
+    assert 8 == v.positive("8")
+
+    with pytest.raises(ValueError):
+        v.positive("0")
+
+
 def test_fqdn():
     valid_hostname = [
         "a",
@@ -407,6 +407,8 @@ def list_options_specs():
     )
     yield OptionSpec(s, "cookie_secret", validator=cookie_secret)
     yield OptionSpec(s, "cookie_timeout", default=84600, validator=int)
+    yield OptionSpec(s, "worker_max_tasks", default=100, validator=int)
+    yield OptionSpec(s, "worker_max_rss", default=256, validator=int)
     home = os.environ.get("HOME", "/var/lib/temboard")
     yield OptionSpec(s, "home", default=home, validator=v.writeabledir)
 
@@ -437,6 +439,7 @@ def list_options_specs():
 
     s = "statements"
     yield OptionSpec(s, "purge_after", default=7, validator=v.nday)
+    yield OptionSpec(s, "pull_concurrency", default=8, validator=v.positive)
 
 
 app = TemboardApplication(specs=list_options_specs())
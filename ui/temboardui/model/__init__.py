@@ -1,4 +1,5 @@
 import logging
+import os
 import sys
 from time import sleep
 
@@ -13,6 +14,7 @@ Session = sessionmaker(expire_on_commit=False)
 logger = logging.getLogger(__name__)
 # named queries, loaded with QUERIES.load() by temboardui.__main__.
 QUERIES = QueryFiler(__path__[0] + "/queries")
+_worker_engines = {}
 
 
 def format_dsn(dsn):
@@ -66,11 +68,17 @@ def check_connectivity(engine):
         raise Exception(msg % pgversion)
 
 
-def worker_engine(dbconf):
+def worker_engine(dbconf, **kw):
     """Create a new stand-alone SQLAlchemy engine to be instantiated in worker
     context.
+
+    Engines are reused by persistent worker processes, never across fork.
     """
-    return create_engine(format_dsn(dbconf))
+    key = (os.getpid(), format_dsn(dbconf), tuple(sorted(kw.items())))
+    engine = _worker_engines.get(key)
+    if engine is None:
+        engine = _worker_engines[key] = create_engine(format_dsn(dbconf), **kw)
+    return engine
 
 
 def check_schema():
@@ -431,6 +431,7 @@ class Instance(Model):
                 groups=types.ARRAY(types.UnicodeText),
                 plugins=types.ARRAY(types.UnicodeText),
                 available=types.Boolean,
+                last_seen=types.DateTime(timezone=True),
                 checks=postgresql.JSONB,
             )
         )
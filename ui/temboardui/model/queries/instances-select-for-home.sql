@@ -1,27 +1,3 @@
-WITH availability AS (
-	SELECT
-	  h.hostname AS hostname,
-	  i.port as pg_port,
-	  FIRST_VALUE(ia.available) OVER instance AS available
-	FROM monitoring.hosts AS h
-	JOIN monitoring.instances AS i ON i.host_id = h.host_id
-	JOIN monitoring.instance_availability AS ia ON ia.instance_id = i.instance_id
-	WINDOW instance AS (PARTITION BY h.hostname, i.port ORDER BY ia.datetime DESC)
-), alerts AS (
-	SELECT DISTINCT
-	    h.hostname,
-	    i.port AS pg_port,
-		checks.name,
-	    checks.description,
-	    FIRST_VALUE(monitoring.check_states.state) OVER states AS state,
-	    checks.check_id -- For window
-	FROM monitoring.check_states
-	JOIN monitoring.checks ON checks.check_id = check_states.check_id
-	JOIN monitoring.instances AS i ON i.instance_id = checks.instance_id
-	JOIN monitoring.hosts AS h ON h.host_id = i.host_id
-	WHERE check_states.state = 'WARNING' OR check_states.state = 'CRITICAL'
-	WINDOW states AS (PARTITION BY checks.check_id ORDER BY check_states.state DESC)
-)
 SELECT DISTINCT
   i.agent_address,
   i.agent_port,
@@ -31,10 +7,10 @@ SELECT DISTINCT
   i.discover->'postgres'->'data_directory' AS pg_data,
   i.discover->'postgres'->'version' AS pg_version,
   i.discover->'postgres'->'version_summary' AS pg_version_summary,
-  ia.available AS available,
+  s.available AS available,
+  s.last_seen AS last_seen,
   e.name AS environment,
-  COALESCE(jsonb_agg(DISTINCT jsonb_build_object('name', alerts.name, 'description', alerts.description, 'state', alerts.state))
-	  FILTER (WHERE alerts.name IS NOT NULL), '[]'::jsonb) AS checks,
+  COALESCE(s.checks, '[]'::jsonb) AS checks,
   -- Used by InstanceCard.vue in hasMonitoring
   array_agg(DISTINCT plugins.plugin_name) AS plugins
 FROM application.instances AS i
@@ -43,8 +19,9 @@ JOIN application.plugins
 JOIN application.environments AS e ON e.id = i.environment_id
 JOIN application.groups AS g ON g.id = e.dba_group_id
 JOIN application.memberships AS ms ON ms.group_id = g.id
-LEFT OUTER JOIN availability AS ia ON ia.hostname = i.hostname AND ia.pg_port = i.pg_port
-LEFT OUTER JOIN alerts ON alerts.hostname = i.hostname AND alerts.pg_port = i.pg_port
+LEFT OUTER JOIN monitoring.hosts AS h ON h.hostname = i.hostname
+LEFT OUTER JOIN monitoring.instances AS mi ON mi.host_id = h.host_id AND mi.port = i.pg_port
+LEFT OUTER JOIN monitoring.instance_summary AS s ON s.instance_id = mi.instance_id
 WHERE
   ms.role_name = :role_name
-GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11
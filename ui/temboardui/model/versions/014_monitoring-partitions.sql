@@ -0,0 +1,162 @@
+SET search_path TO monitoring, public;
+
+-- Partition metric_*_current tables by day on datetime.
+--
+-- Collector inserts in the partition of the day. Archiving moves closed
+-- partitions to metric_*_history and drops them, without locking the
+-- partition receiving points. Points out of any daily partition fall in
+-- metric_*_current_default, archived as a whole.
+
+CREATE OR REPLACE FUNCTION monitoring.partition_upper_bound(i_partition REGCLASS)
+RETURNS TIMESTAMP WITH TIME ZONE
+LANGUAGE sql
+STABLE
+AS $$
+  -- NULL for DEFAULT partition.
+  SELECT substring(pg_get_expr(relpartbound, oid) FROM 'TO \(''([^'']+)''\)')::TIMESTAMPTZ
+  FROM pg_catalog.pg_class
+  WHERE oid = i_partition;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.create_metric_partitions(table_name TEXT, i_days INTEGER DEFAULT 2)
+RETURNS TABLE(tblname TEXT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_table_current TEXT;
+  v_partition TEXT;
+  v_lower TIMESTAMP WITH TIME ZONE;
+  v_upper TIMESTAMP WITH TIME ZONE;
+BEGIN
+  -- Create daily partitions of metric_*_current from today to i_days ahead.
+  v_table_current := table_name || '_current';
+  SELECT max(monitoring.partition_upper_bound(inhrelid)) INTO v_lower
+  FROM pg_catalog.pg_inherits
+  WHERE inhparent = ('monitoring.' || v_table_current)::REGCLASS;
+  v_lower := greatest(v_lower, date_trunc('day', NOW()));
+
+  WHILE v_lower <= date_trunc('day', NOW()) + i_days * INTERVAL '1 day' LOOP
+    v_upper := v_lower + INTERVAL '1 day';
+    v_partition := v_table_current || '_' || to_char(v_lower, 'YYYYMMDD');
+    -- Attaching requires only a SHARE UPDATE EXCLUSIVE lock on parent, which
+    -- does not conflict with inserts.
+    EXECUTE format('CREATE TABLE monitoring.%I (LIKE monitoring.%I INCLUDING DEFAULTS)', v_partition, v_table_current);
+    -- Move points in advance from default partition, if any.
+    EXECUTE format(
+      'WITH moved AS (DELETE FROM monitoring.%I WHERE datetime >= %L AND datetime < %L RETURNING *) '
+      'INSERT INTO monitoring.%I SELECT * FROM moved',
+      v_table_current || '_default', v_lower, v_upper, v_partition
+    );
+    EXECUTE format(
+      'ALTER TABLE monitoring.%I ATTACH PARTITION monitoring.%I FOR VALUES FROM (%L) TO (%L)',
+      v_table_current, v_partition, v_lower, v_upper
+    );
+    RETURN QUERY SELECT v_partition;
+    v_lower := v_upper;
+  END LOOP;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.archive_current_metrics(table_name TEXT, record_type TEXT, query TEXT)
+RETURNS TABLE(tblname TEXT, nb_rows INTEGER)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_table_current TEXT;
+  v_table_history TEXT;
+  v_partition RECORD;
+  v_query TEXT;
+  v_lock_timeout TEXT;
+  i INTEGER;
+  v_total INTEGER := 0;
+BEGIN
+  v_table_current := table_name || '_current';
+  v_table_history := table_name || '_history';
+  v_lock_timeout := current_setting('lock_timeout');
+  -- Archive closed partitions and default partition.
+  FOR v_partition IN
+    SELECT c.relname, monitoring.partition_upper_bound(c.oid) IS NULL AS is_default
+    FROM pg_catalog.pg_inherits
+    JOIN pg_catalog.pg_class AS c ON c.oid = inhrelid
+    WHERE inhparent = ('monitoring.' || v_table_current)::REGCLASS
+      AND coalesce(monitoring.partition_upper_bound(c.oid) <= date_trunc('day', NOW()), TRUE)
+    ORDER BY 1
+  LOOP
+    BEGIN
+      -- Block late points for this partition only. Points of the day go
+      -- to another partition.
+      EXECUTE format('LOCK TABLE monitoring.%I IN SHARE MODE', v_partition.relname);
+      v_query := replace(query, '#history_table#', v_table_history);
+      v_query := replace(v_query, '#current_table#', quote_ident(v_partition.relname));
+      v_query := replace(v_query, '#record_type#', record_type);
+      -- Move data into _history table
+      EXECUTE v_query;
+      GET DIAGNOSTICS i = ROW_COUNT;
+      IF v_partition.is_default THEN
+        EXECUTE format('TRUNCATE monitoring.%I', v_partition.relname);
+      ELSE
+        -- Dropping a partition requires a short exclusive lock on parent.
+        -- Don't queue inserts behind us, retry on next run.
+        PERFORM set_config('lock_timeout', '1s', TRUE);
+        EXECUTE format('DROP TABLE monitoring.%I', v_partition.relname);
+        PERFORM set_config('lock_timeout', v_lock_timeout, TRUE);
+      END IF;
+      v_total := v_total + i;
+    EXCEPTION WHEN lock_not_available THEN
+      RAISE NOTICE 'Partition % is busy. Archiving postponed.', v_partition.relname;
+    END;
+  END LOOP;
+  -- Return history table name and the number of rows inserted
+  RETURN QUERY SELECT v_table_history, v_total;
+END;
+$$;
+
+
+-- Swap each metric_*_current table with a partitioned table. Existing table
+-- becomes the partition of the days it holds, without copying rows. It is
+-- archived like any other closed partition.
+DO $$
+DECLARE
+  t JSON;
+  c JSON;
+  v_table_current TEXT;
+  v_table_legacy TEXT;
+  v_create_tbl_cols TEXT;
+  v_create_idx_cols TEXT;
+  v_upper TIMESTAMP WITH TIME ZONE;
+BEGIN
+  FOR t IN SELECT value FROM json_each(monitoring.metric_tables_config()) LOOP
+    v_table_current := (t->>'name') || '_current';
+    v_table_legacy := v_table_current || '_legacy';
+    v_create_tbl_cols := 'datetime TIMESTAMPTZ NOT NULL';
+    v_create_idx_cols := 'datetime';
+    FOR c IN SELECT json_array_elements(t->'columns') LOOP
+      v_create_tbl_cols := v_create_tbl_cols || ', ' || (c->>'name') || ' ' || (c->>'data_type');
+      v_create_idx_cols := v_create_idx_cols || ', ' || (c->>'name');
+    END LOOP;
+
+    EXECUTE format('ALTER TABLE monitoring.%I RENAME TO %I', v_table_current, v_table_legacy);
+    EXECUTE format('ALTER INDEX monitoring.%I RENAME TO %I', 'idx_' || v_table_current, 'idx_' || v_table_legacy);
+    EXECUTE format(
+      'CREATE TABLE monitoring.%I (%s, record %s) PARTITION BY RANGE (datetime)',
+      v_table_current, v_create_tbl_cols, t->>'record_type'
+    );
+    EXECUTE format('CREATE INDEX %I ON monitoring.%I (%s)', 'idx_' || v_table_current, v_table_current, v_create_idx_cols);
+
+    EXECUTE format(
+      'SELECT greatest(date_trunc(''day'', max(datetime)), date_trunc(''day'', NOW())) + INTERVAL ''1 day'' FROM monitoring.%I',
+      v_table_legacy
+    ) INTO v_upper;
+    EXECUTE format(
+      'ALTER TABLE monitoring.%I ATTACH PARTITION monitoring.%I FOR VALUES FROM (MINVALUE) TO (%L)',
+      v_table_current, v_table_legacy, v_upper
+    );
+    EXECUTE format('CREATE TABLE monitoring.%I PARTITION OF monitoring.%I DEFAULT', v_table_current || '_default', v_table_current);
+    PERFORM monitoring.create_metric_partitions(t->>'name');
+  END LOOP;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
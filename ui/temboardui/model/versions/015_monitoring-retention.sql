@@ -0,0 +1,170 @@
+SET search_path TO monitoring, public;
+
+-- Partition metric_*_history and aggregate tables by month. Retention drops
+-- whole partitions instead of deleting rows.
+
+CREATE OR REPLACE FUNCTION monitoring.create_partitions(i_parent TEXT, i_unit TEXT, i_ahead INTEGER)
+RETURNS TABLE(tblname TEXT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_key TEXT;
+  v_step INTERVAL;
+  v_partition TEXT;
+  v_lower TIMESTAMP WITH TIME ZONE;
+  v_upper TIMESTAMP WITH TIME ZONE;
+BEGIN
+  -- Create partitions of i_parent by i_unit, day or month, from now to
+  -- i_ahead units ahead.
+  v_key := substring(pg_get_partkeydef(('monitoring.' || i_parent)::REGCLASS) FROM '^RANGE \((.*)\)$');
+  v_step := ('1 ' || i_unit)::INTERVAL;
+  SELECT max(monitoring.partition_upper_bound(inhrelid)) INTO v_lower
+  FROM pg_catalog.pg_inherits
+  WHERE inhparent = ('monitoring.' || i_parent)::REGCLASS;
+  v_lower := greatest(v_lower, date_trunc(i_unit, NOW()));
+
+  WHILE v_lower <= date_trunc(i_unit, NOW()) + i_ahead * v_step LOOP
+    v_upper := v_lower + v_step;
+    v_partition := i_parent || '_' || to_char(v_lower, CASE i_unit WHEN 'day' THEN 'YYYYMMDD' ELSE 'YYYYMM' END);
+    -- Attaching requires only a SHARE UPDATE EXCLUSIVE lock on parent, which
+    -- does not conflict with inserts.
+    EXECUTE format('CREATE TABLE monitoring.%I (LIKE monitoring.%I INCLUDING DEFAULTS)', v_partition, i_parent);
+    -- Move points in advance from default partition, if any.
+    IF to_regclass('monitoring.' || i_parent || '_default') IS NOT NULL THEN
+      EXECUTE format(
+        'WITH moved AS (DELETE FROM monitoring.%I WHERE %s >= %L AND %s < %L RETURNING *) '
+        'INSERT INTO monitoring.%I SELECT * FROM moved',
+        i_parent || '_default', v_key, v_lower, v_key, v_upper, v_partition
+      );
+    END IF;
+    EXECUTE format(
+      'ALTER TABLE monitoring.%I ATTACH PARTITION monitoring.%I FOR VALUES FROM (%L) TO (%L)',
+      i_parent, v_partition, v_lower, v_upper
+    );
+    RETURN QUERY SELECT v_partition;
+    v_lower := v_upper;
+  END LOOP;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.create_metric_partitions(table_name TEXT, i_days INTEGER DEFAULT 2)
+RETURNS TABLE(tblname TEXT)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  -- Daily partitions for points, monthly partitions for archives and
+  -- aggregates.
+  RETURN QUERY SELECT * FROM monitoring.create_partitions(table_name || '_current', 'day', i_days);
+  RETURN QUERY SELECT * FROM monitoring.create_partitions(table_name || '_history', 'month', 1);
+  RETURN QUERY SELECT * FROM monitoring.create_partitions(table_name || '_30m_current', 'month', 1);
+  RETURN QUERY SELECT * FROM monitoring.create_partitions(table_name || '_6h_current', 'month', 1);
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.purge_partitions(i_parent TEXT, i_before TIMESTAMP WITH TIME ZONE, i_dry_run BOOLEAN DEFAULT FALSE)
+RETURNS TABLE(tblname TEXT, nb_bytes BIGINT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_partition RECORD;
+  v_lock_timeout TEXT;
+BEGIN
+  -- Drop partitions of i_parent holding only data before i_before. Returns
+  -- dropped partitions and their size. With i_dry_run, drop nothing.
+  v_lock_timeout := current_setting('lock_timeout');
+  FOR v_partition IN
+    SELECT c.relname, pg_total_relation_size(c.oid) AS size
+    FROM pg_catalog.pg_inherits
+    JOIN pg_catalog.pg_class AS c ON c.oid = inhrelid
+    WHERE inhparent = ('monitoring.' || i_parent)::REGCLASS
+      AND monitoring.partition_upper_bound(c.oid) <= i_before
+    ORDER BY 1
+  LOOP
+    IF NOT i_dry_run THEN
+      BEGIN
+        -- Dropping a partition requires a short exclusive lock on parent.
+        -- Don't queue inserts behind us, retry on next run.
+        PERFORM set_config('lock_timeout', '1s', TRUE);
+        EXECUTE format('DROP TABLE monitoring.%I', v_partition.relname);
+        PERFORM set_config('lock_timeout', v_lock_timeout, TRUE);
+      EXCEPTION WHEN lock_not_available THEN
+        RAISE NOTICE 'Partition % is busy. Purge postponed.', v_partition.relname;
+        CONTINUE;
+      END;
+    END IF;
+    RETURN QUERY SELECT v_partition.relname::TEXT, v_partition.size;
+  END LOOP;
+END;
+$$;
+
+
+-- Swap metric_*_history, metric_*_30m_current and metric_*_6h_current tables
+-- with partitioned tables. Existing table becomes the partition of the months
+-- it holds, without copying rows. Purge deletes rows from it until it
+-- expires.
+DO $$
+DECLARE
+  t JSON;
+  c JSON;
+  v_parent TEXT;
+  v_legacy TEXT;
+  v_cols TEXT;
+  v_create_tbl_cols TEXT;
+  v_upper TIMESTAMP WITH TIME ZONE;
+  i_period TEXT;
+BEGIN
+  FOR t IN SELECT value FROM json_each(monitoring.metric_tables_config()) LOOP
+    v_cols := '';
+    v_create_tbl_cols := 'history_range TSTZRANGE NOT NULL';
+    FOR c IN SELECT json_array_elements(t->'columns') LOOP
+      v_cols := v_cols || ', ' || (c->>'name');
+      v_create_tbl_cols := v_create_tbl_cols || ', ' || (c->>'name') || ' ' || (c->>'data_type');
+    END LOOP;
+
+    v_parent := (t->>'name') || '_history';
+    v_legacy := v_parent || '_legacy';
+    EXECUTE format('ALTER TABLE monitoring.%I RENAME TO %I', v_parent, v_legacy);
+    EXECUTE format('ALTER INDEX monitoring.%I RENAME TO %I', 'idx_' || v_parent, 'idx_' || v_legacy);
+    EXECUTE format(
+      'CREATE TABLE monitoring.%I (%s, records %s[]) PARTITION BY RANGE ((lower(history_range)))',
+      v_parent, v_create_tbl_cols, t->>'record_type'
+    );
+    EXECUTE format('CREATE INDEX %I ON monitoring.%I (history_range%s)', 'idx_' || v_parent, v_parent, v_cols);
+    EXECUTE format(
+      'SELECT greatest(date_trunc(''month'', max(lower(history_range))), date_trunc(''month'', NOW())) + INTERVAL ''1 month'' FROM monitoring.%I',
+      v_legacy
+    ) INTO v_upper;
+    EXECUTE format(
+      'ALTER TABLE monitoring.%I ATTACH PARTITION monitoring.%I FOR VALUES FROM (MINVALUE) TO (%L)',
+      v_parent, v_legacy, v_upper
+    );
+    EXECUTE format('CREATE TABLE monitoring.%I PARTITION OF monitoring.%I DEFAULT', v_parent || '_default', v_parent);
+
+    FOREACH i_period IN ARRAY array['30m', '6h'] LOOP
+      v_parent := (t->>'name') || '_' || i_period || '_current';
+      v_legacy := v_parent || '_legacy';
+      EXECUTE format('ALTER TABLE monitoring.%I RENAME TO %I', v_parent, v_legacy);
+      EXECUTE format(
+        'CREATE TABLE monitoring.%I (LIKE monitoring.%I INCLUDING DEFAULTS) PARTITION BY RANGE (datetime)',
+        v_parent, v_legacy
+      );
+      EXECUTE format('ALTER TABLE monitoring.%I ADD UNIQUE (datetime%s)', v_parent, v_cols);
+      EXECUTE format(
+        'SELECT greatest(date_trunc(''month'', max(datetime)), date_trunc(''month'', NOW())) + INTERVAL ''1 month'' FROM monitoring.%I',
+        v_legacy
+      ) INTO v_upper;
+      EXECUTE format(
+        'ALTER TABLE monitoring.%I ATTACH PARTITION monitoring.%I FOR VALUES FROM (MINVALUE) TO (%L)',
+        v_parent, v_legacy, v_upper
+      );
+      EXECUTE format('CREATE TABLE monitoring.%I PARTITION OF monitoring.%I DEFAULT', v_parent || '_default', v_parent);
+    END LOOP;
+
+    PERFORM monitoring.create_metric_partitions(t->>'name');
+  END LOOP;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
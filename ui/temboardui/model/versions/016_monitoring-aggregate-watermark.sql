@@ -0,0 +1,120 @@
+SET search_path TO monitoring, public;
+
+-- Aggregate metrics incrementally.
+--
+-- aggregate_watermarks stores the last bucket aggregated per metric table and
+-- period. Collector flags in aggregate_late_points points older than
+-- watermark. Aggregation recomputes buckets of late points and buckets after
+-- watermark only.
+
+CREATE TABLE monitoring.aggregate_watermarks (
+  tablename TEXT NOT NULL,
+  period TEXT NOT NULL,
+  bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+  PRIMARY KEY (tablename, period)
+);
+
+CREATE TABLE monitoring.aggregate_late_points (
+  tablename TEXT NOT NULL,
+  datetime TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Start from last bucket of existing aggregates.
+DO $$
+DECLARE
+  v_name TEXT;
+  i_period TEXT;
+BEGIN
+  FOR v_name IN SELECT json_object_keys(monitoring.metric_tables_config()) LOOP
+    FOREACH i_period IN ARRAY array['30m', '6h'] LOOP
+      EXECUTE format(
+        'INSERT INTO monitoring.aggregate_watermarks (tablename, period, bucket) '
+        'SELECT %L, %L, max(datetime) FROM monitoring.%I HAVING max(datetime) IS NOT NULL',
+        v_name, i_period, v_name || '_' || i_period || '_current'
+      );
+    END LOOP;
+  END LOOP;
+END;
+$$;
+
+
+DROP FUNCTION monitoring.aggregate_data_single(TEXT, TEXT, TEXT);
+
+CREATE FUNCTION monitoring.aggregate_data_single(table_name TEXT, record_type TEXT, query TEXT)
+RETURNS TABLE(tblname TEXT, nb_rows INTEGER, nb_points BIGINT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_agg_periods TEXT[] := array['30m', '6h'];
+  v_agg_table TEXT;
+  i_period TEXT;
+  v_query TEXT;
+  v_watermark TIMESTAMP WITH TIME ZONE;
+  v_late TIMESTAMP WITH TIME ZONE[];
+  v_bucket TIMESTAMP WITH TIME ZONE;
+  v_range TSTZRANGE;
+  v_rows INTEGER;
+  v_points BIGINT;
+  i INTEGER;
+  n BIGINT;
+BEGIN
+  -- Consume points flagged late by collector.
+  WITH consumed AS (
+    DELETE FROM monitoring.aggregate_late_points
+    WHERE tablename = table_name
+    RETURNING datetime
+  )
+  SELECT array_agg(datetime) INTO v_late FROM consumed;
+
+  FOREACH i_period IN ARRAY v_agg_periods LOOP
+    v_agg_table := table_name || '_' || i_period || '_current';
+    -- Expand the range given by caller instead of everything since last
+    -- aggregated bucket. Count buckets and points written.
+    v_query := replace(query, '(SELECT tstzrange(MAX(datetime), NOW()) FROM #agg_table#)', '#range#');
+    v_query := replace(v_query, '#agg_table#', v_agg_table);
+    v_query := replace(v_query, '#interval#', i_period);
+    v_query := replace(v_query, '#record_type#', record_type);
+    v_query := replace(v_query, '#name#', table_name);
+    v_query := 'WITH upserted AS (' || v_query || ' RETURNING w) SELECT count(*), coalesce(sum(w), 0) FROM upserted';
+    v_rows := 0;
+    v_points := 0;
+
+    SELECT bucket INTO v_watermark
+    FROM monitoring.aggregate_watermarks
+    WHERE tablename = table_name AND period = i_period;
+
+    -- Recompute buckets of late points.
+    FOR v_bucket IN
+      SELECT DISTINCT truncate_time(d, i_period::INTERVAL)
+      FROM unnest(v_late) AS d
+      WHERE d < v_watermark
+      ORDER BY 1
+    LOOP
+      v_range := tstzrange(v_bucket, v_bucket + i_period::INTERVAL);
+      EXECUTE replace(v_query, '#range#', quote_literal(v_range) || '::TSTZRANGE') INTO i, n;
+      v_rows := v_rows + i;
+      v_points := v_points + n;
+    END LOOP;
+
+    -- Aggregate new buckets, from last aggregated bucket which may be
+    -- incomplete.
+    v_range := tstzrange(v_watermark, NOW());
+    EXECUTE replace(v_query, '#range#', quote_literal(v_range) || '::TSTZRANGE') INTO i, n;
+    v_rows := v_rows + i;
+    v_points := v_points + n;
+
+    EXECUTE format('SELECT max(datetime) FROM %I WHERE datetime >= %L', v_agg_table, coalesce(v_watermark, '-infinity'))
+    INTO v_bucket;
+    IF v_bucket IS NOT NULL THEN
+      INSERT INTO monitoring.aggregate_watermarks (tablename, period, bucket)
+      VALUES (table_name, i_period, v_bucket)
+      ON CONFLICT (tablename, period) DO UPDATE SET bucket = EXCLUDED.bucket;
+    END IF;
+
+    RETURN QUERY SELECT v_agg_table, v_rows, v_points;
+  END LOOP;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
+GRANT ALL ON ALL TABLES IN SCHEMA monitoring TO temboard;
@@ -0,0 +1,246 @@
+SET search_path TO monitoring, public;
+
+-- Aggregate metrics in a ladder of tiers: 5m, 30m, 1h, 6h and 1d.
+--
+-- Tier tables are named metric_*_<period>_current. aggregate_watermarks.since
+-- tells from when a tier holds aggregates, for charts to choose a tier
+-- covering the requested range.
+
+ALTER TABLE monitoring.aggregate_watermarks ADD COLUMN since TIMESTAMP WITH TIME ZONE;
+
+DO $$
+DECLARE
+  v_name TEXT;
+  i_period TEXT;
+BEGIN
+  FOR v_name IN SELECT json_object_keys(monitoring.metric_tables_config()) LOOP
+    FOREACH i_period IN ARRAY array['30m', '6h'] LOOP
+      EXECUTE format(
+        'UPDATE monitoring.aggregate_watermarks SET since = (SELECT min(datetime) FROM monitoring.%I) '
+        'WHERE tablename = %L AND period = %L',
+        v_name || '_' || i_period || '_current', v_name, i_period
+      );
+    END LOOP;
+  END LOOP;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.range_bounds(i_expr TEXT, i_range TSTZRANGE, i_margin INTERVAL DEFAULT '0')
+RETURNS TEXT
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+  v_where TEXT := '';
+BEGIN
+  -- Translate range in btree comparisons on i_expr, for index scan and
+  -- partition pruning. Bounds are inclusive, filter with range for exact
+  -- result.
+  IF NOT lower_inf(i_range) THEN
+    v_where := v_where || ' AND ' || i_expr || ' >= ' || quote_literal(lower(i_range) - i_margin) || '::TIMESTAMPTZ';
+  END IF;
+  IF NOT upper_inf(i_range) THEN
+    v_where := v_where || ' AND ' || i_expr || ' <= ' || quote_literal(upper(i_range)) || '::TIMESTAMPTZ';
+  END IF;
+  RETURN v_where;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.build_expand_data_query(i_name TEXT, i_range TSTZRANGE) RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+
+DECLARE
+  t JSON;
+  v_query TEXT;
+  v_table_current TEXT;
+  v_table_history TEXT;
+BEGIN
+  -- Build and execute 'expand' query
+  SELECT metric_tables_config()->i_name INTO t;
+  v_query := t->>'expand';
+  v_table_current := trim((t->'name')::TEXT, '"')||'_current';
+  v_table_history := trim((t->'name')::TEXT, '"')||'_history';
+  v_query := replace(v_query, '#history_table#', v_table_history);
+  v_query := replace(v_query, '#current_table#', v_table_current);
+  v_query := replace(v_query, '#record_type#', trim((t->'record_type')::TEXT, '"'));
+  v_query := replace(v_query, '#where_current#', 'datetime <@ '''||i_range::TEXT||'''::TSTZRANGE'||monitoring.range_bounds('datetime', i_range));
+  -- Archives are grouped by day.
+  v_query := replace(v_query, '#where_history#', 'history_range && '''||i_range::TEXT||'''::TSTZRANGE'||monitoring.range_bounds('lower(history_range)', i_range, '1 day'));
+  v_query := replace(v_query, '#tstzrange#', ''''||i_range::TEXT||'''::TSTZRANGE');
+  RETURN v_query;
+END;
+
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.create_aggregate_table(table_name TEXT, i_period TEXT)
+RETURNS TABLE(tblname TEXT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  t JSON;
+  c JSON;
+  v_tablename TEXT;
+  v_cols TEXT := 'datetime';
+BEGIN
+  -- Create aggregate table of tier i_period, if missing.
+  v_tablename := table_name || '_' || i_period || '_current';
+  IF to_regclass('monitoring.' || v_tablename) IS NOT NULL THEN
+    RETURN;
+  END IF;
+
+  SELECT monitoring.metric_tables_config()->table_name INTO t;
+  FOR c IN SELECT json_array_elements(t->'columns') LOOP
+    v_cols := v_cols || ', ' || (c->>'name');
+  END LOOP;
+
+  EXECUTE format(
+    'CREATE TABLE monitoring.%I (LIKE monitoring.%I INCLUDING DEFAULTS) PARTITION BY RANGE (datetime)',
+    v_tablename, table_name || '_30m_current'
+  );
+  EXECUTE format('ALTER TABLE monitoring.%I ADD UNIQUE (%s)', v_tablename, v_cols);
+  EXECUTE format('CREATE TABLE monitoring.%I PARTITION OF monitoring.%I DEFAULT', v_tablename || '_default', v_tablename);
+  RETURN QUERY SELECT v_tablename;
+  RETURN QUERY SELECT * FROM monitoring.create_partitions(v_tablename, 'month', 1);
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.create_metric_partitions(table_name TEXT, i_days INTEGER DEFAULT 2)
+RETURNS TABLE(tblname TEXT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_tablename TEXT;
+BEGIN
+  -- Daily partitions for points, monthly partitions for archives and
+  -- aggregates of each tier.
+  RETURN QUERY SELECT * FROM monitoring.create_partitions(table_name || '_current', 'day', i_days);
+  RETURN QUERY SELECT * FROM monitoring.create_partitions(table_name || '_history', 'month', 1);
+  FOR v_tablename IN
+    SELECT relname
+    FROM pg_catalog.pg_class
+    WHERE relnamespace = 'monitoring'::REGNAMESPACE
+      AND relkind = 'p'
+      AND relname ~ ('^' || table_name || '_[0-9]+[mhd]_current$')
+    ORDER BY 1
+  LOOP
+    RETURN QUERY SELECT * FROM monitoring.create_partitions(v_tablename, 'month', 1);
+  END LOOP;
+END;
+$$;
+
+
+DROP FUNCTION monitoring.aggregate_data_single(TEXT, TEXT, TEXT);
+
+CREATE FUNCTION monitoring.aggregate_data_single(table_name TEXT, record_type TEXT, query TEXT, i_periods TEXT[], i_max_buckets INTEGER DEFAULT 1000)
+RETURNS TABLE(tblname TEXT, nb_rows INTEGER, nb_points BIGINT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_agg_table TEXT;
+  i_period TEXT;
+  v_query TEXT;
+  v_watermark TIMESTAMP WITH TIME ZONE;
+  v_since TIMESTAMP WITH TIME ZONE;
+  v_late TIMESTAMP WITH TIME ZONE[];
+  v_bucket TIMESTAMP WITH TIME ZONE;
+  v_end TIMESTAMP WITH TIME ZONE;
+  v_buckets INTEGER;
+  v_rows INTEGER;
+  v_points BIGINT;
+  i INTEGER;
+  n BIGINT;
+BEGIN
+  -- Consume points flagged late by collector.
+  WITH consumed AS (
+    DELETE FROM monitoring.aggregate_late_points
+    WHERE tablename = table_name
+    RETURNING datetime
+  )
+  SELECT array_agg(datetime) INTO v_late FROM consumed;
+
+  FOREACH i_period IN ARRAY i_periods LOOP
+    PERFORM monitoring.create_aggregate_table(table_name, i_period);
+    v_agg_table := table_name || '_' || i_period || '_current';
+    -- Expand one bucket at a time instead of everything since last
+    -- aggregated bucket. Count buckets and points written.
+    v_query := replace(query, 'expand_data_limit(''#name#'', (SELECT tstzrange(MAX(datetime), NOW()) FROM #agg_table#), 100000)', 'expand_data(''#name#'', #range#)');
+    v_query := replace(v_query, '#agg_table#', v_agg_table);
+    v_query := replace(v_query, '#interval#', i_period);
+    v_query := replace(v_query, '#record_type#', record_type);
+    v_query := replace(v_query, '#name#', table_name);
+    v_query := 'WITH upserted AS (' || v_query || ' RETURNING w) SELECT count(*), coalesce(sum(w), 0) FROM upserted';
+    v_rows := 0;
+    v_points := 0;
+
+    SELECT bucket, since INTO v_watermark, v_since
+    FROM monitoring.aggregate_watermarks
+    WHERE tablename = table_name AND period = i_period;
+
+    -- Recompute buckets of late points.
+    FOR v_bucket IN
+      SELECT DISTINCT truncate_time(d, i_period::INTERVAL)
+      FROM unnest(v_late) AS d
+      WHERE d < v_watermark
+      ORDER BY 1
+    LOOP
+      EXECUTE replace(v_query, '#range#', quote_literal(tstzrange(v_bucket, v_bucket + i_period::INTERVAL)) || '::TSTZRANGE') INTO i, n;
+      v_rows := v_rows + i;
+      v_points := v_points + n;
+    END LOOP;
+
+    -- Aggregate new buckets, from last aggregated bucket which may be
+    -- incomplete. A new tier starts from oldest point not archived.
+    IF v_watermark IS NULL THEN
+      EXECUTE format('SELECT min(datetime) FROM %I', table_name || '_current') INTO v_bucket;
+      v_bucket := truncate_time(coalesce(v_bucket, NOW()), i_period::INTERVAL);
+      v_since := v_bucket;
+    ELSE
+      v_bucket := v_watermark;
+    END IF;
+    v_end := truncate_time(NOW(), i_period::INTERVAL);
+    v_buckets := 0;
+    WHILE v_bucket < v_end AND v_buckets < i_max_buckets LOOP
+      EXECUTE replace(v_query, '#range#', quote_literal(tstzrange(v_bucket, v_bucket + i_period::INTERVAL)) || '::TSTZRANGE') INTO i, n;
+      v_rows := v_rows + i;
+      v_points := v_points + n;
+      v_watermark := v_bucket;
+      v_bucket := v_bucket + i_period::INTERVAL;
+      v_buckets := v_buckets + 1;
+    END LOOP;
+
+    IF v_watermark IS NOT NULL THEN
+      INSERT INTO monitoring.aggregate_watermarks (tablename, period, bucket, since)
+      VALUES (table_name, i_period, v_watermark, v_since)
+      ON CONFLICT (tablename, period) DO UPDATE SET bucket = EXCLUDED.bucket;
+    END IF;
+
+    RETURN QUERY SELECT v_agg_table, v_rows, v_points;
+  END LOOP;
+
+  -- Forget tiers not aggregated anymore.
+  DELETE FROM monitoring.aggregate_watermarks
+  WHERE tablename = table_name AND NOT period = ANY(i_periods);
+END;
+$$;
+
+
+DO $$
+DECLARE
+  v_name TEXT;
+  i_period TEXT;
+BEGIN
+  FOR v_name IN SELECT json_object_keys(monitoring.metric_tables_config()) LOOP
+    FOREACH i_period IN ARRAY array['5m', '1h', '1d'] LOOP
+      PERFORM monitoring.create_aggregate_table(v_name, i_period);
+    END LOOP;
+  END LOOP;
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
+GRANT ALL ON ALL TABLES IN SCHEMA monitoring TO temboard;
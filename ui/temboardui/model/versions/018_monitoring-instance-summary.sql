@@ -0,0 +1,83 @@
+SET search_path TO monitoring, public;
+
+-- Summary of availability and alerts per instance, for home page.
+--
+-- insert_instance_availability() maintains availability and last point
+-- datetime. Alerting refreshes checks in WARNING or CRITICAL state after each
+-- evaluation. Home page reads one row per instance, whatever the history
+-- length.
+
+CREATE TABLE monitoring.instance_summary (
+  instance_id INTEGER PRIMARY KEY REFERENCES monitoring.instances(instance_id) ON DELETE CASCADE,
+  available BOOLEAN,
+  last_seen TIMESTAMP WITH TIME ZONE,
+  warning INTEGER NOT NULL DEFAULT 0,
+  critical INTEGER NOT NULL DEFAULT 0,
+  -- Checks in WARNING or CRITICAL state, as name, description and state.
+  checks JSONB NOT NULL DEFAULT '[]'
+);
+
+
+CREATE OR REPLACE FUNCTION monitoring.insert_instance_availability(i_tstz TIMESTAMP WITH TIME ZONE, i_instance_id INTEGER, i_available BOOLEAN)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  s_available BOOLEAN;
+BEGIN
+  SELECT available::BOOLEAN FROM monitoring.instance_availability
+  WHERE instance_id = i_instance_id
+  ORDER BY datetime desc LIMIT 1 INTO s_available;
+  IF s_available IS NULL OR i_available <> s_available THEN
+    INSERT INTO monitoring.instance_availability (datetime, instance_id, available)
+    VALUES (i_tstz, i_instance_id, i_available);
+  END IF;
+
+  INSERT INTO monitoring.instance_summary AS s (instance_id, available, last_seen)
+  VALUES (i_instance_id, i_available, i_tstz)
+  ON CONFLICT (instance_id) DO UPDATE
+  SET available = EXCLUDED.available, last_seen = EXCLUDED.last_seen
+  WHERE s.last_seen IS NULL OR s.last_seen <= EXCLUDED.last_seen;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION monitoring.refresh_instance_checks(i_instance_id INTEGER)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+  -- Summarize most severe state of checks in alert, across keys.
+  WITH alerts AS (
+    SELECT c.name, c.description, max(cs.state) AS state
+    FROM monitoring.check_states AS cs
+    JOIN monitoring.checks AS c ON c.check_id = cs.check_id
+    WHERE c.instance_id = i_instance_id AND cs.state IN ('WARNING', 'CRITICAL')
+    GROUP BY c.check_id, c.name, c.description
+  )
+  INSERT INTO monitoring.instance_summary (instance_id, warning, critical, checks)
+  SELECT
+    i_instance_id,
+    count(*) FILTER (WHERE state = 'WARNING'),
+    count(*) FILTER (WHERE state = 'CRITICAL'),
+    COALESCE(jsonb_agg(jsonb_build_object('name', name, 'description', description, 'state', state)), '[]')
+  FROM alerts
+  ON CONFLICT (instance_id) DO UPDATE
+  SET warning = EXCLUDED.warning, critical = EXCLUDED.critical, checks = EXCLUDED.checks;
+$$;
+
+
+-- Initialize summary from history.
+INSERT INTO monitoring.instance_summary (instance_id, available, last_seen)
+SELECT i.instance_id, ia.available, cs.last_insert AT TIME ZONE 'UTC'
+FROM monitoring.instances AS i
+LEFT OUTER JOIN monitoring.collector_status AS cs ON cs.instance_id = i.instance_id
+LEFT OUTER JOIN LATERAL (
+  SELECT available FROM monitoring.instance_availability
+  WHERE instance_id = i.instance_id
+  ORDER BY datetime DESC LIMIT 1
+) AS ia ON TRUE;
+
+SELECT monitoring.refresh_instance_checks(instance_id) FROM monitoring.instances;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
+GRANT ALL ON ALL TABLES IN SCHEMA monitoring TO temboard;
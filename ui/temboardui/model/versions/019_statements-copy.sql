@@ -0,0 +1,129 @@
+SET search_path TO statements, public;
+
+-- Ingest statements snapshots with COPY.
+--
+-- UI sends back to agent the cursor of last snapshot stored in metas. Agent
+-- returns only entries changed since cursor, with query text of new entries
+-- only, and totals by database computed on all entries. UI copies entries in
+-- statements_src_tmp and totals in statements_src_db_tmp.
+
+ALTER TABLE metas ADD COLUMN cursor TEXT;
+
+ALTER TABLE statements_src_tmp ALTER COLUMN query DROP NOT NULL;
+
+CREATE UNLOGGED TABLE statements_src_db_tmp (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  ts  TIMESTAMP WITH TIME ZONE NOT NULL,
+  dbid oid NOT NULL,
+  datname TEXT NOT NULL,
+  calls BIGINT NOT NULL,
+  total_exec_time DOUBLE PRECISION NOT NULL,
+  rows BIGINT NOT NULL,
+  shared_blks_hit BIGINT NOT NULL,
+  shared_blks_read BIGINT NOT NULL,
+  shared_blks_dirtied BIGINT NOT NULL,
+  shared_blks_written BIGINT NOT NULL,
+  local_blks_hit BIGINT NOT NULL,
+  local_blks_read BIGINT NOT NULL,
+  local_blks_dirtied BIGINT NOT NULL,
+  local_blks_written BIGINT NOT NULL,
+  temp_blks_read BIGINT NOT NULL,
+  temp_blks_written BIGINT NOT NULL,
+  blk_read_time DOUBLE PRECISION NOT NULL,
+  blk_write_time DOUBLE PRECISION NOT NULL,
+  total_plan_time DOUBLE PRECISION,
+  wal_records BIGINT,
+  wal_fpi BIGINT,
+  wal_bytes NUMERIC
+);
+
+
+DROP FUNCTION process_statements(text, integer);
+
+CREATE FUNCTION process_statements(_address text, _port integer, _cursor text DEFAULT NULL) RETURNS void AS $PROC$
+DECLARE
+    v_missing     bigint;
+    v_coalesce    integer := 100;
+    agg_seq  bigint;
+BEGIN
+    -- In this function, we process statements that have just been copied
+    -- from agent snapshot, and totals by database.
+
+    -- Create new meta for agent if doesn't already exist
+    INSERT INTO metas (agent_address, agent_port) VALUES (_address, _port)
+    ON CONFLICT DO NOTHING;
+
+    PERFORM prevent_concurrent_snapshot(_address, _port);
+
+    -- Update meta with info from the current proccess (snapshot)
+    UPDATE metas
+    SET coalesce_seq = coalesce_seq + 1,
+        snapts = now(),
+        cursor = _cursor,
+        error = NULL
+    WHERE agent_address = _address AND agent_port = _port
+    RETURNING coalesce_seq INTO agg_seq;
+
+    -- Store text of new statements before history references them.
+    INSERT INTO statements (agent_address, agent_port, queryid, query, dbid, datname, userid, rolname)
+    SELECT _address, _port, queryid, query, dbid, datname, userid, rolname
+    FROM statements_src_tmp
+    WHERE agent_address = _address AND agent_port = _port AND query IS NOT NULL
+    ON CONFLICT DO NOTHING;
+
+    WITH capture AS (
+        SELECT src.*
+        FROM statements_src_tmp AS src
+        JOIN statements AS s USING (agent_address, agent_port, queryid, dbid, userid)
+        WHERE src.agent_address = _address AND src.agent_port = _port
+    ),
+
+    by_query AS (
+        INSERT INTO statements_history_current
+            SELECT _address, _port, queryid, dbid, userid,
+            ROW(
+                ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+                shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+                local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+                blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes
+            )::statements_history_record
+            FROM capture
+            RETURNING 1
+    ),
+
+    by_database AS (
+        INSERT INTO statements_history_current_db
+            SELECT _address, _port, dbid, datname,
+            ROW(
+                ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+                shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+                local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+                blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes
+            )::statements_history_record
+            FROM statements_src_db_tmp
+            WHERE agent_address = _address AND agent_port = _port
+    )
+
+    SELECT (SELECT count(*) FROM statements_src_tmp WHERE agent_address = _address AND agent_port = _port)
+         - (SELECT count(*) FROM by_query)
+    INTO v_missing;
+
+    -- Text of some statements is unknown, e.g. snapshot stored after cursor
+    -- was lost. Request a full snapshot on next pull.
+    IF v_missing > 0 THEN
+        RAISE WARNING 'Skipped % statements without text from %:%.', v_missing, _address, _port;
+        UPDATE metas SET cursor = NULL
+        WHERE agent_address = _address AND agent_port = _port;
+    END IF;
+
+    -- Coalesce datas if needed
+    IF ( (agg_seq % v_coalesce ) = 0 )
+    THEN
+      EXECUTE format('SELECT statements_aggregate(''%s'', %s)', _address, _port);
+    END IF;
+
+    DELETE FROM statements_src_tmp WHERE agent_address = _address AND agent_port = _port;
+    DELETE FROM statements_src_db_tmp WHERE agent_address = _address AND agent_port = _port;
+END;
+$PROC$ language plpgsql; /* end of process_statements */
@@ -0,0 +1,9 @@
+SET search_path TO statements, public;
+
+-- Statements are pulled concurrently by batches of instances. Record per
+-- instance duration in seconds of last pull from agent and of its ingestion,
+-- to spot slow agents.
+
+ALTER TABLE metas
+  ADD COLUMN pull_duration DOUBLE PRECISION,
+  ADD COLUMN ingest_duration DOUBLE PRECISION;
@@ -0,0 +1,316 @@
+SET search_path TO statements, public;
+
+-- Store counters increase of statements per snapshot interval.
+--
+-- statements_last keeps last counters of each statement. process_statements()
+-- inserts in statements_deltas the difference with new counters, stamped with
+-- snapshot datetime, and sums them by database in statements_deltas_db.
+-- Statistics of a range are the sum of deltas in range.
+--
+-- Counters restart from zero after pg_stat_statements_reset() or when entry
+-- is evicted then seen again. In this case, delta is the new counters. In
+-- incremental snapshot, agent sends query text of entries seen again, whose
+-- counters have restarted. In full snapshot, unknown statements set baseline
+-- only.
+
+CREATE TABLE statements_last (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  queryid BIGINT NOT NULL,
+  dbid OID NOT NULL,
+  userid OID NOT NULL,
+  record statements_history_record NOT NULL,
+  PRIMARY KEY (agent_address, agent_port, queryid, dbid, userid),
+  FOREIGN KEY (agent_address, agent_port, queryid, dbid, userid) REFERENCES statements ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+CREATE TABLE statements_deltas (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  queryid BIGINT NOT NULL,
+  dbid OID NOT NULL,
+  userid OID NOT NULL,
+  ts TIMESTAMP WITH TIME ZONE NOT NULL,
+  calls BIGINT,
+  total_exec_time DOUBLE PRECISION,
+  rows BIGINT,
+  shared_blks_hit BIGINT,
+  shared_blks_read BIGINT,
+  shared_blks_dirtied BIGINT,
+  shared_blks_written BIGINT,
+  local_blks_hit BIGINT,
+  local_blks_read BIGINT,
+  local_blks_dirtied BIGINT,
+  local_blks_written BIGINT,
+  temp_blks_read BIGINT,
+  temp_blks_written BIGINT,
+  blk_read_time DOUBLE PRECISION,
+  blk_write_time DOUBLE PRECISION,
+  total_plan_time DOUBLE PRECISION,
+  wal_records BIGINT,
+  wal_fpi BIGINT,
+  wal_bytes NUMERIC,
+  FOREIGN KEY (agent_address, agent_port, queryid, dbid, userid) REFERENCES statements ON DELETE CASCADE ON UPDATE CASCADE
+);
+CREATE INDEX ON statements_deltas (agent_address, agent_port, dbid, ts);
+
+CREATE TABLE statements_deltas_db (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  dbid OID NOT NULL,
+  datname TEXT NOT NULL,
+  ts TIMESTAMP WITH TIME ZONE NOT NULL,
+  calls BIGINT,
+  total_exec_time DOUBLE PRECISION,
+  rows BIGINT,
+  shared_blks_hit BIGINT,
+  shared_blks_read BIGINT,
+  shared_blks_dirtied BIGINT,
+  shared_blks_written BIGINT,
+  local_blks_hit BIGINT,
+  local_blks_read BIGINT,
+  local_blks_dirtied BIGINT,
+  local_blks_written BIGINT,
+  temp_blks_read BIGINT,
+  temp_blks_written BIGINT,
+  blk_read_time DOUBLE PRECISION,
+  blk_write_time DOUBLE PRECISION,
+  total_plan_time DOUBLE PRECISION,
+  wal_records BIGINT,
+  wal_fpi BIGINT,
+  wal_bytes NUMERIC,
+  FOREIGN KEY (agent_address, agent_port) REFERENCES application.instances (agent_address, agent_port) ON DELETE CASCADE ON UPDATE CASCADE
+);
+CREATE INDEX ON statements_deltas_db (agent_address, agent_port, ts);
+
+
+CREATE OR REPLACE FUNCTION statements_record_delta(_new statements_history_record, _old statements_history_record)
+RETURNS statements_history_record
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  -- Counters increase since _old, or since reset if _old is NULL.
+  SELECT CASE WHEN (_old).ts IS NULL THEN _new ELSE ROW(
+    (_new).ts,
+    (_new).calls - (_old).calls,
+    (_new).total_exec_time - (_old).total_exec_time,
+    (_new).rows - (_old).rows,
+    (_new).shared_blks_hit - (_old).shared_blks_hit,
+    (_new).shared_blks_read - (_old).shared_blks_read,
+    (_new).shared_blks_dirtied - (_old).shared_blks_dirtied,
+    (_new).shared_blks_written - (_old).shared_blks_written,
+    (_new).local_blks_hit - (_old).local_blks_hit,
+    (_new).local_blks_read - (_old).local_blks_read,
+    (_new).local_blks_dirtied - (_old).local_blks_dirtied,
+    (_new).local_blks_written - (_old).local_blks_written,
+    (_new).temp_blks_read - (_old).temp_blks_read,
+    (_new).temp_blks_written - (_old).temp_blks_written,
+    (_new).blk_read_time - (_old).blk_read_time,
+    (_new).blk_write_time - (_old).blk_write_time,
+    (_new).total_plan_time - (_old).total_plan_time,
+    (_new).wal_records - (_old).wal_records,
+    (_new).wal_fpi - (_old).wal_fpi,
+    (_new).wal_bytes - (_old).wal_bytes
+  )::statements_history_record END;
+$$;
+
+
+DROP FUNCTION process_statements(text, integer, text);
+
+CREATE FUNCTION process_statements(_address text, _port integer, _cursor text DEFAULT NULL, _full boolean DEFAULT true) RETURNS void AS $PROC$
+DECLARE
+    v_missing     bigint;
+    v_coalesce    integer := 100;
+    agg_seq  bigint;
+BEGIN
+    -- In this function, we process statements that have just been copied
+    -- from agent snapshot, and totals by database.
+
+    -- Create new meta for agent if doesn't already exist
+    INSERT INTO metas (agent_address, agent_port) VALUES (_address, _port)
+    ON CONFLICT DO NOTHING;
+
+    PERFORM prevent_concurrent_snapshot(_address, _port);
+
+    -- Update meta with info from the current proccess (snapshot)
+    UPDATE metas
+    SET coalesce_seq = coalesce_seq + 1,
+        snapts = now(),
+        cursor = _cursor,
+        error = NULL
+    WHERE agent_address = _address AND agent_port = _port
+    RETURNING coalesce_seq INTO agg_seq;
+
+    -- Store text of new statements before history references them.
+    INSERT INTO statements (agent_address, agent_port, queryid, query, dbid, datname, userid, rolname)
+    SELECT _address, _port, queryid, query, dbid, datname, userid, rolname
+    FROM statements_src_tmp
+    WHERE agent_address = _address AND agent_port = _port AND query IS NOT NULL
+    ON CONFLICT DO NOTHING;
+
+    WITH capture AS (
+        SELECT
+            src.queryid, src.dbid, src.userid, src.datname,
+            -- Agent sends text of entries seen again since last snapshot.
+            src.query IS NOT NULL AS seen_again,
+            ROW(
+                ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+                shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+                local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+                blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes
+            )::statements_history_record AS record
+        FROM statements_src_tmp AS src
+        JOIN statements AS s USING (agent_address, agent_port, queryid, dbid, userid)
+        WHERE src.agent_address = _address AND src.agent_port = _port
+    ),
+
+    by_query AS (
+        INSERT INTO statements_history_current
+            SELECT _address, _port, queryid, dbid, userid, record
+            FROM capture
+            RETURNING 1
+    ),
+
+    by_database AS (
+        INSERT INTO statements_history_current_db
+            SELECT _address, _port, dbid, datname,
+            ROW(
+                ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+                shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+                local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+                blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes
+            )::statements_history_record
+            FROM statements_src_db_tmp
+            WHERE agent_address = _address AND agent_port = _port
+    ),
+
+    deltas AS (
+        INSERT INTO statements_deltas
+            SELECT _address, _port, c.queryid, c.dbid, c.userid, d.*
+            FROM capture AS c
+            LEFT OUTER JOIN statements_last AS l
+                ON l.agent_address = _address AND l.agent_port = _port
+                AND l.queryid = c.queryid AND l.dbid = c.dbid AND l.userid = c.userid
+            CROSS JOIN LATERAL statements_record_delta(
+                c.record,
+                CASE
+                    WHEN (c.record).calls < (l.record).calls THEN NULL
+                    WHEN c.seen_again AND NOT _full THEN NULL
+                    ELSE l.record
+                END
+            ) AS d
+            WHERE (l.queryid IS NOT NULL OR NOT _full)
+            AND (d.calls <> 0 OR coalesce(d.total_plan_time, 0) <> 0)
+            RETURNING *
+    ),
+
+    deltas_by_database AS (
+        INSERT INTO statements_deltas_db
+            SELECT _address, _port, d.dbid, c.datname, d.ts,
+                sum(d.calls), sum(d.total_exec_time), sum(d.rows), sum(d.shared_blks_hit),
+                sum(d.shared_blks_read), sum(d.shared_blks_dirtied), sum(d.shared_blks_written),
+                sum(d.local_blks_hit), sum(d.local_blks_read), sum(d.local_blks_dirtied),
+                sum(d.local_blks_written), sum(d.temp_blks_read), sum(d.temp_blks_written),
+                sum(d.blk_read_time), sum(d.blk_write_time), sum(d.total_plan_time),
+                sum(d.wal_records), sum(d.wal_fpi), sum(d.wal_bytes)
+            FROM deltas AS d
+            JOIN capture AS c USING (queryid, dbid, userid)
+            GROUP BY d.dbid, c.datname, d.ts
+    ),
+
+    last_counters AS (
+        INSERT INTO statements_last
+            SELECT _address, _port, queryid, dbid, userid, record
+            FROM capture
+            ON CONFLICT (agent_address, agent_port, queryid, dbid, userid)
+            DO UPDATE SET record = EXCLUDED.record
+    )
+
+    SELECT (SELECT count(*) FROM statements_src_tmp WHERE agent_address = _address AND agent_port = _port)
+         - (SELECT count(*) FROM by_query)
+    INTO v_missing;
+
+    -- Text of some statements is unknown, e.g. snapshot stored after cursor
+    -- was lost. Request a full snapshot on next pull.
+    IF v_missing > 0 THEN
+        RAISE WARNING 'Skipped % statements without text from %:%.', v_missing, _address, _port;
+        UPDATE metas SET cursor = NULL
+        WHERE agent_address = _address AND agent_port = _port;
+    END IF;
+
+    -- Coalesce datas if needed
+    IF ( (agg_seq % v_coalesce ) = 0 )
+    THEN
+      EXECUTE format('SELECT statements_aggregate(''%s'', %s)', _address, _port);
+    END IF;
+
+    DELETE FROM statements_src_tmp WHERE agent_address = _address AND agent_port = _port;
+    DELETE FROM statements_src_db_tmp WHERE agent_address = _address AND agent_port = _port;
+END;
+$PROC$ language plpgsql; /* end of process_statements */
+
+
+CREATE OR REPLACE FUNCTION statements_purge(_ndays integer)
+RETURNS void AS $PROC$
+DECLARE
+    v_retention   interval := (_ndays || ' days')::interval;
+BEGIN
+    -- Delete obsolete datas.
+    DELETE FROM statements_history
+    WHERE upper(coalesce_range)< (now() - v_retention);
+
+    DELETE FROM statements_history_db
+    WHERE upper(coalesce_range)< (now() - v_retention);
+
+    DELETE FROM statements_deltas
+    WHERE ts < (now() - v_retention);
+
+    DELETE FROM statements_deltas_db
+    WHERE ts < (now() - v_retention);
+END;
+$PROC$ LANGUAGE plpgsql; /* end of statements_purge */
+
+
+-- Initialize deltas and last counters from history.
+CREATE TEMPORARY TABLE records_tmp AS
+SELECT agent_address, agent_port, queryid, dbid, userid, unnest(records) AS record
+FROM statements_history
+UNION ALL
+SELECT agent_address, agent_port, queryid, dbid, userid, record
+FROM statements_history_current;
+
+INSERT INTO statements_deltas
+SELECT r.agent_address, r.agent_port, r.queryid, r.dbid, r.userid, d.*
+FROM (
+  SELECT *, lag(record) OVER (
+    PARTITION BY agent_address, agent_port, queryid, dbid, userid
+    ORDER BY (record).ts
+  ) AS previous
+  FROM records_tmp
+) AS r
+CROSS JOIN LATERAL statements_record_delta(
+  r.record,
+  CASE WHEN (r.record).calls < (r.previous).calls THEN NULL ELSE r.previous END
+) AS d
+WHERE (r.previous).ts IS NOT NULL
+AND (d.calls <> 0 OR coalesce(d.total_plan_time, 0) <> 0);
+
+INSERT INTO statements_deltas_db
+SELECT d.agent_address, d.agent_port, d.dbid, s.datname, d.ts,
+  sum(d.calls), sum(d.total_exec_time), sum(d.rows), sum(d.shared_blks_hit),
+  sum(d.shared_blks_read), sum(d.shared_blks_dirtied), sum(d.shared_blks_written),
+  sum(d.local_blks_hit), sum(d.local_blks_read), sum(d.local_blks_dirtied),
+  sum(d.local_blks_written), sum(d.temp_blks_read), sum(d.temp_blks_written),
+  sum(d.blk_read_time), sum(d.blk_write_time), sum(d.total_plan_time),
+  sum(d.wal_records), sum(d.wal_fpi), sum(d.wal_bytes)
+FROM statements_deltas AS d
+JOIN statements AS s USING (agent_address, agent_port, queryid, dbid, userid)
+GROUP BY d.agent_address, d.agent_port, d.dbid, s.datname, d.ts;
+
+INSERT INTO statements_last
+SELECT DISTINCT ON (agent_address, agent_port, queryid, dbid, userid)
+  agent_address, agent_port, queryid, dbid, userid, record
+FROM records_tmp
+ORDER BY agent_address, agent_port, queryid, dbid, userid, (record).ts DESC;
+
+DROP TABLE records_tmp;
@@ -0,0 +1,300 @@
+SET search_path TO statements, public;
+
+-- Store closed statements history ranges by columns.
+--
+-- statements_compact() moves rows of statements_history and
+-- statements_history_db in *_packed tables. Records are stored as one array
+-- per field, ordered by ts, encoded as delta-of-delta integers. Cumulative
+-- counters growing steadily encode as zeros, which TOAST compresses well.
+-- Datetime are encoded in microseconds since epoch, durations are rounded to
+-- microsecond.
+--
+-- statements_history_all and statements_history_db_all views decode packed
+-- ranges as arrays of statements_history_record, like statements_history.
+-- Decoding functions qualify names to work whatever the search_path.
+
+CREATE TYPE statements_history_columns AS (
+  ts BIGINT[],
+  calls BIGINT[],
+  total_exec_time BIGINT[],
+  rows BIGINT[],
+  shared_blks_hit BIGINT[],
+  shared_blks_read BIGINT[],
+  shared_blks_dirtied BIGINT[],
+  shared_blks_written BIGINT[],
+  local_blks_hit BIGINT[],
+  local_blks_read BIGINT[],
+  local_blks_dirtied BIGINT[],
+  local_blks_written BIGINT[],
+  temp_blks_read BIGINT[],
+  temp_blks_written BIGINT[],
+  blk_read_time BIGINT[],
+  blk_write_time BIGINT[],
+  total_plan_time BIGINT[],
+  wal_records BIGINT[],
+  wal_fpi BIGINT[],
+  wal_bytes BIGINT[]
+);
+
+CREATE TABLE statements_history_packed (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  queryid BIGINT NOT NULL,
+  dbid oid NOT NULL,
+  userid oid NOT NULL,
+  coalesce_range tstzrange NOT NULL,
+  columns statements_history_columns NOT NULL,
+  FOREIGN KEY (agent_address, agent_port, queryid, dbid, userid) REFERENCES statements
+    ON DELETE CASCADE ON UPDATE CASCADE
+);
+CREATE INDEX ON statements_history_packed (agent_address, agent_port, dbid);
+CREATE INDEX ON statements_history_packed USING GIST (coalesce_range);
+
+CREATE TABLE statements_history_db_packed (
+  agent_address TEXT NOT NULL,
+  agent_port INTEGER NOT NULL,
+  dbid oid NOT NULL,
+  datname TEXT NOT NULL,
+  coalesce_range tstzrange NOT NULL,
+  columns statements_history_columns NOT NULL,
+  FOREIGN KEY (agent_address, agent_port) REFERENCES application.instances (agent_address, agent_port)
+    ON DELETE CASCADE ON UPDATE CASCADE
+);
+CREATE INDEX ON statements_history_db_packed (agent_address, agent_port, dbid);
+CREATE INDEX ON statements_history_db_packed USING GIST (coalesce_range);
+
+
+CREATE OR REPLACE FUNCTION statements_dod_encode(_values BIGINT[])
+RETURNS BIGINT[]
+LANGUAGE plpgsql
+IMMUTABLE
+AS $$
+DECLARE
+  v_result BIGINT[] := '{}';
+  v_value BIGINT;
+  v_last BIGINT;
+  v_delta BIGINT := 0;
+BEGIN
+  -- Encode first value as is, then difference between consecutive deltas.
+  -- NULL values are kept and skipped by deltas. Returns NULL if all values
+  -- are NULL.
+  FOREACH v_value IN ARRAY _values LOOP
+    IF v_value IS NULL THEN
+      v_result := v_result || NULL::BIGINT;
+    ELSIF v_last IS NULL THEN
+      v_result := v_result || v_value;
+      v_last := v_value;
+    ELSE
+      v_result := v_result || (v_value - v_last - v_delta);
+      v_delta := v_value - v_last;
+      v_last := v_value;
+    END IF;
+  END LOOP;
+
+  IF v_last IS NULL THEN
+    RETURN NULL;
+  END IF;
+  RETURN v_result;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION statements_dod_decode(_values BIGINT[])
+RETURNS BIGINT[]
+LANGUAGE plpgsql
+IMMUTABLE
+AS $$
+DECLARE
+  v_result BIGINT[] := '{}';
+  v_value BIGINT;
+  v_last BIGINT;
+  v_delta BIGINT := 0;
+BEGIN
+  -- Reverse statements_dod_encode().
+  IF _values IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  FOREACH v_value IN ARRAY _values LOOP
+    IF v_value IS NULL THEN
+      v_result := v_result || NULL::BIGINT;
+    ELSIF v_last IS NULL THEN
+      v_last := v_value;
+      v_result := v_result || v_last;
+    ELSE
+      v_delta := v_delta + v_value;
+      v_last := v_last + v_delta;
+      v_result := v_result || v_last;
+    END IF;
+  END LOOP;
+  RETURN v_result;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION statements_history_encode(_records statements_history_record[])
+RETURNS statements_history_columns
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT ROW(
+    statements.statements_dod_encode(array_agg((extract(epoch FROM ts) * 1000000)::BIGINT ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(calls ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(round(total_exec_time * 1000)::BIGINT ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(rows ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(shared_blks_hit ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(shared_blks_read ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(shared_blks_dirtied ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(shared_blks_written ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(local_blks_hit ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(local_blks_read ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(local_blks_dirtied ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(local_blks_written ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(temp_blks_read ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(temp_blks_written ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(round(blk_read_time * 1000)::BIGINT ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(round(blk_write_time * 1000)::BIGINT ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(round(total_plan_time * 1000)::BIGINT ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(wal_records ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(wal_fpi ORDER BY ts)),
+    statements.statements_dod_encode(array_agg(wal_bytes::BIGINT ORDER BY ts))
+  )::statements.statements_history_columns
+  FROM unnest(_records);
+$$;
+
+
+CREATE OR REPLACE FUNCTION statements_history_decode(_columns statements_history_columns)
+RETURNS statements_history_record[]
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  -- unnest() pads columns of NULL with NULL values.
+  SELECT array_agg(ROW(
+    'epoch'::TIMESTAMPTZ + ts * INTERVAL '1 microsecond',
+    calls,
+    total_exec_time / 1000.0,
+    rows,
+    shared_blks_hit,
+    shared_blks_read,
+    shared_blks_dirtied,
+    shared_blks_written,
+    local_blks_hit,
+    local_blks_read,
+    local_blks_dirtied,
+    local_blks_written,
+    temp_blks_read,
+    temp_blks_written,
+    blk_read_time / 1000.0,
+    blk_write_time / 1000.0,
+    total_plan_time / 1000.0,
+    wal_records,
+    wal_fpi,
+    wal_bytes
+  )::statements.statements_history_record ORDER BY i)
+  FROM unnest(
+    statements.statements_dod_decode((_columns).ts),
+    statements.statements_dod_decode((_columns).calls),
+    statements.statements_dod_decode((_columns).total_exec_time),
+    statements.statements_dod_decode((_columns).rows),
+    statements.statements_dod_decode((_columns).shared_blks_hit),
+    statements.statements_dod_decode((_columns).shared_blks_read),
+    statements.statements_dod_decode((_columns).shared_blks_dirtied),
+    statements.statements_dod_decode((_columns).shared_blks_written),
+    statements.statements_dod_decode((_columns).local_blks_hit),
+    statements.statements_dod_decode((_columns).local_blks_read),
+    statements.statements_dod_decode((_columns).local_blks_dirtied),
+    statements.statements_dod_decode((_columns).local_blks_written),
+    statements.statements_dod_decode((_columns).temp_blks_read),
+    statements.statements_dod_decode((_columns).temp_blks_written),
+    statements.statements_dod_decode((_columns).blk_read_time),
+    statements.statements_dod_decode((_columns).blk_write_time),
+    statements.statements_dod_decode((_columns).total_plan_time),
+    statements.statements_dod_decode((_columns).wal_records),
+    statements.statements_dod_decode((_columns).wal_fpi),
+    statements.statements_dod_decode((_columns).wal_bytes)
+  ) WITH ORDINALITY AS u(
+    ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+    shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+    local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+    blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes,
+    i
+  );
+$$;
+
+
+CREATE VIEW statements_history_all AS
+SELECT agent_address, agent_port, queryid, dbid, userid, coalesce_range, records
+FROM statements_history
+UNION ALL
+SELECT agent_address, agent_port, queryid, dbid, userid, coalesce_range, statements_history_decode(columns)
+FROM statements_history_packed;
+
+CREATE VIEW statements_history_db_all AS
+SELECT agent_address, agent_port, dbid, datname, coalesce_range, records
+FROM statements_history_db
+UNION ALL
+SELECT agent_address, agent_port, dbid, datname, coalesce_range, statements_history_decode(columns)
+FROM statements_history_db_packed;
+
+
+CREATE OR REPLACE FUNCTION statements_compact(_limit integer DEFAULT 1000)
+RETURNS TABLE(tblname TEXT, nb_rows BIGINT)
+AS $PROC$
+BEGIN
+    -- Pack at most _limit ranges of each history table.
+    RETURN QUERY
+    WITH moved AS (
+        DELETE FROM statements_history
+        WHERE ctid = ANY(ARRAY(SELECT ctid FROM statements_history LIMIT _limit))
+        RETURNING *
+    ), packed AS (
+        INSERT INTO statements_history_packed
+        SELECT agent_address, agent_port, queryid, dbid, userid, coalesce_range,
+            statements_history_encode(records)
+        FROM moved
+        RETURNING 1
+    )
+    SELECT 'statements_history_packed'::TEXT, count(*) FROM packed;
+
+    RETURN QUERY
+    WITH moved AS (
+        DELETE FROM statements_history_db
+        WHERE ctid = ANY(ARRAY(SELECT ctid FROM statements_history_db LIMIT _limit))
+        RETURNING *
+    ), packed AS (
+        INSERT INTO statements_history_db_packed
+        SELECT agent_address, agent_port, dbid, datname, coalesce_range,
+            statements_history_encode(records)
+        FROM moved
+        RETURNING 1
+    )
+    SELECT 'statements_history_db_packed'::TEXT, count(*) FROM packed;
+END;
+$PROC$ LANGUAGE plpgsql; /* end of statements_compact */
+
+
+CREATE OR REPLACE FUNCTION statements_purge(_ndays integer)
+RETURNS void AS $PROC$
+DECLARE
+    v_retention   interval := (_ndays || ' days')::interval;
+BEGIN
+    -- Delete obsolete datas.
+    DELETE FROM statements_history
+    WHERE upper(coalesce_range)< (now() - v_retention);
+
+    DELETE FROM statements_history_db
+    WHERE upper(coalesce_range)< (now() - v_retention);
+
+    DELETE FROM statements_history_packed
+    WHERE upper(coalesce_range)< (now() - v_retention);
+
+    DELETE FROM statements_history_db_packed
+    WHERE upper(coalesce_range)< (now() - v_retention);
+
+    DELETE FROM statements_deltas
+    WHERE ts < (now() - v_retention);
+
+    DELETE FROM statements_deltas_db
+    WHERE ts < (now() - v_retention);
+END;
+$PROC$ LANGUAGE plpgsql; /* end of statements_purge */
@@ -0,0 +1,108 @@
+SET search_path TO monitoring, public;
+
+-- Count rewrites of aggregated data.
+--
+-- aggregate_watermarks.revision is incremented each time aggregation writes
+-- buckets of the tier and each time collector flags late points of the
+-- table. Chart cache keys include revision, thus past ranges are refreshed
+-- when their buckets are recomputed.
+
+ALTER TABLE monitoring.aggregate_watermarks ADD COLUMN revision BIGINT NOT NULL DEFAULT 0;
+
+
+CREATE OR REPLACE FUNCTION monitoring.aggregate_data_single(table_name TEXT, record_type TEXT, query TEXT, i_periods TEXT[], i_max_buckets INTEGER DEFAULT 1000)
+RETURNS TABLE(tblname TEXT, nb_rows INTEGER, nb_points BIGINT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_agg_table TEXT;
+  i_period TEXT;
+  v_query TEXT;
+  v_watermark TIMESTAMP WITH TIME ZONE;
+  v_since TIMESTAMP WITH TIME ZONE;
+  v_late TIMESTAMP WITH TIME ZONE[];
+  v_bucket TIMESTAMP WITH TIME ZONE;
+  v_end TIMESTAMP WITH TIME ZONE;
+  v_buckets INTEGER;
+  v_rows INTEGER;
+  v_points BIGINT;
+  i INTEGER;
+  n BIGINT;
+BEGIN
+  -- Consume points flagged late by collector.
+  WITH consumed AS (
+    DELETE FROM monitoring.aggregate_late_points
+    WHERE tablename = table_name
+    RETURNING datetime
+  )
+  SELECT array_agg(datetime) INTO v_late FROM consumed;
+
+  FOREACH i_period IN ARRAY i_periods LOOP
+    PERFORM monitoring.create_aggregate_table(table_name, i_period);
+    v_agg_table := table_name || '_' || i_period || '_current';
+    -- Expand one bucket at a time instead of everything since last
+    -- aggregated bucket. Count buckets and points written.
+    v_query := replace(query, 'expand_data_limit(''#name#'', (SELECT tstzrange(MAX(datetime), NOW()) FROM #agg_table#), 100000)', 'expand_data(''#name#'', #range#)');
+    v_query := replace(v_query, '#agg_table#', v_agg_table);
+    v_query := replace(v_query, '#interval#', i_period);
+    v_query := replace(v_query, '#record_type#', record_type);
+    v_query := replace(v_query, '#name#', table_name);
+    v_query := 'WITH upserted AS (' || v_query || ' RETURNING w) SELECT count(*), coalesce(sum(w), 0) FROM upserted';
+    v_rows := 0;
+    v_points := 0;
+
+    SELECT bucket, since INTO v_watermark, v_since
+    FROM monitoring.aggregate_watermarks
+    WHERE tablename = table_name AND period = i_period;
+
+    -- Recompute buckets of late points.
+    FOR v_bucket IN
+      SELECT DISTINCT truncate_time(d, i_period::INTERVAL)
+      FROM unnest(v_late) AS d
+      WHERE d < v_watermark
+      ORDER BY 1
+    LOOP
+      EXECUTE replace(v_query, '#range#', quote_literal(tstzrange(v_bucket, v_bucket + i_period::INTERVAL)) || '::TSTZRANGE') INTO i, n;
+      v_rows := v_rows + i;
+      v_points := v_points + n;
+    END LOOP;
+
+    -- Aggregate new buckets, from last aggregated bucket which may be
+    -- incomplete. A new tier starts from oldest point not archived.
+    IF v_watermark IS NULL THEN
+      EXECUTE format('SELECT min(datetime) FROM %I', table_name || '_current') INTO v_bucket;
+      v_bucket := truncate_time(coalesce(v_bucket, NOW()), i_period::INTERVAL);
+      v_since := v_bucket;
+    ELSE
+      v_bucket := v_watermark;
+    END IF;
+    v_end := truncate_time(NOW(), i_period::INTERVAL);
+    v_buckets := 0;
+    WHILE v_bucket < v_end AND v_buckets < i_max_buckets LOOP
+      EXECUTE replace(v_query, '#range#', quote_literal(tstzrange(v_bucket, v_bucket + i_period::INTERVAL)) || '::TSTZRANGE') INTO i, n;
+      v_rows := v_rows + i;
+      v_points := v_points + n;
+      v_watermark := v_bucket;
+      v_bucket := v_bucket + i_period::INTERVAL;
+      v_buckets := v_buckets + 1;
+    END LOOP;
+
+    IF v_watermark IS NOT NULL THEN
+      INSERT INTO monitoring.aggregate_watermarks (tablename, period, bucket, since)
+      VALUES (table_name, i_period, v_watermark, v_since)
+      ON CONFLICT (tablename, period) DO UPDATE SET
+        bucket = EXCLUDED.bucket,
+        revision = monitoring.aggregate_watermarks.revision + CASE WHEN v_rows > 0 THEN 1 ELSE 0 END;
+    END IF;
+
+    RETURN QUERY SELECT v_agg_table, v_rows, v_points;
+  END LOOP;
+
+  -- Forget tiers not aggregated anymore.
+  DELETE FROM monitoring.aggregate_watermarks
+  WHERE tablename = table_name AND NOT period = ANY(i_periods);
+END;
+$$;
+
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA monitoring TO temboard;
+GRANT ALL ON ALL TABLES IN SCHEMA monitoring TO temboard;
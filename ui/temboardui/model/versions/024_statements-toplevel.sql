@@ -0,0 +1,189 @@
+SET search_path TO statements, public;
+
+-- Process statements executed both at top level and nested in a function.
+--
+-- Since PostgreSQL 14, pg_stat_statements has an entry per queryid, dbid,
+-- userid and toplevel. Agent sends toplevel, NULL before PostgreSQL 14 meaning
+-- top level. statements_last keeps last counters of each entry to compute its
+-- deltas. Deltas and history sum entries of both levels by statement. In
+-- incremental snapshot, counters of the entry of the other level not sent are
+-- unchanged since last snapshot.
+
+ALTER TABLE statements_src_tmp ADD COLUMN toplevel BOOLEAN;
+
+ALTER TABLE statements_last ADD COLUMN toplevel BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE statements_last DROP CONSTRAINT statements_last_pkey;
+ALTER TABLE statements_last ADD PRIMARY KEY (agent_address, agent_port, queryid, dbid, userid, toplevel);
+
+
+CREATE OR REPLACE FUNCTION process_statements(_address text, _port integer, _cursor text DEFAULT NULL, _full boolean DEFAULT true) RETURNS void AS $PROC$
+DECLARE
+    v_missing     bigint;
+    v_coalesce    integer := 100;
+    agg_seq  bigint;
+BEGIN
+    -- In this function, we process statements that have just been copied
+    -- from agent snapshot, and totals by database.
+
+    -- Create new meta for agent if doesn't already exist
+    INSERT INTO metas (agent_address, agent_port) VALUES (_address, _port)
+    ON CONFLICT DO NOTHING;
+
+    PERFORM prevent_concurrent_snapshot(_address, _port);
+
+    -- Update meta with info from the current proccess (snapshot)
+    UPDATE metas
+    SET coalesce_seq = coalesce_seq + 1,
+        snapts = now(),
+        cursor = _cursor,
+        error = NULL
+    WHERE agent_address = _address AND agent_port = _port
+    RETURNING coalesce_seq INTO agg_seq;
+
+    -- Store text of new statements before history references them.
+    INSERT INTO statements (agent_address, agent_port, queryid, query, dbid, datname, userid, rolname)
+    SELECT _address, _port, queryid, query, dbid, datname, userid, rolname
+    FROM statements_src_tmp
+    WHERE agent_address = _address AND agent_port = _port AND query IS NOT NULL
+    ON CONFLICT DO NOTHING;
+
+    WITH capture AS (
+        SELECT
+            src.queryid, src.dbid, src.userid, src.datname,
+            coalesce(src.toplevel, TRUE) AS toplevel,
+            -- Agent sends text of entries seen again since last snapshot.
+            src.query IS NOT NULL AS seen_again,
+            ROW(
+                ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+                shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+                local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+                blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes
+            )::statements_history_record AS record
+        FROM statements_src_tmp AS src
+        JOIN statements AS s USING (agent_address, agent_port, queryid, dbid, userid)
+        WHERE src.agent_address = _address AND src.agent_port = _port
+    ),
+
+    unchanged AS (
+        SELECT l.queryid, l.dbid, l.userid, l.record
+        FROM statements_last AS l
+        JOIN (SELECT DISTINCT queryid, dbid, userid FROM capture) AS c USING (queryid, dbid, userid)
+        WHERE NOT _full
+        AND l.agent_address = _address AND l.agent_port = _port
+        AND NOT EXISTS (
+            SELECT FROM capture AS c2
+            WHERE c2.queryid = l.queryid AND c2.dbid = l.dbid AND c2.userid = l.userid
+            AND c2.toplevel = l.toplevel
+        )
+    ),
+
+    by_query AS (
+        INSERT INTO statements_history_current
+            SELECT _address, _port, queryid, dbid, userid,
+            ROW(
+                max((r).ts), sum((r).calls), sum((r).total_exec_time), sum((r).rows),
+                sum((r).shared_blks_hit), sum((r).shared_blks_read), sum((r).shared_blks_dirtied),
+                sum((r).shared_blks_written), sum((r).local_blks_hit), sum((r).local_blks_read),
+                sum((r).local_blks_dirtied), sum((r).local_blks_written), sum((r).temp_blks_read),
+                sum((r).temp_blks_written), sum((r).blk_read_time), sum((r).blk_write_time),
+                sum((r).total_plan_time), sum((r).wal_records), sum((r).wal_fpi), sum((r).wal_bytes)
+            )::statements_history_record
+            FROM (
+                SELECT queryid, dbid, userid, record AS r FROM capture
+                UNION ALL
+                SELECT queryid, dbid, userid, record AS r FROM unchanged
+            ) AS records
+            GROUP BY queryid, dbid, userid
+    ),
+
+    by_database AS (
+        INSERT INTO statements_history_current_db
+            SELECT _address, _port, dbid, datname,
+            ROW(
+                ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+                shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+                local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+                blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes
+            )::statements_history_record
+            FROM statements_src_db_tmp
+            WHERE agent_address = _address AND agent_port = _port
+    ),
+
+    entries_deltas AS (
+        SELECT c.queryid, c.dbid, c.userid, d.*
+        FROM capture AS c
+        LEFT OUTER JOIN statements_last AS l
+            ON l.agent_address = _address AND l.agent_port = _port
+            AND l.queryid = c.queryid AND l.dbid = c.dbid AND l.userid = c.userid
+            AND l.toplevel = c.toplevel
+        CROSS JOIN LATERAL statements_record_delta(
+            c.record,
+            CASE
+                WHEN (c.record).calls < (l.record).calls THEN NULL
+                WHEN c.seen_again AND NOT _full THEN NULL
+                ELSE l.record
+            END
+        ) AS d
+        WHERE (l.queryid IS NOT NULL OR NOT _full)
+        AND (d.calls <> 0 OR coalesce(d.total_plan_time, 0) <> 0)
+    ),
+
+    deltas AS (
+        INSERT INTO statements_deltas
+            SELECT _address, _port, queryid, dbid, userid, ts,
+                sum(calls), sum(total_exec_time), sum(rows), sum(shared_blks_hit),
+                sum(shared_blks_read), sum(shared_blks_dirtied), sum(shared_blks_written),
+                sum(local_blks_hit), sum(local_blks_read), sum(local_blks_dirtied),
+                sum(local_blks_written), sum(temp_blks_read), sum(temp_blks_written),
+                sum(blk_read_time), sum(blk_write_time), sum(total_plan_time),
+                sum(wal_records), sum(wal_fpi), sum(wal_bytes)
+            FROM entries_deltas
+            GROUP BY queryid, dbid, userid, ts
+            RETURNING *
+    ),
+
+    deltas_by_database AS (
+        INSERT INTO statements_deltas_db
+            SELECT _address, _port, d.dbid, c.datname, d.ts,
+                sum(d.calls), sum(d.total_exec_time), sum(d.rows), sum(d.shared_blks_hit),
+                sum(d.shared_blks_read), sum(d.shared_blks_dirtied), sum(d.shared_blks_written),
+                sum(d.local_blks_hit), sum(d.local_blks_read), sum(d.local_blks_dirtied),
+                sum(d.local_blks_written), sum(d.temp_blks_read), sum(d.temp_blks_written),
+                sum(d.blk_read_time), sum(d.blk_write_time), sum(d.total_plan_time),
+                sum(d.wal_records), sum(d.wal_fpi), sum(d.wal_bytes)
+            FROM deltas AS d
+            JOIN (SELECT DISTINCT queryid, dbid, userid, datname FROM capture) AS c
+                USING (queryid, dbid, userid)
+            GROUP BY d.dbid, c.datname, d.ts
+    ),
+
+    last_counters AS (
+        INSERT INTO statements_last (agent_address, agent_port, queryid, dbid, userid, toplevel, record)
+            SELECT _address, _port, queryid, dbid, userid, toplevel, record
+            FROM capture
+            ON CONFLICT (agent_address, agent_port, queryid, dbid, userid, toplevel)
+            DO UPDATE SET record = EXCLUDED.record
+    )
+
+    SELECT (SELECT count(*) FROM statements_src_tmp WHERE agent_address = _address AND agent_port = _port)
+         - (SELECT count(*) FROM capture)
+    INTO v_missing;
+
+    -- Text of some statements is unknown, e.g. snapshot stored after cursor
+    -- was lost. Request a full snapshot on next pull.
+    IF v_missing > 0 THEN
+        RAISE WARNING 'Skipped % statements without text from %:%.', v_missing, _address, _port;
+        UPDATE metas SET cursor = NULL
+        WHERE agent_address = _address AND agent_port = _port;
+    END IF;
+
+    -- Coalesce datas if needed
+    IF ( (agg_seq % v_coalesce ) = 0 )
+    THEN
+      EXECUTE format('SELECT statements_aggregate(''%s'', %s)', _address, _port);
+    END IF;
+
+    DELETE FROM statements_src_tmp WHERE agent_address = _address AND agent_port = _port;
+    DELETE FROM statements_src_db_tmp WHERE agent_address = _address AND agent_port = _port;
+END;
+$PROC$ language plpgsql; /* end of process_statements */
@@ -0,0 +1,212 @@
+SET search_path TO statements, public;
+
+-- Encode packed statements history as plain deltas.
+--
+-- Each array stores first value as is, then difference with previous non-NULL
+-- value. Counters of idle statements encode as zeros, where delta-of-delta
+-- alternates signs around each execution. statements_history_decode()
+-- restores values with running sums over arrays in a single query, instead
+-- of a function call per field. See dev/bin/bench-statements-history.py.
+
+CREATE OR REPLACE FUNCTION statements_delta_encode(_values BIGINT[])
+RETURNS BIGINT[]
+LANGUAGE plpgsql
+IMMUTABLE
+AS $$
+DECLARE
+  v_result BIGINT[] := '{}';
+  v_value BIGINT;
+  v_last BIGINT;
+BEGIN
+  -- Encode first value as is, then difference with previous value. NULL
+  -- values are kept and skipped by deltas. Returns NULL if all values are
+  -- NULL.
+  IF _values IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  FOREACH v_value IN ARRAY _values LOOP
+    IF v_value IS NULL THEN
+      v_result := v_result || NULL::BIGINT;
+    ELSE
+      v_result := v_result || (v_value - coalesce(v_last, 0));
+      v_last := v_value;
+    END IF;
+  END LOOP;
+
+  IF v_last IS NULL THEN
+    RETURN NULL;
+  END IF;
+  RETURN v_result;
+END;
+$$;
+
+
+-- Re-encode existing ranges.
+UPDATE statements_history_packed SET columns = ROW(
+  statements_delta_encode(statements_dod_decode((columns).ts)),
+  statements_delta_encode(statements_dod_decode((columns).calls)),
+  statements_delta_encode(statements_dod_decode((columns).total_exec_time)),
+  statements_delta_encode(statements_dod_decode((columns).rows)),
+  statements_delta_encode(statements_dod_decode((columns).shared_blks_hit)),
+  statements_delta_encode(statements_dod_decode((columns).shared_blks_read)),
+  statements_delta_encode(statements_dod_decode((columns).shared_blks_dirtied)),
+  statements_delta_encode(statements_dod_decode((columns).shared_blks_written)),
+  statements_delta_encode(statements_dod_decode((columns).local_blks_hit)),
+  statements_delta_encode(statements_dod_decode((columns).local_blks_read)),
+  statements_delta_encode(statements_dod_decode((columns).local_blks_dirtied)),
+  statements_delta_encode(statements_dod_decode((columns).local_blks_written)),
+  statements_delta_encode(statements_dod_decode((columns).temp_blks_read)),
+  statements_delta_encode(statements_dod_decode((columns).temp_blks_written)),
+  statements_delta_encode(statements_dod_decode((columns).blk_read_time)),
+  statements_delta_encode(statements_dod_decode((columns).blk_write_time)),
+  statements_delta_encode(statements_dod_decode((columns).total_plan_time)),
+  statements_delta_encode(statements_dod_decode((columns).wal_records)),
+  statements_delta_encode(statements_dod_decode((columns).wal_fpi)),
+  statements_delta_encode(statements_dod_decode((columns).wal_bytes))
+)::statements_history_columns;
+
+UPDATE statements_history_db_packed SET columns = ROW(
+  statements_delta_encode(statements_dod_decode((columns).ts)),
+  statements_delta_encode(statements_dod_decode((columns).calls)),
+  statements_delta_encode(statements_dod_decode((columns).total_exec_time)),
+  statements_delta_encode(statements_dod_decode((columns).rows)),
+  statements_delta_encode(statements_dod_decode((columns).shared_blks_hit)),
+  statements_delta_encode(statements_dod_decode((columns).shared_blks_read)),
+  statements_delta_encode(statements_dod_decode((columns).shared_blks_dirtied)),
+  statements_delta_encode(statements_dod_decode((columns).shared_blks_written)),
+  statements_delta_encode(statements_dod_decode((columns).local_blks_hit)),
+  statements_delta_encode(statements_dod_decode((columns).local_blks_read)),
+  statements_delta_encode(statements_dod_decode((columns).local_blks_dirtied)),
+  statements_delta_encode(statements_dod_decode((columns).local_blks_written)),
+  statements_delta_encode(statements_dod_decode((columns).temp_blks_read)),
+  statements_delta_encode(statements_dod_decode((columns).temp_blks_written)),
+  statements_delta_encode(statements_dod_decode((columns).blk_read_time)),
+  statements_delta_encode(statements_dod_decode((columns).blk_write_time)),
+  statements_delta_encode(statements_dod_decode((columns).total_plan_time)),
+  statements_delta_encode(statements_dod_decode((columns).wal_records)),
+  statements_delta_encode(statements_dod_decode((columns).wal_fpi)),
+  statements_delta_encode(statements_dod_decode((columns).wal_bytes))
+)::statements_history_columns;
+
+
+CREATE OR REPLACE FUNCTION statements_history_encode(_records statements_history_record[])
+RETURNS statements_history_columns
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  SELECT ROW(
+    statements.statements_delta_encode(array_agg((extract(epoch FROM ts) * 1000000)::BIGINT ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(calls ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(round(total_exec_time * 1000)::BIGINT ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(rows ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(shared_blks_hit ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(shared_blks_read ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(shared_blks_dirtied ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(shared_blks_written ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(local_blks_hit ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(local_blks_read ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(local_blks_dirtied ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(local_blks_written ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(temp_blks_read ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(temp_blks_written ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(round(blk_read_time * 1000)::BIGINT ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(round(blk_write_time * 1000)::BIGINT ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(round(total_plan_time * 1000)::BIGINT ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(wal_records ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(wal_fpi ORDER BY ts)),
+    statements.statements_delta_encode(array_agg(wal_bytes::BIGINT ORDER BY ts))
+  )::statements.statements_history_columns
+  FROM unnest(_records);
+$$;
+
+
+CREATE OR REPLACE FUNCTION statements_history_decode(_columns statements_history_columns)
+RETURNS statements_history_record[]
+LANGUAGE sql
+IMMUTABLE
+AS $$
+  -- unnest() pads columns of NULL with NULL values. sum() skips NULL deltas,
+  -- thus running sums are kept NULL where deltas are NULL.
+  SELECT array_agg(ROW(
+    'epoch'::TIMESTAMPTZ + ts * INTERVAL '1 microsecond',
+    calls,
+    total_exec_time / 1000.0::FLOAT8,
+    rows,
+    shared_blks_hit,
+    shared_blks_read,
+    shared_blks_dirtied,
+    shared_blks_written,
+    local_blks_hit,
+    local_blks_read,
+    local_blks_dirtied,
+    local_blks_written,
+    temp_blks_read,
+    temp_blks_written,
+    blk_read_time / 1000.0::FLOAT8,
+    blk_write_time / 1000.0::FLOAT8,
+    total_plan_time / 1000.0::FLOAT8,
+    wal_records,
+    wal_fpi,
+    wal_bytes
+  )::statements.statements_history_record ORDER BY i)
+  FROM (
+    SELECT
+      u.i,
+      CASE WHEN u.ts IS NOT NULL THEN (sum(u.ts) OVER w)::BIGINT END AS ts,
+      CASE WHEN u.calls IS NOT NULL THEN (sum(u.calls) OVER w)::BIGINT END AS calls,
+      CASE WHEN u.total_exec_time IS NOT NULL THEN (sum(u.total_exec_time) OVER w)::BIGINT END AS total_exec_time,
+      CASE WHEN u.rows IS NOT NULL THEN (sum(u.rows) OVER w)::BIGINT END AS rows,
+      CASE WHEN u.shared_blks_hit IS NOT NULL THEN (sum(u.shared_blks_hit) OVER w)::BIGINT END AS shared_blks_hit,
+      CASE WHEN u.shared_blks_read IS NOT NULL THEN (sum(u.shared_blks_read) OVER w)::BIGINT END AS shared_blks_read,
+      CASE WHEN u.shared_blks_dirtied IS NOT NULL THEN (sum(u.shared_blks_dirtied) OVER w)::BIGINT END AS shared_blks_dirtied,
+      CASE WHEN u.shared_blks_written IS NOT NULL THEN (sum(u.shared_blks_written) OVER w)::BIGINT END AS shared_blks_written,
+      CASE WHEN u.local_blks_hit IS NOT NULL THEN (sum(u.local_blks_hit) OVER w)::BIGINT END AS local_blks_hit,
+      CASE WHEN u.local_blks_read IS NOT NULL THEN (sum(u.local_blks_read) OVER w)::BIGINT END AS local_blks_read,
+      CASE WHEN u.local_blks_dirtied IS NOT NULL THEN (sum(u.local_blks_dirtied) OVER w)::BIGINT END AS local_blks_dirtied,
+      CASE WHEN u.local_blks_written IS NOT NULL THEN (sum(u.local_blks_written) OVER w)::BIGINT END AS local_blks_written,
+      CASE WHEN u.temp_blks_read IS NOT NULL THEN (sum(u.temp_blks_read) OVER w)::BIGINT END AS temp_blks_read,
+      CASE WHEN u.temp_blks_written IS NOT NULL THEN (sum(u.temp_blks_written) OVER w)::BIGINT END AS temp_blks_written,
+      CASE WHEN u.blk_read_time IS NOT NULL THEN (sum(u.blk_read_time) OVER w)::BIGINT END AS blk_read_time,
+      CASE WHEN u.blk_write_time IS NOT NULL THEN (sum(u.blk_write_time) OVER w)::BIGINT END AS blk_write_time,
+      CASE WHEN u.total_plan_time IS NOT NULL THEN (sum(u.total_plan_time) OVER w)::BIGINT END AS total_plan_time,
+      CASE WHEN u.wal_records IS NOT NULL THEN (sum(u.wal_records) OVER w)::BIGINT END AS wal_records,
+      CASE WHEN u.wal_fpi IS NOT NULL THEN (sum(u.wal_fpi) OVER w)::BIGINT END AS wal_fpi,
+      CASE WHEN u.wal_bytes IS NOT NULL THEN (sum(u.wal_bytes) OVER w)::BIGINT END AS wal_bytes
+    -- Expand columns once, each field access detoasts the whole value.
+    FROM unnest(ARRAY[_columns]) AS c
+    CROSS JOIN LATERAL unnest(
+      c.ts,
+      c.calls,
+      c.total_exec_time,
+      c.rows,
+      c.shared_blks_hit,
+      c.shared_blks_read,
+      c.shared_blks_dirtied,
+      c.shared_blks_written,
+      c.local_blks_hit,
+      c.local_blks_read,
+      c.local_blks_dirtied,
+      c.local_blks_written,
+      c.temp_blks_read,
+      c.temp_blks_written,
+      c.blk_read_time,
+      c.blk_write_time,
+      c.total_plan_time,
+      c.wal_records,
+      c.wal_fpi,
+      c.wal_bytes
+    ) WITH ORDINALITY AS u(
+      ts, calls, total_exec_time, rows, shared_blks_hit, shared_blks_read,
+      shared_blks_dirtied, shared_blks_written, local_blks_hit, local_blks_read,
+      local_blks_dirtied, local_blks_written, temp_blks_read, temp_blks_written,
+      blk_read_time, blk_write_time, total_plan_time, wal_records, wal_fpi, wal_bytes,
+      i
+    )
+    WINDOW w AS (ORDER BY i ROWS UNBOUNDED PRECEDING)
+  ) AS decoded;
+$$;
+
+
+DROP FUNCTION statements_dod_encode(BIGINT[]);
+DROP FUNCTION statements_dod_decode(BIGINT[]);
@@ -3,8 +3,10 @@
 #
 # Metrics are stored in different tables:
 #
-# - metric_*_current stores metrics one row per metric point
-# - metric_*_30m_current is a compacted COPY of _current by interval
+# - metric_*_current stores metrics one row per metric point, partitioned
+#   by day
+# - metric_*_<tier>_current is a compacted COPY of _current by interval,
+#   one table per tier of aggregate_tiers parameter: 5m, 30m, 1h, etc.
 # - metric_*_history aggregates points per time interavl
 #
 # Tasks:
@@ -13,15 +15,18 @@
 #   inventory.
 # - collector(host, port, key) inserts metrics history in metric_*_current
 #   table.
-# - history_tables_worker() move data from metric_*_current to
-#   metric_*_history, grouped by time range. metric table is truncated
-# - aggregate_data_worker() aggregates data in metric_*_30m_current and
-#   metric_*_6h_current.
+# - history_tables_worker() creates partitions of metric_*_current for the
+#   coming days and move closed partitions to metric_*_history, grouped by
+#   time range. Closed partitions are dropped.
+# - aggregate_data_worker() aggregates data in metric_*_<tier>_current
+#   tables.
 #
 
+import json
 import logging
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 try:
@@ -30,6 +35,7 @@ except ImportError:
     from itertools import izip_longest as zip_longest
 from textwrap import dedent
 
+import psycopg2
 import tornado.escape
 import tornado.web
 from psycopg2.extensions import AsIs
@@ -48,6 +54,7 @@ from ...core import refresh_discover
 from ...model import QUERIES, Session
 from ...model import orm as coreorm
 from .alerting import check_specs
+from .chartdata import tiers
 from .handlers import blueprint
 from .model.db import insert_availability
 from .model.orm import Check, CollectorStatus, Host, Instance
@@ -61,6 +68,7 @@ from .tools import (
     merge_agent_info,
     populate_host_checks,
     preprocess_data,
+    read_history,
     update_collector_status,
 )
 
@@ -73,6 +81,9 @@ class MonitoringPlugin:
     prometheus = shutil.which("prometheus")
     options_specs = [
         OptionSpec(s, "collect_max_duration", default=30, validator=int),
+        OptionSpec(s, "collect_concurrency", default=8, validator=v.positive),
+        OptionSpec(s, "aggregate_tiers", default="5m,30m,1h,6h,1d", validator=tiers),
+        OptionSpec(s, "chart_cache_size", default=256, validator=int),
         OptionSpec(s, "prometheus", default=prometheus, validator=v.file_),
     ]
 
@@ -105,7 +116,12 @@ class MonitoringPlugin:
 @workers.register(pool_size=1)
 def aggregate_data_worker(app):
     # Worker in charge of aggregate data
+    #
+    # Aggregation recomputes only buckets after last aggregated bucket and
+    # buckets of points flagged late by collector. Logs the number of
+    # buckets written and the number of points aggregated in them.
     stopwatch = Stopwatch()
+    total_rows = total_points = 0
     engine = worker_engine(app.config.repository)
     logger.info("Aggregating data.")
     with engine.connect() as conn:
@@ -117,24 +133,37 @@ def aggregate_data_worker(app):
             try:
                 with conn.begin(), stopwatch:
                     res = conn.execute(
-                        "SELECT * FROM aggregate_data_single(%s, %s, %s)",
-                        (config["name"], config["record_type"], config["aggregate"]),
+                        "SELECT * FROM aggregate_data_single(%s, %s, %s, %s)",
+                        (
+                            config["name"],
+                            config["record_type"],
+                            config["aggregate"],
+                            app.config.monitoring.aggregate_tiers,
+                        ),
                     )
                     # Call here pg_sleep() using conn.execute() to fake slow
                     # aggregation.
-                    table_name, nb_rows = res.fetchone()
-                logger.debug(
-                    "table=%s insert=%s timedelta=%s",
-                    table_name,
-                    nb_rows,
-                    stopwatch.last_delta,
-                )
+                    rows = res.fetchall()
+                for table_name, nb_rows, nb_points in rows:
+                    logger.debug(
+                        "table=%s insert=%s scanned=%s timedelta=%s",
+                        table_name,
+                        nb_rows,
+                        nb_points,
+                        stopwatch.last_delta,
+                    )
+                    total_rows += nb_rows
+                    total_points += nb_points
             except Exception as e:
-                logger.error("Failed to archive data: %s.", e)
+                logger.error("Failed to aggregate data: %s.", e)
                 # search_path is lost on exception. Define it again.
                 conn.execute("SET search_path TO monitoring")
 
-    logger.debug("Monitoring data aggregation done.")
+    logger.info(
+        "Monitoring data aggregation done. insert=%s scanned=%s",
+        total_rows,
+        total_points,
+    )
     logger.debug("Total time in SQL %s.", stopwatch.delta)
 
 
@@ -143,8 +172,10 @@ def aggregate_data_worker(app):
 def history_tables_worker(app):
     # Archive monitoring metric tables.
     #
-    # Copy contents of every metric_*_current tables into corresponding
-    # metric_*_history, aggregated. Then truncate _current tables.
+    # Ensure daily partitions of metric_*_current tables exist ahead. Copy
+    # contents of closed partitions into corresponding metric_*_history,
+    # aggregated. Then drop closed partitions. Ingestion in partition of the
+    # day is not locked.
     #
     # This task is triggered every 3 hours by monitoring_boostrap() below.
     #
@@ -158,6 +189,13 @@ def history_tables_worker(app):
         for config in tables_config.values():
             logger.debug("Archiving data for metric %s.", config["name"])
             try:
+                with conn.begin():
+                    res = conn.execute(
+                        "SELECT * FROM create_metric_partitions(%s)", (config["name"],)
+                    )
+                    for (partition,) in res:
+                        logger.debug("Created partition %s.", partition)
+
                 with conn.begin(), stopwatch:
                     res = conn.execute(
                         "SELECT * FROM archive_current_metrics(%s, %s, %s)",
@@ -186,7 +224,7 @@ def check_data_worker(app, host_id, instance_id, data):
     # Worker in charge of checking preprocessed monitoring values
     worker_session = Session(bind=worker_engine(app.config.repository))
 
-    check_preprocessed_data(app, worker_session, host_id, instance_id)
+    check_preprocessed_data(app, worker_session, host_id, instance_id, [data])
 
     worker_session.commit()
     worker_session.close()
@@ -194,14 +232,74 @@ def check_data_worker(app, host_id, instance_id, data):
 
 @workers.schedule(id="purge_data", redo_interval=24 * 60 * 60)  # 24h
 @workers.register(pool_size=1)
-def purge_data_worker(app):
+def purge_data_worker(app, dry_run=False):
     """Background worker in charge of purging monitoring data. Purge policy
     is based on purge_after parameter from monitoring section. purger_after
     defines the number of day of data to keep, from now. Default value means
     there is no purge policy.
+
+    Partitions holding only expired data are dropped. Thus partitioned
+    tables keep expired data until the whole partition expires, up to one
+    month with monthly partitions. Rows are deleted only from tables not
+    partitioned and from legacy partitions, holding data prior to
+    partitioning. With dry_run, only report partitions to drop, their size
+    and rows to delete.
     """
 
     engine = worker_engine(app.config.repository)
+    if not dry_run:
+        purge_inventory(engine)
+
+    if not app.config.monitoring.purge_after:
+        logger.info("No purge policy, end.")
+        return
+
+    logger.debug("Purging old data.")
+    nday = app.config.monitoring.purge_after
+
+    with engine.connect() as conn:
+        # Get metric tables to purge, all tiers included, with legacy
+        # partition still attached if any.
+        res = conn.execute(
+            dedent("""
+                SELECT
+                    p.relname AS tablename, p.relkind = 'p' AS partitioned,
+                    (SELECT c.relname
+                     FROM pg_catalog.pg_inherits
+                     JOIN pg_catalog.pg_class AS c ON c.oid = inhrelid
+                     WHERE inhparent = p.oid AND c.relname = p.relname || '_legacy'
+                    ) AS legacy
+                FROM pg_catalog.pg_class AS p
+                WHERE p.relnamespace = 'monitoring'::regnamespace
+                    AND p.relkind IN ('r', 'p')
+                    AND NOT p.relispartition
+                    AND p.relname ~ '^metric_.+_(current|history)$'
+                ORDER BY tablename;
+            """)  # noqa
+        )
+        tables = [(r["tablename"], r["partitioned"], r["legacy"]) for r in res]
+        tables.extend([("state_changes", False, None), ("check_changes", False, None)])
+
+        reclaimed = 0
+        for tablename, partitioned, legacy in tables:
+            history = tablename.endswith("_history")
+            if not partitioned:
+                purge_rows(conn, tablename, nday, history, dry_run)
+                continue
+
+            dropped = purge_partitions(conn, tablename, nday, dry_run)
+            reclaimed += sum(nb_bytes for _, nb_bytes in dropped)
+            if legacy and legacy not in [partition for partition, _ in dropped]:
+                purge_rows(conn, legacy, nday, history, dry_run)
+
+    if dry_run:
+        logger.info("Purge would reclaim %s bytes.", reclaimed)
+    else:
+        logger.info("Purge reclaimed %s bytes.", reclaimed)
+    logger.debug("End of monitoring data purge worker.")
+
+
+def purge_inventory(engine):
     with engine.begin() as conn:
         logger.debug("Purging instances.")
         result = conn.execute(QUERIES["monitoring-purge-instances"])
@@ -219,71 +317,70 @@ def purge_data_worker(app):
         if result.rowcount:
             logger.info("Purged orphaned hosts. count=%s", result.rowcount)
 
-    if not app.config.monitoring.purge_after:
-        logger.info("No purge policy, end.")
-        return
-
-    logger.debug("Purging old data.")
 
-    with engine.connect() as conn:
-        # Get tablename list to purge from metric_tables_config()
+def purge_partitions(conn, tablename, nday, dry_run=False):
+    # Drop partitions of tablename older than nday days. Returns dropped
+    # partitions and their size.
+    if tablename.endswith("_history"):
+        # A history range may end one day after the partition bound.
+        nday += 1
+    with conn.begin():
         res = conn.execute(
-            dedent("""
-                SELECT
-                    tablename
-                FROM (
-                    SELECT
-                        tablename_prefix||'_'||suffix AS tablename
-                    FROM
-                        json_object_keys(monitoring.metric_tables_config()) AS tablename_prefix,
-                        UNNEST(ARRAY['30m_current', '6h_current', 'current', 'history']) AS suffix
-                ) AS q
-                WHERE EXISTS (
-                    SELECT 1
-                    FROM
-                        pg_catalog.pg_tables AS pgt
-                    WHERE
-                        pgt.tablename=q.tablename
-                        AND pgt.schemaname = 'monitoring'
-                )
-                ORDER BY tablename;
-            """)  # noqa
+            text(
+                "SELECT * FROM monitoring.purge_partitions("
+                ":tablename, NOW() - ':nday days'::INTERVAL, :dry_run)"
+            ),
+            tablename=tablename,
+            nday=nday,
+            dry_run=dry_run,
         )
-        tablenames = [r["tablename"] for r in res.fetchall()]
-        tablenames.extend(["state_changes", "check_changes"])
-
-        purge_query_base = "DELETE FROM :tablename WHERE "
-
-        for tablename in tablenames:
-            # With history tables, we have to deal with tstzrange
-            if tablename.endswith("_history"):
-                query = (
-                    purge_query_base
-                    + "NOT (history_range && tstzrange(NOW() "
-                    + "- ':nday days'::INTERVAL, NOW()))"
-                )
-            else:
-                query = purge_query_base + "datetime < (NOW() - ':nday days'::INTERVAL)"
+        partitions = res.fetchall()
+
+    for partition, nb_bytes in partitions:
+        logger.info(
+            "%s %s. bytes=%s",
+            "Would drop" if dry_run else "Dropped",
+            partition,
+            nb_bytes,
+        )
+    return partitions
 
-            logger.debug("Purging table %s", tablename)
-            t = conn.begin()
-            try:
-                res_delete = conn.execute(
-                    text(query),
-                    tablename=AsIs("monitoring.%s" % tablename),
-                    nday=app.config.monitoring.purge_after,
-                )
-                t.commit()
-            except (ProgrammingError, IntegrityError) as e:
-                logger.exception(e)
-                logger.error("Could not delete data from table %s", tablename)
-                t.rollback()
-                continue
 
-            if res_delete.rowcount > 0:
-                logger.info("%s purged. count=%s", tablename, res_delete.rowcount)
+def purge_rows(conn, tablename, nday, history=False, dry_run=False):
+    # With history tables, we have to deal with tstzrange.
+    if history:
+        where = (
+            "lower(history_range) < NOW() - ':nday days'::INTERVAL "
+            "AND NOT (history_range && tstzrange(NOW() "
+            "- ':nday days'::INTERVAL, NOW()))"
+        )
+    else:
+        where = "datetime < (NOW() - ':nday days'::INTERVAL)"
 
-    logger.debug("End of monitoring data purge worker.")
+    if dry_run:
+        query = "SELECT count(*) FROM :tablename WHERE " + where
+    else:
+        query = "DELETE FROM :tablename WHERE " + where
+
+    logger.debug("Purging table %s", tablename)
+    t = conn.begin()
+    try:
+        res = conn.execute(
+            text(query), tablename=AsIs("monitoring.%s" % tablename), nday=nday
+        )
+        count = res.scalar() if dry_run else res.rowcount
+        t.commit()
+    except (ProgrammingError, IntegrityError) as e:
+        logger.exception(e)
+        logger.error("Could not delete data from table %s", tablename)
+        t.rollback()
+        return
+
+    if count > 0:
+        if dry_run:
+            logger.info("%s would be purged. count=%s", tablename, count)
+        else:
+            logger.info("%s purged. count=%s", tablename, count)
 
 
 @workers.register(pool_size=1)
@@ -422,11 +519,16 @@ def schedule_collector(app):
 
 @workers.register(pool_size=20)
 def collector_batch(app, batch):
-    # Start new ORM DB session
-    engine = worker_engine(app.config.repository)
+    # Collect agents of the batch concurrently. Threads mostly wait for
+    # agents, repository connections are bounded by a small engine pool.
+    concurrency = min(len(batch), app.config.monitoring.collect_concurrency)
+    engine = worker_engine(
+        app.config.repository, pool_size=2, max_overflow=0, pool_timeout=120
+    )
     engine.connect().close()  # Warm pool.
 
-    for address, port in batch:
+    def collect(agent):
+        address, port = agent
         try:
             collector(app, address, port, engine=engine)
         except UserError:
@@ -434,6 +536,57 @@ def collector_batch(app, batch):
         except Exception as e:
             logger.exception("Failed to collect %s:%s: %s", address, port, e)
 
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="collector") as executor:
+        # Consume results to raise UserError.
+        for _ in executor.map(collect, batch):
+            pass
+
+
+def insert_points(session, points, agent_id, max_duration):
+    logger.debug("Insert %s points. agent=%s", len(points), agent_id)
+    metrics = []
+    for row, host, instance_id in points:
+        instance_d = row["instances"][0]
+        insert_availability(
+            session, row["datetime"], instance_id, instance_d["available"]
+        )
+        labels = dict(
+            agent=agent_id,
+            # transform to ISOFORMAT (same as journalctl)
+            timestamp=row["datetime"].replace(" +", "+").replace(" ", "T"),
+        )
+        metrics.append((host.host_id, instance_id, row["data"], labels))
+    count = insert_metrics(session, metrics, max_duration=max_duration)
+    session.commit()
+    logger.debug("Inserted %s metric rows. agent=%s", count, agent_id)
+
+
+def reject_row(session, instance_id, host, row, e):
+    # Wrong data type or corrupted data could lead to DataError. In this case
+    # we should consider this row as unvalid and move to the next one.
+    try:
+        last_insert = datetime.strptime(row["datetime"], "%Y-%m-%d %H:%M:%S +0000")
+    except ValueError:
+        # If row datetime could not be parsed, we should fallback to current
+        # datetime. This will result to ignore potential valid rows between
+        # row datetime and now, but this is better than letting the
+        # collector stucked for ever on an invalid row.
+        last_insert = datetime.utcnow()
+
+    logger.exception(str(e))
+    session.rollback()
+    if instance_id:
+        logger.debug("Set collector status to FAIL for %s.", host)
+        update_collector_status(
+            session,
+            instance_id,
+            "FAIL",
+            last_pull=datetime.utcnow(),
+            last_insert=last_insert,
+        )
+        session.commit()
+    logger.debug("Continue with the next row.")
+
 
 @workers.register(pool_size=20)
 def collector(app, address, port, engine=None):
@@ -448,8 +601,9 @@ def collector(app, address, port, engine=None):
     instance = get_instance(worker_session, address, port)
     worker_session.expunge(instance)
     host_id = instance_id = None
-    # Agent monitoring API endpoint
-    history_url = "/monitoring/history?limit=100"
+    # Agent monitoring API endpoint. Older agents ignore format and answer
+    # JSON.
+    history_url = "/monitoring/history?limit=100&format=frames"
     start = None
     try:
         # Trying to find host_id, instance_id and the datetime of the latest
@@ -481,6 +635,9 @@ def collector(app, address, port, engine=None):
             start = collector_status.last_insert + timedelta(seconds=1)
             history_url += "&start=%s" % start.strftime("%Y-%m-%dT%H:%M:%SZ")
 
+    # Release repository connection while waiting for agent.
+    worker_session.rollback()
+
     # Finally, let's call /monitoring/history agent API for getting metrics
     # history.
     try:
@@ -505,7 +662,9 @@ def collector(app, address, port, engine=None):
         worker_session.close()
         return
     else:
-        rows = response.json()
+        rows = read_history(response)
+    finally:
+        client.close()
 
     # monitoring is still the better place to queue a discover. This allow us
     # to have sub-minute reactivity on instance change.
@@ -538,76 +697,62 @@ def collector(app, address, port, engine=None):
             return
         logger.debug("Instance %s returned no monitoring data.", instance)
 
+    # First, merge inventory. Consecutive rows usually share the same host
+    # and instance info, merge only changes.
+    points = []
+    inventory = host = None
     for row in rows:
         logger.debug("Got points for %s at %s.", instance, row["datetime"])
         hostinfo = row["hostinfo"]
-        data = row["data"]
         instance_d = row["instances"][0]
+        key = json.dumps([hostinfo, instance_d], sort_keys=True, default=str)
+        if key == inventory:
+            points.append((row, host, instance_id))
+            continue
 
         try:
-            # Try to insert collected data
-
             logger.debug("Update the inventory for %s. agent=%s", instance, agent_id)
             host = merge_agent_info(worker_session, hostinfo, instance_d)
             instance_id = get_instance_id(
                 worker_session, host.host_id, instance.pg_port
             )
-            logger.debug(
-                "Insert instance availability for %s. agent=%s", instance, agent_id
-            )
-            insert_availability(
-                worker_session, row["datetime"], instance_id, instance_d["available"]
-            )
-            worker_session.commit()
-            logger.debug(
-                "Insert collected metrics for %s. agent=%s", instance, agent_id
-            )
-            insert_metrics(
-                worker_session,
-                host.host_id,
-                instance_id,
-                data,
-                dict(
-                    agent=agent_id,
-                    timestamp=(
-                        # transform to ISOFORMAT (same as journalctl)
-                        row["datetime"].replace(" +", "+").replace(" ", "T")
-                    ),
-                ),
-                max_duration=app.config.monitoring.collect_max_duration,
-            )
-        except UserError:
-            raise
         except DataError as e:
-            # Wrong data type or corrupted data could lead to DataError. In
-            # this case we should consider this row as unvalid and move to the
-            # next one.
-            try:
-                last_insert = datetime.strptime(
-                    row["datetime"], "%Y-%m-%d %H:%M:%S +0000"
-                )
-            except ValueError:
-                # If row datetime could not be parsed, we should fallback to
-                # current datetime. This will result to ignore potential valid
-                # rows between row datetime and now, but this is better than
-                # letting the collector stucked for ever on an invalid row.
-                last_insert = datetime.utcnow()
-
-            logger.exception(str(e))
-            worker_session.rollback()
-            if instance_id:
-                logger.debug("Set collector status to FAIL for %s.", host)
-                update_collector_status(
-                    worker_session,
-                    instance_id,
-                    "FAIL",
-                    last_pull=datetime.utcnow(),
-                    last_insert=last_insert,
-                )
-                worker_session.commit()
-            logger.debug("Continue with the next row.")
+            inventory = None
+            reject_row(worker_session, instance_id, host, row, e)
             continue
+        inventory = key
+        points.append((row, host, instance_id))
 
+    # Then, load all points in a single transaction. On data error, fallback
+    # to one transaction per point to skip invalid rows.
+    max_duration = app.config.monitoring.collect_max_duration
+    try:
+        insert_points(worker_session, points, agent_id, max_duration)
+    except UserError:
+        raise
+    except (DataError, psycopg2.DataError) as e:
+        logger.warning("Failed to insert points in bulk: %s", e)
+        logger.warning("Inserting points one by one. agent=%s", agent_id)
+        worker_session.rollback()
+        inserted = []
+        for point in points:
+            row, host, instance_id = point
+            try:
+                insert_points(worker_session, [point], agent_id, max_duration)
+            except UserError:
+                raise
+            except (DataError, psycopg2.DataError) as e:
+                reject_row(worker_session, instance_id, host, row, e)
+            else:
+                inserted.append(point)
+        points = inserted
+
+    # Preprocessed data by host and instance, and enabled checks by instance.
+    checked = {}
+    checks = {}
+    for row, host, instance_id in points:
+        hostinfo = row["hostinfo"]
+        instance_d = row["instances"][0]
         logger.debug("Update collector status for agent %s.", agent_id)
         update_collector_status(
             worker_session,
@@ -625,10 +770,6 @@ def collector(app, address, port, engine=None):
         )
         worker_session.commit()
 
-        logger.debug(
-            "Apply alerting checks against preprocessed data for agent %s.", agent_id
-        )
-
         # Hack: copy max_connections in metrics data to pass max_connections to
         # alert processing. max_connections does NOT have the same type of
         # other metrics in data. This is because alerting.PreProcess functions
@@ -636,23 +777,22 @@ def collector(app, address, port, engine=None):
         if "max_connections" in instance_d:
             row["data"]["max_connections"] = instance_d["max_connections"]
 
+        if instance_id not in checks:
+            checks[instance_id] = get_instance_checks(worker_session, instance_id)
+        ppdata = preprocess_data(row["data"], checks[instance_id], row["datetime"])
+        checked.setdefault((host.host_id, instance_id), []).append(ppdata)
+        logger.debug("Row with datetime=%s inserted", row["datetime"])
+
+    # Evaluate checks of all points at once.
+    for (host_id, instance_id), ppdatas in checked.items():
+        logger.debug(
+            "Apply alerting checks against preprocessed data for agent %s.", agent_id
+        )
         try:
-            check_preprocessed_data(
-                app,
-                worker_session,
-                host.host_id,
-                instance_id,
-                preprocess_data(
-                    row["data"],
-                    get_instance_checks(worker_session, instance_id),
-                    row["datetime"],
-                ),
-            )
+            check_preprocessed_data(app, worker_session, host_id, instance_id, ppdatas)
         except Exception:
             logger.exception("Failed to check monitoring data for alerting.")
-
-        logger.debug("Row with datetime=%s inserted", row["datetime"])
-        worker_session.commit()
+            worker_session.rollback()
 
     worker_session.close()
     logger.debug("Collect done. agent=%s", agent_id)
@@ -1,10 +1,23 @@
 import datetime
+import hashlib
+import re
+from collections import Counter
 from io import StringIO
 from textwrap import dedent
 
 from psycopg2.extensions import AsIs
+from temboardtoolkit.validators import commalist
 
-from .pivot import pivot_timeserie
+from .downsample import downsample_timeserie
+from .pivot import PivotWriter
+
+# Agent collects a point per minute.
+RAW_PERIOD = 60
+TIER_UNITS = dict(m=60, h=60 * 60, d=24 * 60 * 60)
+# Number of points of a chart.
+DEFAULT_POINTS = 720
+# Expansion of raw points in metric queries, after mogrify.
+EXPAND_RE = re.compile(r"expand_data_by_\w+\(.*?\)\s+AS\s+\([^)]*\)", re.S)
 
 METRICS = dict(
     blocks=dict(
@@ -130,7 +143,7 @@ SELECT
     datetime AS date,
     dbname,
     (record).size
-FROM expand_data_by_instance_id('metric_db_size', tstzrange(%(start)s, %(end)s), %(instance_id))
+FROM expand_data_by_instance_id('metric_db_size', tstzrange(%(start)s, %(end)s), %(instance_id)s)
 AS (datetime timestamp with time zone, instance_id integer, dbname text, record metric_db_size_record)
         """,  # noqa
         sql_zoom="""
@@ -807,48 +820,152 @@ ORDER BY 1
 )
 
 
-def zoom_level(start, end):
-    zoom = 0
+def tier_seconds(period):
+    return int(period[:-1]) * TIER_UNITS[period[-1]]
+
+
+def tiers(raw):
+    # Validates aggregate_tiers parameter. Returns periods from finest to
+    # coarsest.
+    if isinstance(raw, str):
+        raw = commalist(raw)
+    for period in raw:
+        if not re.match(r"^[1-9][0-9]*[mhd]$", period):
+            raise ValueError("Invalid aggregation tier %s" % period)
+        # truncate_time() aligns buckets on hour or day.
+        if dict(m=60, h=24, d=1)[period[-1]] % int(period[:-1]):
+            raise ValueError("Aggregation tier %s must divide 1h or 1d" % period)
+    return sorted(set(raw), key=tier_seconds)
+
+
+def get_tiers(cur, probename):
+    # Returns (period, since) of tiers aggregated for metric, from finest to
+    # coarsest.
+    cur.execute(
+        "SELECT period, since FROM aggregate_watermarks WHERE tablename = %s",
+        ("metric_" + probename,),
+    )
+    return sorted(cur.fetchall(), key=lambda row: tier_seconds(row[0]))
+
+
+def zoom_level(start, end, tiers=(), points=DEFAULT_POINTS):
+    # Choose the finest table giving at most `points` points for the range.
+    # Returns the tier period or None for raw points.
+    #
+    # tiers is a list of (period, since) tuples, from finest to coarsest.
+    # Prefer tiers aggregated since before start of range.
+    utc = datetime.timezone.utc
+    start = start if start.tzinfo else start.replace(tzinfo=utc)
     if end:
-        d = end - start
+        end = end if end.tzinfo else end.replace(tzinfo=utc)
     else:
-        d = datetime.datetime.utcnow() - start
+        end = datetime.datetime.now(utc)
 
-    if d.days > 1 and d.days <= 31:
-        zoom = 1
-    elif d.days > 31 and d.days <= 365:
-        zoom = 2
-    elif d.days > 365:
-        zoom = 2
-    return zoom
+    resolution = (end - start).total_seconds() / points
+    if resolution <= RAW_PERIOD or not tiers:
+        return None
+
+    covering = [period for period, since in tiers if since and since <= start]
+    covering = covering or [period for period, _ in tiers]
+    for period in covering:
+        if tier_seconds(period) >= resolution:
+            return period
+    return covering[-1]
 
 
 def get_tablename(probename, zoom):
-    if zoom == 1:
-        return "metric_%s_30m_current" % (probename)
-    elif zoom == 2:
-        return "metric_%s_6h_current" % (probename)
-    else:
-        return
+    if zoom:
+        return "metric_%s_%s_current" % (probename, zoom)
 
 
-def get_metric_data_csv(
-    session, metric_name, start, end, host_id=None, instance_id=None, key=None
+def align_start(start, level):
+    # Truncates start of chart range to the period of zoom level, for charts
+    # of sliding ranges to share data and cache key between refreshes.
+    utc = datetime.timezone.utc
+    start = start if start.tzinfo else start.replace(tzinfo=utc)
+    period = tier_seconds(level) if level else RAW_PERIOD
+    epoch = int(start.timestamp())
+    return datetime.datetime.fromtimestamp(epoch - epoch % period, utc)
+
+
+def get_metric_etag(
+    session,
+    metric_name,
+    start,
+    end,
+    host_id=None,
+    instance_id=None,
+    key=None,
+    points=None,
 ):
+    # Returns a validator of metric data for the range, without reading data.
+    #
+    # Data changes only when collector inserts points or when aggregation
+    # writes buckets of the tier. Aggregation increments revision of the tier
+    # on each bucket written and on late points. There is no point after last
+    # insert, thus end is clamped to last insert to share the tag between
+    # charts ending now.
     if metric_name not in METRICS:
         raise IndexError("Metric '%s' not found" % metric_name)
 
     metric = METRICS.get(metric_name)
-    # Instanciate a new string buffer needed by copy_expert()
-    data_buffer = StringIO()
-    # Get a new psycopg2 cursor from the current sqlalchemy session
     cur = session.connection().connection.cursor()
-    # Change working schema to 'monitoring'
     cur.execute("SET search_path TO monitoring")
-    # Get the "zoom level", depending on the time interval
-    level = zoom_level(start, end)
+    level = zoom_level(
+        start, end, get_tiers(cur, metric["probename"]), points or DEFAULT_POINTS
+    )
+    if points:
+        start = align_start(start, level)
+    # Raw level sums revisions of all tiers, incremented by late points.
+    cur.execute(
+        dedent("""\
+        SELECT
+            (SELECT last_insert FROM collector_status
+             WHERE instance_id = %(instance_id)s),
+            max(bucket),
+            sum(revision)
+        FROM aggregate_watermarks
+        WHERE tablename = %(tablename)s AND (period = %(period)s OR %(period)s IS NULL)
+        """),
+        dict(
+            instance_id=instance_id,
+            tablename="metric_" + metric["probename"],
+            period=level,
+        ),
+    )
+    last_insert, bucket, revision = cur.fetchone()
+    cur.close()
+
+    # last_insert is UTC without time zone.
+    utc = datetime.timezone.utc
+    if last_insert:
+        last_insert = last_insert.replace(tzinfo=utc)
+    if end and not end.tzinfo:
+        end = end.replace(tzinfo=utc)
+    if end is None or (last_insert and end > last_insert):
+        end = last_insert
+
+    key = (metric_name, host_id, instance_id, key, start, end, points, level)
+    key += (bucket, revision)
+    return '"%s"' % hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+
+def build_metric_query(
+    cur, metric_name, start, end, host_id=None, instance_id=None, key=None, points=None
+):
+    # Returns metric definition and SQL query of metric for the range.
+    if metric_name not in METRICS:
+        raise IndexError("Metric '%s' not found" % metric_name)
+
+    metric = METRICS.get(metric_name)
+    # Get the aggregation tier, depending on the time interval and points
+    level = zoom_level(
+        start, end, get_tiers(cur, metric["probename"]), points or DEFAULT_POINTS
+    )
+    if points:
+        start = align_start(start, level)
     # Load query template
-    q_tpl = metric.get("sql_nozoom") if level == 0 else metric.get("sql_zoom")
+    q_tpl = metric.get("sql_nozoom") if level is None else metric.get("sql_zoom")
     tablename = get_tablename(metric.get("probename"), level)
     query = cur.mogrify(
         q_tpl,
@@ -861,7 +978,25 @@ def get_metric_data_csv(
             tablename=AsIs(tablename),
         ),
     )
-    query = query.strip().decode("utf-8")
+    return metric, query.strip().decode("utf-8")
+
+
+def copy_metric_data(cur, metric, query, output, points=None):
+    # Writes CSV data of query to output file-like object. Data is streamed
+    # from COPY to output unless points is set, reducing each serie to this
+    # number of points.
+
+    # Downsampling requires the whole serie. Its size is bounded by zoom level.
+    sink = StringIO() if points else output
+    if metric.get("pivot"):
+        # Apply pivot rotation while copying.
+        sink = PivotWriter(
+            index=metric.get("pivot").get("index"),
+            key=metric.get("pivot").get("key"),
+            value=metric.get("pivot").get("value"),
+            output=sink,
+        )
+
     # Retreive data using copy_expert()
     cur.copy_expert(
         dedent("""\
@@ -872,27 +1007,79 @@ def get_metric_data_csv(
     ) TO STDOUT WITH CSV HEADER
     """)
         % (query,),
-        data_buffer,
+        sink,
     )
-    cur.close()
 
     if metric.get("pivot"):
-        # Apply pivot rotation
-        data_pivot = StringIO()
-        pivot_timeserie(
-            data_buffer,
-            index=metric.get("pivot").get("index"),
-            key=metric.get("pivot").get("key"),
-            value=metric.get("pivot").get("value"),
-            output=data_pivot,
+        sink.close()
+        sink = sink.output
+
+    if points:
+        output.write(downsample_timeserie(sink.getvalue(), points))
+        sink.close()
+
+
+def get_metric_data_csv(
+    session,
+    metric_name,
+    start,
+    end,
+    output,
+    host_id=None,
+    instance_id=None,
+    key=None,
+    points=None,
+):
+    # Writes CSV data of metric for the range to output file-like object.
+
+    # Get a new psycopg2 cursor from the current sqlalchemy session
+    cur = session.connection().connection.cursor()
+    # Change working schema to 'monitoring'
+    cur.execute("SET search_path TO monitoring")
+    metric, query = build_metric_query(
+        cur, metric_name, start, end, host_id, instance_id, key, points
+    )
+    copy_metric_data(cur, metric, query, output, points)
+    cur.close()
+
+
+def get_metrics_data_csv(
+    session, metric_names, start, end, host_id=None, instance_id=None, points=None
+):
+    # Returns a dict of CSV data by metric for the range, on one cursor.
+    #
+    # Raw points expanded identically by several metrics are expanded once in
+    # a temporary table dropped at commit.
+    cur = session.connection().connection.cursor()
+    cur.execute("SET search_path TO monitoring")
+    queries = {
+        name: build_metric_query(
+            cur, name, start, end, host_id, instance_id, points=points
         )
+        for name in metric_names
+    }
 
-        data = data_pivot.getvalue()
-        data_buffer.close()
-        data_pivot.close()
-    else:
-        data = data_buffer.getvalue()
-        data_buffer.close()
+    expansions = Counter(
+        m.group(0) for _, query in queries.values() for m in EXPAND_RE.finditer(query)
+    )
+    shared = {}
+    for expansion, count in sorted(expansions.items()):
+        if count < 2:
+            continue
+        shared[expansion] = "expanded_%d" % len(shared)
+        cur.execute(
+            "CREATE TEMPORARY TABLE %s ON COMMIT DROP AS SELECT * FROM %s"
+            % (shared[expansion], expansion)
+        )
+
+    data = {}
+    for name, (metric, query) in queries.items():
+        for expansion, tablename in shared.items():
+            query = query.replace(expansion, tablename)
+        output = StringIO()
+        copy_metric_data(cur, metric, query, output, points)
+        data[name] = output.getvalue()
+    cur.close()
     return data
 
 
@@ -0,0 +1,63 @@
+import csv
+
+
+def lttb(values, threshold):
+    # Largest-Triangle-Three-Buckets downsampling.
+    #
+    # values is a list of (x, y) tuples, ordered by x. Returns indices of at
+    # most threshold values keeping the visual shape of the serie: first and
+    # last values, then in each bucket the value forming the largest
+    # triangle with the previously selected value and the average of the next
+    # bucket.
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int((i + 1) * every) + 1
+        end = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(x for x, _ in values[start:end]) / (end - start)
+        avg_y = sum(y for _, y in values[start:end]) / (end - start)
+
+        ax, ay = values[a]
+        best, best_area = None, -1
+        for j in range(int(i * every) + 1, start):
+            x, y = values[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def downsample_timeserie(data, points):
+    # Reduce CSV time serie to the rows selected by LTTB for each column.
+    #
+    # First column is the date, other columns are series. Rows are kept
+    # whole so that series are not broken. Rows position is used as x, rows
+    # being nearly evenly spaced in time.
+    lines = data.splitlines()
+    if len(lines) <= points + 1:
+        return data
+
+    header, lines = lines[0], lines[1:]
+    rows = list(csv.reader(lines))
+    keep = set()
+    for column in range(1, len(next(csv.reader([header])))):
+        values = []
+        for i, row in enumerate(rows):
+            try:
+                y = float(row[column])
+            except (IndexError, ValueError):
+                # Skip empty cell.
+                continue
+            if y == y:  # Skip NaN.
+                values.append((i, y))
+        keep.update(values[j][0] for j in lttb(values, points))
+
+    return "\n".join([header] + [lines[i] for i in sorted(keep)]) + "\n"
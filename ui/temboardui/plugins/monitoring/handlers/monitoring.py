@@ -1,12 +1,34 @@
+import gzip
+import hashlib
 import logging
+from collections import OrderedDict
+from io import StringIO
+from threading import Lock
 
-from temboardui.web.tornado import HTTPError, csvify
+from temboardui.web.tornado import (
+    HTTPError,
+    Response,
+    ResponseStream,
+    csvify,
+    etag_matches,
+    json_encode,
+)
 
-from ..chartdata import get_metric_data_csv, get_unavailability_csv
-from ..tools import get_request_ids, parse_start_end
+from ..chartdata import (
+    METRICS,
+    get_metric_data_csv,
+    get_metric_etag,
+    get_metrics_data_csv,
+    get_unavailability_csv,
+)
+from ..tools import get_request_ids, parse_points, parse_start_end
 from . import blueprint, render_template
 
 logger = logging.getLogger(__name__)
+# Downsampled chart data by ETag, least recently used first. Shared by all
+# users watching the same instance.
+chart_cache = OrderedDict()
+chart_cache_lock = Lock()
 
 
 @blueprint.instance_route("/monitoring")
@@ -37,6 +59,7 @@ def unavailability(request):
 @blueprint.instance_route(r"/monitoring/data/([a-z\-_.0-9]{1,64})$")
 def data_metric(request, metric_name):
     key = request.handler.get_argument("key", default=None)
+    points = parse_points(request)
     try:
         host_id, instance_id = get_request_ids(request)
     except NameError as e:
@@ -44,17 +67,101 @@ def data_metric(request, metric_name):
         return csvify(data=[])
 
     start, end = parse_start_end(request)
+    kwargs = dict(host_id=host_id, instance_id=instance_id, key=key, points=points)
     try:
-        data = get_metric_data_csv(
-            request.db_session,
-            metric_name,
-            start,
-            end,
-            host_id=host_id,
-            instance_id=instance_id,
-            key=key,
-        )
+        etag = get_metric_etag(request.db_session, metric_name, start, end, **kwargs)
     except IndexError:
         raise HTTPError(404, "Unknown metric.")
 
-    return csvify(data=data)
+    # no-cache requires browser to revalidate its copy with If-None-Match.
+    headers = {"Cache-Control": "no-cache", "ETag": etag}
+    if etag_matches(request, etag):
+        return Response(304, headers=headers)
+
+    headers["Content-Type"] = "text/csv"
+
+    if not points:
+        # Raw export may be large, don't cache it.
+        stream = ResponseStream(request.handler, headers=headers)
+        get_metric_data_csv(
+            request.db_session, metric_name, start, end, stream, **kwargs
+        )
+        return stream.close()
+
+    data = get_cached_chart(etag)
+    if data is None:
+        buffer = StringIO()
+        get_metric_data_csv(
+            request.db_session, metric_name, start, end, buffer, **kwargs
+        )
+        data = buffer.getvalue()
+        cache_chart(request, etag, data)
+
+    return Response(headers=headers, body=data)
+
+
+@blueprint.instance_route(r"/monitoring/data")
+def data_metrics(request):
+    # Serves several metrics for the same range in one gzipped JSON object of
+    # CSV data by metric.
+    metric_names = request.handler.get_argument("metrics", default="").split(",")
+    metric_names = [name for name in metric_names if name]
+    for name in metric_names:
+        if name not in METRICS:
+            raise HTTPError(404, "Unknown metric %s." % name)
+    points = parse_points(request)
+    try:
+        host_id, instance_id = get_request_ids(request)
+    except NameError as e:
+        logger.info("%s. No data.", e)
+        return Response(headers={"Content-Type": "application/json"}, body="{}")
+
+    start, end = parse_start_end(request)
+    kwargs = dict(host_id=host_id, instance_id=instance_id, points=points)
+    etags = {
+        name: get_metric_etag(request.db_session, name, start, end, **kwargs)
+        for name in metric_names
+    }
+    etag = '"%s"' % hashlib.sha1(" ".join(etags.values()).encode("utf-8")).hexdigest()
+    headers = {"Cache-Control": "no-cache", "ETag": etag, "Vary": "Accept-Encoding"}
+    if etag_matches(request, etag):
+        return Response(304, headers=headers)
+
+    data = {}
+    if points:
+        for name in metric_names:
+            cached = get_cached_chart(etags[name])
+            if cached is not None:
+                data[name] = cached
+
+    missing = [name for name in metric_names if name not in data]
+    if missing:
+        fetched = get_metrics_data_csv(
+            request.db_session, missing, start, end, **kwargs
+        )
+        for name, csv in fetched.items():
+            if points:
+                cache_chart(request, etags[name], csv)
+            data[name] = csv
+
+    headers["Content-Type"] = "application/json; charset=UTF-8"
+    body = json_encode(data).encode("utf-8")
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    return Response(headers=headers, body=body)
+
+
+def get_cached_chart(etag):
+    with chart_cache_lock:
+        data = chart_cache.get(etag)
+        if data is not None:
+            chart_cache.move_to_end(etag)
+    return data
+
+
+def cache_chart(request, etag, data):
+    with chart_cache_lock:
+        chart_cache[etag] = data
+        while len(chart_cache) > request.config.monitoring.chart_cache_size:
+            chart_cache.popitem(last=False)
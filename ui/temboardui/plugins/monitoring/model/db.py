@@ -2,11 +2,18 @@ import functools
 import logging
 from textwrap import dedent
 
+from psycopg2.extras import execute_values
+
 logger = logging.getLogger(__name__.replace(".db", ""))
 
+# Map agent metric name to (level, row builder). Builders return the row of
+# monitoring.metric_<name>_current for a point, or None if the point is
+# incomplete. level tells whether rows reference host_id or instance_id.
+METRICS = {}
+
 
 def handle_keyerror(fun):
-    metric_name = fun.__name__.replace("insert_metric_", "")
+    metric_name = fun.__name__.replace("_values", "")
 
     @functools.wraps(fun)
     def wrapper(*a, **kw):
@@ -18,6 +25,55 @@ def handle_keyerror(fun):
     return wrapper
 
 
+def register(name, level="instance"):
+    def decorator(fun):
+        fun = handle_keyerror(fun)
+        METRICS[name] = (level, fun)
+        return fun
+
+    return decorator
+
+
+def insert_metric_rows(session, name, rows, page_size=1000):
+    # Load rows in metric table with multi-row INSERT, in session
+    # transaction.
+    cur = session.connection().connection.cursor()
+    execute_values(
+        cur,
+        f"INSERT INTO monitoring.metric_{name}_current VALUES %s",
+        rows,
+        page_size=page_size,
+    )
+
+
+def flag_late_points(session, datetimes):
+    # Record points older than last aggregated bucket, for aggregation to
+    # recompute their buckets. datetimes maps metric name to datetimes of
+    # inserted points. Revision of tiers of tables with late points is
+    # incremented to invalidate chart caches.
+    values = [("metric_" + name, dt) for name, dts in datetimes.items() for dt in dts]
+    if not values:
+        return
+    cur = session.connection().connection.cursor()
+    execute_values(
+        cur,
+        dedent("""\
+        WITH late AS (
+          INSERT INTO monitoring.aggregate_late_points (tablename, datetime)
+          SELECT DISTINCT v.tablename, v.datetime::TIMESTAMPTZ
+          FROM (VALUES %s) AS v (tablename, datetime)
+          JOIN monitoring.aggregate_watermarks AS w USING (tablename)
+          WHERE v.datetime::TIMESTAMPTZ < w.bucket
+          RETURNING tablename
+        )
+        UPDATE monitoring.aggregate_watermarks
+        SET revision = revision + 1
+        WHERE tablename IN (SELECT tablename FROM late)
+        """),
+        values,
+    )
+
+
 def insert_availability(session, dt, instance_id, available):
     session.execute(
         dedent("""
@@ -31,392 +87,258 @@ def insert_availability(session, dt, instance_id, available):
     )
 
 
-@handle_keyerror
-def insert_metric_sessions(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_sessions_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(
-                None,
-                metric["active"],
-                metric["waiting"],
-                metric["idle"],
-                metric["idle_in_xact"],
-                metric["idle_in_xact_aborted"],
-                metric["fastpath"],
-                metric["disabled"],
-                metric["no_priv"],
-            ),
+@register("sessions")
+def sessions_values(instance_id, metric):
+    return (
+        metric["datetime"],
+        instance_id,
+        metric["dbname"],
+        (
+            None,
+            metric["active"],
+            metric["waiting"],
+            metric["idle"],
+            metric["idle_in_xact"],
+            metric["idle_in_xact_aborted"],
+            metric["fastpath"],
+            metric["disabled"],
+            metric["no_priv"],
         ),
     )
 
 
-@handle_keyerror
-def insert_metric_xacts(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_xacts_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["n_commit"],
-                metric["n_rollback"],
-            ),
+@register("xacts")
+def xacts_values(instance_id, metric):
+    return (
+        metric["datetime"],
+        instance_id,
+        metric["dbname"],
+        (
+            None,
+            str(metric["measure_interval"]),
+            metric["n_commit"],
+            metric["n_rollback"],
         ),
     )
 
 
-@handle_keyerror
-def insert_metric_locks(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_locks_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(
-                None,
-                metric["access_share"],
-                metric["row_share"],
-                metric["row_exclusive"],
-                metric["share_update_exclusive"],
-                metric["share"],
-                metric["share_row_exclusive"],
-                metric["exclusive"],
-                metric["access_exclusive"],
-                metric["siread"],
-                metric["waiting_access_share"],
-                metric["waiting_row_share"],
-                metric["waiting_row_exclusive"],
-                metric["waiting_share_update_exclusive"],
-                metric["waiting_share"],
-                metric["waiting_share_row_exclusive"],
-                metric["waiting_exclusive"],
-                metric["waiting_access_exclusive"],
-            ),
+@register("locks")
+def locks_values(instance_id, metric):
+    return (
+        metric["datetime"],
+        instance_id,
+        metric["dbname"],
+        (
+            None,
+            metric["access_share"],
+            metric["row_share"],
+            metric["row_exclusive"],
+            metric["share_update_exclusive"],
+            metric["share"],
+            metric["share_row_exclusive"],
+            metric["exclusive"],
+            metric["access_exclusive"],
+            metric["siread"],
+            metric["waiting_access_share"],
+            metric["waiting_row_share"],
+            metric["waiting_row_exclusive"],
+            metric["waiting_share_update_exclusive"],
+            metric["waiting_share"],
+            metric["waiting_share_row_exclusive"],
+            metric["waiting_exclusive"],
+            metric["waiting_access_exclusive"],
         ),
     )
 
 
-@handle_keyerror
-def insert_metric_blocks(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_blocks_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["blks_read"],
-                metric["blks_hit"],
-                metric["hitmiss_ratio"],
-            ),
+@register("blocks")
+def blocks_values(instance_id, metric):
+    return (
+        metric["datetime"],
+        instance_id,
+        metric["dbname"],
+        (
+            None,
+            str(metric["measure_interval"]),
+            metric["blks_read"],
+            metric["blks_hit"],
+            metric["hitmiss_ratio"],
         ),
     )
 
 
-@handle_keyerror
-def insert_metric_bgwriter(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_bgwriter_current
-            VALUES (:dt, :instance_id, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["checkpoints_timed"],
-                metric["checkpoints_req"],
-                metric["checkpoint_write_time"],
-                metric["checkpoint_sync_time"],
-                metric["buffers_checkpoint"],
-                metric["buffers_clean"],
-                metric["maxwritten_clean"],
-                metric["buffers_backend"],
-                metric["buffers_backend_fsync"],
-                metric["buffers_alloc"],
-                metric["stats_reset"],
-            ),
+@register("bgwriter")
+def bgwriter_values(instance_id, metric):
+    return (
+        metric["datetime"],
+        instance_id,
+        (
+            None,
+            str(metric["measure_interval"]),
+            metric["checkpoints_timed"],
+            metric["checkpoints_req"],
+            metric["checkpoint_write_time"],
+            metric["checkpoint_sync_time"],
+            metric["buffers_checkpoint"],
+            metric["buffers_clean"],
+            metric["maxwritten_clean"],
+            metric["buffers_backend"],
+            metric["buffers_backend_fsync"],
+            metric["buffers_alloc"],
+            metric["stats_reset"],
         ),
     )
 
 
-@handle_keyerror
-def insert_metric_db_size(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_db_size_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(None, metric["size"]),
-        ),
-    )
+@register("db_size")
+def db_size_values(instance_id, metric):
+    return (metric["datetime"], instance_id, metric["dbname"], (None, metric["size"]))
 
 
-@handle_keyerror
-def insert_metric_tblspc_size(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_tblspc_size_current
-            VALUES (:dt, :instance_id, :spcname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            spcname=metric["spcname"],
-            row=(None, metric["size"]),
-        ),
-    )
+@register("tblspc_size")
+def tblspc_size_values(instance_id, metric):
+    return (metric["datetime"], instance_id, metric["spcname"], (None, metric["size"]))
 
 
-@handle_keyerror
-def insert_metric_fs_size(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_filesystems_size_current
-            VALUES (:dt, :host_id, :mount_point, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            host_id=host_id,
-            mount_point=metric["mount_point"],
-            row=(None, metric["used"], metric["total"], metric["device"]),
-        ),
+@register("filesystems_size", level="host")
+def filesystems_size_values(host_id, metric):
+    return (
+        metric["datetime"],
+        host_id,
+        metric["mount_point"],
+        (None, metric["used"], metric["total"], metric["device"]),
     )
 
 
-@handle_keyerror
-def insert_metric_temp_files_size_delta(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_temp_files_size_delta_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(None, str(metric["measure_interval"]), metric["size"]),
-        ),
+@register("temp_files_size_delta")
+def temp_files_size_delta_values(instance_id, metric):
+    return (
+        metric["datetime"],
+        instance_id,
+        metric["dbname"],
+        (None, str(metric["measure_interval"]), metric["size"]),
     )
 
 
-@handle_keyerror
-def insert_metric_wal_files(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_wal_files_current
-            VALUES (:dt, :instance_id, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["written_size"],
-                metric["current_location"],
-                metric["total"],
-                metric["archive_ready"],
-                metric["total_size"],
-            ),
+@register("wal_files")
+def wal_files_values(instance_id, metric):
+    return (
+        metric["datetime"],
+        instance_id,
+        (
+            None,
+            str(metric["measure_interval"]),
+            metric["written_size"],
+            metric["current_location"],
+            metric["total"],
+            metric["archive_ready"],
+            metric["total_size"],
         ),
     )
 
 
-@handle_keyerror
-def insert_metric_cpu(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_cpu_current
-            VALUES (:dt, :host_id, :cpu, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            host_id=host_id,
-            cpu=metric["cpu"],
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["time_user"],
-                metric["time_system"],
-                metric["time_idle"],
-                metric["time_iowait"],
-                metric["time_steal"],
-            ),
+@register("cpu", level="host")
+def cpu_values(host_id, metric):
+    return (
+        metric["datetime"],
+        host_id,
+        metric["cpu"],
+        (
+            None,
+            str(metric["measure_interval"]),
+            metric["time_user"],
+            metric["time_system"],
+            metric["time_idle"],
+            metric["time_iowait"],
+            metric["time_steal"],
         ),
     )
 
 
-@handle_keyerror
-def insert_metric_process(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_process_current
-            VALUES (:dt, :host_id, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            host_id=host_id,
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["context_switches"],
-                metric["forks"],
-                metric["procs_running"],
-                metric["procs_blocked"],
-                metric["procs_total"],
-            ),
+@register("process", level="host")
+def process_values(host_id, metric):
+    return (
+        metric["datetime"],
+        host_id,
+        (
+            None,
+            str(metric["measure_interval"]),
+            metric["context_switches"],
+            metric["forks"],
+            metric["procs_running"],
+            metric["procs_blocked"],
+            metric["procs_total"],
         ),
     )
 
 
-@handle_keyerror
-def insert_metric_memory(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_memory_current
-            VALUES (:dt, :host_id, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            host_id=host_id,
-            row=(
-                None,
-                metric["mem_total"],
-                metric["mem_used"],
-                metric["mem_free"],
-                metric["mem_buffers"],
-                metric["mem_cached"],
-                metric["swap_total"],
-                metric["swap_used"],
-            ),
+@register("memory", level="host")
+def memory_values(host_id, metric):
+    return (
+        metric["datetime"],
+        host_id,
+        (
+            None,
+            metric["mem_total"],
+            metric["mem_used"],
+            metric["mem_free"],
+            metric["mem_buffers"],
+            metric["mem_cached"],
+            metric["swap_total"],
+            metric["swap_used"],
         ),
     )
 
 
-@handle_keyerror
-def insert_metric_loadavg(session, host_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_loadavg_current
-            VALUES (:dt, :host_id, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            host_id=host_id,
-            row=(None, metric["load1"], metric["load5"], metric["load15"]),
-        ),
+@register("loadavg", level="host")
+def loadavg_values(host_id, metric):
+    return (
+        metric["datetime"],
+        host_id,
+        (None, metric["load1"], metric["load5"], metric["load15"]),
     )
 
 
-@handle_keyerror
-def insert_metric_vacuum_analyze(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_vacuum_analyze_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(
-                None,
-                str(metric["measure_interval"]),
-                metric["n_vacuum"],
-                metric["n_analyze"],
-                metric["n_autovacuum"],
-                metric["n_autoanalyze"],
-            ),
+@register("vacuum_analyze")
+def vacuum_analyze_values(instance_id, metric):
+    return (
+        metric["datetime"],
+        instance_id,
+        metric["dbname"],
+        (
+            None,
+            str(metric["measure_interval"]),
+            metric["n_vacuum"],
+            metric["n_analyze"],
+            metric["n_autovacuum"],
+            metric["n_autoanalyze"],
         ),
     )
 
 
-@handle_keyerror
-def insert_metric_replication_lag(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_replication_lag_current
-            VALUES (:dt, :instance_id, :row)
-        """),
-        dict(dt=metric["datetime"], instance_id=instance_id, row=(None, metric["lag"])),
-    )
+@register("replication_lag")
+def replication_lag_values(instance_id, metric):
+    return (metric["datetime"], instance_id, (None, metric["lag"]))
 
 
-@handle_keyerror
-def insert_metric_replication_connection(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_replication_connection_current
-            VALUES (:dt, :instance_id, :upstream, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            upstream=metric["upstream"],
-            row=(None, metric["connected"]),
-        ),
+@register("replication_connection")
+def replication_connection_values(instance_id, metric):
+    return (
+        metric["datetime"],
+        instance_id,
+        metric["upstream"],
+        (None, metric["connected"]),
     )
 
 
-@handle_keyerror
-def insert_metric_heap_bloat(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_heap_bloat_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(None, metric["ratio"]),
-        ),
-    )
+@register("heap_bloat")
+def heap_bloat_values(instance_id, metric):
+    return (metric["datetime"], instance_id, metric["dbname"], (None, metric["ratio"]))
 
 
-@handle_keyerror
-def insert_metric_btree_bloat(session, instance_id, metric):
-    session.execute(
-        dedent("""
-            INSERT INTO monitoring.metric_btree_bloat_current
-            VALUES (:dt, :instance_id, :dbname, :row)
-        """),
-        dict(
-            dt=metric["datetime"],
-            instance_id=instance_id,
-            dbname=metric["dbname"],
-            row=(None, metric["ratio"]),
-        ),
-    )
+@register("btree_bloat")
+def btree_bloat_values(instance_id, metric):
+    return (metric["datetime"], instance_id, metric["dbname"], (None, metric["ratio"]))
 
 
 def get_host_id(session, hostname):
@@ -439,43 +361,92 @@ def get_instance_id(session, host_id, port):
     return row[0] if row else None
 
 
-def append_state_changes(session, dt, check_id, state, key, value, warning, critical):
-    session.execute(
+def get_check_states(session, check_ids):
+    # Returns states of checks as a dict of (check_id, key) to state.
+    rows = session.execute(
         dedent("""
-            SELECT monitoring.append_state_changes(
-                :datetime, :check_id, :state, :key, :value, :warning, :critical
-            )
+            SELECT check_id, key, state FROM monitoring.check_states
+            WHERE check_id = ANY(:check_ids)
         """),
-        dict(
-            datetime=dt,
-            check_id=check_id,
-            state=state,
-            key=key,
-            value=value,
-            warning=warning,
-            critical=critical,
-        ),
+        dict(check_ids=check_ids),
     )
+    return {(check_id, key): state for check_id, key, state in rows}
 
 
-def purge_check_states(session, check_id, keys):
-    session.execute(
+def get_last_state_changes(session, keys):
+    # Returns last state in history of (check_id, key) tuples, as a dict of
+    # (check_id, key) to state. Each key is a single lookup in
+    # idx_state_changes_key.
+    if not keys:
+        return {}
+    check_ids, keys = zip(*keys)
+    rows = session.execute(
         dedent("""
-            DELETE FROM monitoring.check_states
-            WHERE check_id = :check_id AND NOT (key = ANY(:keys))
+            SELECT k.check_id, k.key, last.state
+            FROM unnest(:check_ids, :keys) AS k(check_id, key)
+            CROSS JOIN LATERAL (
+                SELECT state FROM monitoring.state_changes
+                WHERE check_id = k.check_id AND key = k.key
+                ORDER BY datetime DESC
+                LIMIT 1
+            ) AS last
         """),
-        dict(check_id=check_id, keys=keys),
+        dict(check_ids=list(check_ids), keys=list(keys)),
+    )
+    return {(check_id, key): state for check_id, key, state in rows}
+
+
+def upsert_check_states(session, states):
+    # states is a list of (check_id, key, state) tuples.
+    if not states:
+        return
+    cur = session.connection().connection.cursor()
+    execute_values(
+        cur,
+        dedent("""\
+        INSERT INTO monitoring.check_states (check_id, key, state)
+        VALUES %s
+        ON CONFLICT (check_id, key) DO UPDATE SET state = EXCLUDED.state
+        """),
+        states,
     )
 
 
-def undef_check_states(session, all_ids, to_keep_ids):
-    session.execute(
-        dedent("""
-            UPDATE monitoring.check_states
-            SET state = 'UNDEF'
-            WHERE
-                check_id = ANY(:all_ids)
-                AND NOT (check_id = ANY(:to_keep_ids))
+def delete_check_states(session, keys):
+    # keys is a list of (check_id, key) tuples.
+    if not keys:
+        return
+    cur = session.connection().connection.cursor()
+    execute_values(
+        cur,
+        dedent("""\
+        DELETE FROM monitoring.check_states
+        WHERE (check_id, key) IN (VALUES %s)
+        """),
+        keys,
+    )
+
+
+def insert_state_changes(session, changes):
+    # changes is a list of (datetime, check_id, state, key, value, warning,
+    # critical) tuples.
+    if not changes:
+        return
+    cur = session.connection().connection.cursor()
+    execute_values(
+        cur,
+        dedent("""\
+        INSERT INTO monitoring.state_changes
+            (datetime, check_id, state, key, value, warning, critical)
+        VALUES %s
         """),
-        dict(all_ids=all_ids, to_keep_ids=to_keep_ids),
+        changes,
+    )
+
+
+def refresh_instance_checks(session, instance_id):
+    # Update checks in alert of home page summary.
+    session.execute(
+        "SELECT monitoring.refresh_instance_checks(:instance_id)",
+        dict(instance_id=instance_id),
     )
@@ -1,39 +1,78 @@
+import codecs
 import csv
-import operator
+from tempfile import SpooledTemporaryFile
 
 
-def get_csv_data(fd):
-    # CSV parser as generator
-    yield from csv.DictReader(fd)
+class PivotWriter:
+    # Single pass pivot table, as a file-like sink of CSV data.
+    #
+    # Beware, input data *MUST* be ordered by index value. Keys are discovered
+    # while reading, pivoted lines are spooled to disk past max_size and
+    # completed with missing keys on close().
 
+    def __init__(self, index, key, value, output, max_size=1024 * 1024):
+        self.index = index
+        self.key = key
+        self.value = value
+        self.output = output
+        self.spool = SpooledTemporaryFile(max_size=max_size, mode="w+")
+        self.keys = {}
+        self.columns = None
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.partial = ""
+        self.line = None
 
-def pivot_timeserie(fd, index, key, value, output):
-    # Simple pivot table implementation.
-    # Beware, input data *MUST* be ordered by index value.
-    fd.seek(0)
-    keys = {}
-    p = 1
-    # We need to get the keys first
-    for r in get_csv_data(fd):
-        if r[key] not in keys:
-            keys[r[key]] = p
-            p += 1
-    sk = sorted(list(keys.items()), key=operator.itemgetter(1))
-    # CSV Header
-    line = [index] + [x[0] for x in sk]
-    p_index = ""
-    fd.seek(0)
-    for r in get_csv_data(fd):
-        if r[index] != p_index:
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data)
+        lines = (self.partial + data).split("\n")
+        # Keep incomplete line for next write.
+        self.partial = lines.pop()
+        for row in csv.reader(lines):
+            if row:
+                self.push(row)
+        return len(data)
+
+    def push(self, row):
+        if self.columns is None:
+            # CSV Header
+            self.columns = [row.index(c) for c in (self.index, self.key, self.value)]
+            return
+
+        index, key, value = (row[c] for c in self.columns)
+        if self.line is None or index != self.line[0]:
             # As data are ordered if we meet a new index value then the current
             # line is complete.
-            output.write(",".join(line) + "\n")
+            self.write_line()
             # And start a new line
-            line = [""] * (len(keys) + 1)
-            line[0] = r[index]
+            self.line = [index]
+        p = self.keys.setdefault(key, len(self.keys) + 1)
+        if p >= len(self.line):
+            self.line.extend([""] * (p + 1 - len(self.line)))
         # Append value to the current line
-        line[keys[r[key]]] = r[value]
-        # Keep a track of the index value
-        p_index = r[index]
-    # Write the last line
-    output.write(",".join(line) + "\n")
+        self.line[p] = value
+
+    def write_line(self):
+        if self.line is not None:
+            self.spool.write(",".join(self.line) + "\n")
+
+    def close(self):
+        if self.partial:
+            self.write("\n")
+        self.write_line()
+        self.output.write(",".join([self.index] + list(self.keys)) + "\n")
+        # Lines lack keys discovered after them.
+        self.spool.seek(0)
+        for line in self.spool:
+            missing = len(self.keys) - line.count(",")
+            self.output.write(line[:-1] + "," * missing + "\n")
+        self.spool.close()
+
+
+def pivot_timeserie(fd, index, key, value, output):
+    # Simple pivot table implementation.
+    fd.seek(0)
+    writer = PivotWriter(index, key, value, output)
+    for line in fd:
+        writer.write(line)
+    writer.close()
@@ -2,13 +2,13 @@ import logging
 from datetime import datetime, timedelta
 
 from dateutil import parser as parse_datetime
-from sqlalchemy.orm.exc import NoResultFound
+from temboardtoolkit import frames
 from temboardtoolkit.errors import UserError
 
 from ...web.tornado import HTTPError
 from .alerting import bootstrap_checks, check_specs
 from .model import db
-from .model.orm import Check, CheckState, CollectorStatus, Host, Instance
+from .model.orm import Check, CollectorStatus, Host, Instance
 
 logger = logging.getLogger(__package__)
 
@@ -96,16 +96,50 @@ def parse_start_end(request):
     return start, end
 
 
+def parse_points(request):
+    points = request.handler.get_argument("points", default=None)
+    if points is None:
+        return None
+    try:
+        points = int(points)
+    except ValueError:
+        raise HTTPError(406, "Invalid points.")
+    if points < 3:
+        raise HTTPError(406, "Points must be at least 3.")
+    return points
+
+
+def read_history(response):
+    # Decode agent /monitoring/history response as a list of points.
+    if response.headers.get("Content-Type") != frames.CONTENT_TYPE:
+        return response.json()
+
+    rows = []
+    inventory = None
+    for kind, blob in frames.iter_frames(response):
+        if kind == b"I":
+            inventory = frames.decompress(blob)
+        else:
+            rows.append(dict(frames.decompress(blob), **inventory))
+    return rows
+
+
 class TimeoutError(UserError):
     pass
 
 
-def insert_metrics(session, host_id, instance_id, data, labels=None, max_duration=30):
+def insert_metrics(session, points, max_duration=30):
+    # Load metrics of points in session transaction, without committing.
+    #
+    # points is a list of (host_id, instance_id, data, labels) tuples. Rows
+    # are grouped per metric table and loaded with a multi-row INSERT per
+    # table. Points older than aggregates are flagged for aggregation.
+    # Returns the number of inserted rows.
     start = datetime.utcnow()
     max_duration = timedelta(seconds=max_duration)
-    labels = labels or {}
-
-    for metric_name in list(data.keys()):
+    count = 0
+    datetimes = {}
+    for metric_name, rows in group_metric_rows(points).items():
         call_duration = datetime.utcnow() - start
         if call_duration >= max_duration:
             logger.warning(
@@ -116,69 +150,44 @@ def insert_metrics(session, host_id, instance_id, data, labels=None, max_duratio
             )
             raise TimeoutError("Metrics insertion takes more than %s." % max_duration)
 
-        # Do not try to insert empty lines
-        if data[metric_name] is None:
-            continue
-        if len(data[metric_name]) == 0:
-            continue
+        logger.debug("Inserting %s rows for metric %s.", len(rows), metric_name)
+        db.insert_metric_rows(session, metric_name, rows)
+        datetimes[metric_name] = {row[0] for row in rows}
+        count += len(rows)
+    db.flag_late_points(session, datetimes)
+    return count
+
+
+def group_metric_rows(points):
+    # Build metric table rows from agent points, grouped by metric name.
+    tables = {}
+    for host_id, instance_id, data, labels in points:
+        labels = labels or {}
+        for metric_name, metric_points in data.items():
+            # Do not try to insert empty lines
+            if not metric_points:
+                continue
 
-        for record in generate_logfmt_records(metric_name, data[metric_name]):
-            try:
-                logger.debug(
-                    "up=1 %s %s",
-                    " ".join(["%s=%s" % i for i in labels.items()]),
-                    " ".join(["%s=%s" % i for i in record.items()]),
-                )
-            except Exception:
-                logger.exception("Failed to format logfmt.")
-
-        # Insert data
-        for metric_data in data[metric_name]:
-            logger.debug("Inserting data for metric %s.", metric_name)
-            if metric_name == "sessions":
-                db.insert_metric_sessions(session, instance_id, metric_data)
-            elif metric_name == "xacts":
-                db.insert_metric_xacts(session, instance_id, metric_data)
-            elif metric_name == "locks":
-                db.insert_metric_locks(session, instance_id, metric_data)
-            elif metric_name == "blocks":
-                db.insert_metric_blocks(session, instance_id, metric_data)
-            elif metric_name == "bgwriter":
-                db.insert_metric_bgwriter(session, instance_id, metric_data)
-            elif metric_name == "db_size":
-                db.insert_metric_db_size(session, instance_id, metric_data)
-            elif metric_name == "tblspc_size":
-                db.insert_metric_tblspc_size(session, instance_id, metric_data)
-            elif metric_name == "filesystems_size":
-                db.insert_metric_fs_size(session, host_id, metric_data)
-            elif metric_name == "temp_files_size_delta":
-                db.insert_metric_temp_files_size_delta(
-                    session, instance_id, metric_data
-                )
-            elif metric_name == "wal_files":
-                db.insert_metric_wal_files(session, instance_id, metric_data)
-            elif metric_name == "cpu":
-                db.insert_metric_cpu(session, host_id, metric_data)
-            elif metric_name == "process":
-                db.insert_metric_process(session, host_id, metric_data)
-            elif metric_name == "memory":
-                db.insert_metric_memory(session, host_id, metric_data)
-            elif metric_name == "loadavg":
-                db.insert_metric_loadavg(session, host_id, metric_data)
-            elif metric_name == "vacuum_analyze":
-                db.insert_metric_vacuum_analyze(session, instance_id, metric_data)
-            elif metric_name == "replication_lag":
-                db.insert_metric_replication_lag(session, instance_id, metric_data)
-            elif metric_name == "replication_connection":
-                db.insert_metric_replication_connection(
-                    session, instance_id, metric_data
-                )
-            elif metric_name == "heap_bloat":
-                db.insert_metric_heap_bloat(session, instance_id, metric_data)
-            elif metric_name == "btree_bloat":
-                db.insert_metric_btree_bloat(session, instance_id, metric_data)
+            for record in generate_logfmt_records(metric_name, metric_points):
+                try:
+                    logger.debug(
+                        "up=1 %s %s",
+                        " ".join(["%s=%s" % i for i in labels.items()]),
+                        " ".join(["%s=%s" % i for i in record.items()]),
+                    )
+                except Exception:
+                    logger.exception("Failed to format logfmt.")
 
-            session.commit()
+            if metric_name not in db.METRICS:
+                continue
+
+            level, build = db.METRICS[metric_name]
+            id_ = host_id if level == "host" else instance_id
+            for point in metric_points:
+                row = build(id_, point)
+                if row is not None:
+                    tables.setdefault(metric_name, []).append(row)
+    return tables
 
 
 def generate_logfmt_records(metric, points):
@@ -291,104 +300,124 @@ def preprocess_data(data, checks, timestamp):
     return ret
 
 
-def check_preprocessed_data(app, session, host_id, instance_id, ppdata):
-    # Function in charge of checking preprocessed monitoring values
-    keys = dict()
-
-    for raw in ppdata:
-        dt = raw.get("datetime")
-        name = raw.get("name")
-        key = raw.get("key")
-        value = raw.get("value")
-        warning = raw.get("warning")
-        critical = raw.get("critical")
-
-        # Proceed with thresholds comparison
-        spec = check_specs.get(name)
-        state = "UNDEF"
-        if not spec:
-            continue
-        if not (
-            spec.get("operator")(value, warning)
-            or spec.get("operator")(value, critical)
-        ):
-            state = "OK"
-        if spec.get("operator")(value, warning):
-            state = "WARNING"
-        if spec.get("operator")(value, critical):
-            state = "CRITICAL"
+def check_preprocessed_data(app, session, host_id, instance_id, ppdatas):
+    # Function in charge of checking preprocessed monitoring values of one or
+    # more points of an instance.
+    #
+    # Checks and states are loaded once, transitions are computed in memory
+    # and states are written in a single batch.
+    checks = session.query(Check).filter(
+        Check.host_id == host_id, Check.instance_id == instance_id
+    )
+    enabled = {c.name: c.check_id for c in checks if c.enabled}
+    # Get the list of check_id for the given instance
+    req = session.query(Check.check_id).filter(Check.instance_id == instance_id)
+    all_check_ids = [check_id for (check_id,) in req]
+
+    states = db.get_check_states(session, all_check_ids)
+    previous = dict(states)
+    checked = {
+        (enabled[raw["name"]], str(raw["key"]))
+        for ppdata in ppdatas
+        for raw in ppdata
+        if raw.get("name") in enabled
+    }
+    last_changes = db.get_last_state_changes(session, sorted(checked))
+    changes, notifications = evaluate_checks(enabled, states, last_changes, ppdatas)
+
+    db.upsert_check_states(
+        session,
+        [
+            (check_id, key, state)
+            for (check_id, key), state in states.items()
+            if previous.get((check_id, key)) != state
+        ],
+    )
+    db.delete_check_states(session, [k for k in previous if k not in states])
+    db.insert_state_changes(session, changes)
+    db.refresh_instance_checks(session, instance_id)
+    session.commit()
 
-        # Try to find enabled check for this host_id with the same name
-        try:
-            c = (
-                session.query(Check)
-                .filter(
-                    Check.name == str(name),
-                    Check.host_id == host_id,
-                    Check.instance_id == instance_id,
-                    Check.enabled == bool(True),
-                )
-                .one()
+    for options in notifications:
+        if app.scheduler.can_schedule:
+            app.scheduler.schedule_task(
+                "notify_state_change", options=options, expire=0
             )
-        except NoResultFound:
-            continue
+        else:
+            logger.warning("Can't schedule state change task.")
+
+
+def evaluate_checks(checks, states, last_changes, ppdatas):
+    # Apply preprocessed values of each point to check states, in place.
+    #
+    # checks maps enabled check name to check_id. states and last_changes map
+    # (check_id, key) to current state and last state in history. Returns
+    # state changes to append to history and options of notifications.
+    changes = []
+    notifications = []
+    for ppdata in ppdatas:
+        keys = dict()
+        for raw in ppdata:
+            dt = raw.get("datetime")
+            name = raw.get("name")
+            key = raw.get("key")
+            value = raw.get("value")
+            warning = raw.get("warning")
+            critical = raw.get("critical")
+
+            # Proceed with thresholds comparison
+            spec = check_specs.get(name)
+            state = "UNDEF"
+            if not spec:
+                continue
+            if not (
+                spec.get("operator")(value, warning)
+                or spec.get("operator")(value, critical)
+            ):
+                state = "OK"
+            if spec.get("operator")(value, warning):
+                state = "WARNING"
+            if spec.get("operator")(value, critical):
+                state = "CRITICAL"
+
+            check_id = checks.get(name)
+            if check_id is None:
+                continue
 
-        # Update/insert check current state
-        try:
-            cs = (
-                session.query(CheckState)
-                .filter(CheckState.check_id == c.check_id, CheckState.key == str(key))
-                .one()
-            )
             # State has changed since last time
-            if cs.state != state:
-                if app.scheduler.can_schedule:
-                    app.scheduler.schedule_task(
-                        "notify_state_change",
-                        options={
-                            "check_id": c.check_id,
-                            "key": key,
-                            "value": value,
-                            "state": state,
-                            "prev_state": cs.state,
-                        },
-                        expire=0,
+            prev_state = states.get((check_id, str(key)))
+            if prev_state is not None and prev_state != state:
+                notifications.append(
+                    dict(
+                        check_id=check_id,
+                        key=key,
+                        value=value,
+                        state=state,
+                        prev_state=prev_state,
                     )
-                else:
-                    logger.warning("Can't schedule state change task.")
-            cs.state = str(state)
-            session.merge(cs)
-
-        except NoResultFound:
-            cs = CheckState(check_id=c.check_id, key=str(key), state=str(state))
-            session.add(cs)
-
-        session.flush()
-        # Append state change if any to history
-        db.append_state_changes(
-            session, dt, c.check_id, cs.state, cs.key, value, warning, critical
-        )
-
-        if c.check_id not in keys:
-            keys[c.check_id] = list()
-        keys[c.check_id].append(cs.key)
+                )
+            states[(check_id, str(key))] = state
 
-        session.commit()
-        session.expunge_all()
+            # Append state change if any to history
+            if last_changes.get((check_id, str(key))) != state:
+                last_changes[(check_id, str(key))] = state
+                changes.append(
+                    (dt, check_id, state, str(key), value, warning, critical)
+                )
 
-    # Purge CheckState
-    for check_id, ks in list(keys.items()):
-        db.purge_check_states(session, check_id, ks)
-        session.commit()
+            keys.setdefault(check_id, set()).add(str(key))
 
-    # Get the list of check_id for the given instance
-    req = session.query(Check).filter(Check.instance_id == instance_id)
-    all_check_ids = [check.check_id for check in req]
+        for check_id, key in list(states):
+            if check_id in keys:
+                # Purge CheckState of keys not checked anymore.
+                if key not in keys[check_id]:
+                    del states[(check_id, key)]
+            else:
+                # Set to UNDEF each unchecked check for the given instance
+                # This may happen when postgres is not available
+                states[(check_id, key)] = "UNDEF"
 
-    # Set to UNDEF each unchecked check for the given instance
-    # This may happen when postgres is not available
-    db.undef_check_states(session, all_check_ids, list(keys.keys()))
-    session.commit()
+    return changes, notifications
 
 
 # Stolen from ldap2pg
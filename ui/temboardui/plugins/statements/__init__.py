@@ -1,7 +1,10 @@
+import io
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from os import path
+from time import monotonic
 
 import tornado.web
 from sqlalchemy.orm import scoped_session, sessionmaker
@@ -11,6 +14,7 @@ from temboardtoolkit import taskmanager
 from temboardui.agentclient import TemboardAgentClient
 from temboardui.model import worker_engine
 from temboardui.model.orm import Instance
+from temboardui.plugins.monitoring import grouper
 from temboardui.plugins.monitoring.tools import parse_start_end
 from temboardui.web.tornado import Blueprint, TemplateRenderer, jsonify
 
@@ -49,44 +53,48 @@ METAS_QUERY = text("""
 """)
 
 
-BASE_QUERY_STATDATA = text("""
-    (
-        SELECT dbid, datname, (record).*
-        FROM (
-          SELECT psh.dbid, psh.datname, unnest(records) AS record
-          FROM statements.statements_history_db psh
-          WHERE coalesce_range && tstzrange(:start, :end,'[]')
-          AND    agent_address = :agent_address
-          AND    agent_port = :agent_port
-        ) AS unnested
-        WHERE tstzrange((record).ts, (record).ts, '[]')
-              <@ tstzrange(:start, :end, '[]')
+# Sums of counters increase in range, from statements_deltas* tables. Cast
+# sums of integers back from NUMERIC for JSON.
+SUM_DELTAS = """
+    sum(calls)::BIGINT AS calls,
+    sum(total_exec_time) AS total_exec_time,
+    sum(total_exec_time) / sum(calls) AS mean_time,
+    sum(shared_blks_read)::BIGINT AS shared_blks_read,
+    sum(shared_blks_hit)::BIGINT AS shared_blks_hit,
+    sum(shared_blks_dirtied)::BIGINT AS shared_blks_dirtied,
+    sum(shared_blks_written)::BIGINT AS shared_blks_written,
+    sum(local_blks_read)::BIGINT AS local_blks_read,
+    sum(local_blks_hit)::BIGINT AS local_blks_hit,
+    sum(local_blks_dirtied)::BIGINT AS local_blks_dirtied,
+    sum(local_blks_written)::BIGINT AS local_blks_written,
+    sum(temp_blks_read)::BIGINT AS temp_blks_read,
+    sum(temp_blks_written)::BIGINT AS temp_blks_written,
+    sum(blk_read_time) AS blk_read_time,
+    sum(blk_write_time) AS blk_write_time
+"""
 
-        UNION ALL
 
-        SELECT dbid, datname, (record).*
-        FROM statements.statements_history_current_db
-        WHERE agent_address = :agent_address
-        AND agent_port = :agent_port
-        AND tstzrange((record).ts, (record).ts, '[]')
-          <@ tstzrange(:start, :end, '[]')
-    ) h
-""")
+BASE_QUERY_STATDATA = text(
+    """
+    SELECT datname, dbid,
+    """
+    + SUM_DELTAS
+    + """
+    FROM statements.statements_deltas_db
+    WHERE agent_address = :agent_address
+    AND agent_port = :agent_port
+    AND ts <@ tstzrange(:start, :end, '(]')
+    GROUP BY dbid, datname
+    HAVING sum(calls) > 0
+"""
+)
 
 
 @blueprint.instance_route(r"/statements/data", json=True)
 def json_data_instance(request):
     start, end = parse_start_end(request)
 
-    base_query = BASE_QUERY_STATDATA
-    diffs = get_diffs_forstatdata()
-    query = (
-        select([column("datname"), column("dbid")] + diffs)
-        .select_from(base_query)
-        .group_by(column("dbid"), column("datname"))
-        .having(func.max(column("calls")) - func.min(column("calls")) > 0)
-    )
-
+    query = BASE_QUERY_STATDATA
     statements = request.db_session.execute(
         query,
         dict(
@@ -109,269 +117,53 @@ def json_data_instance(request):
     return jsonify(dict(data=statements, metas=metas))
 
 
-BASE_QUERY_STATDATA_DATABASE = """
-WITH first_occurence AS (
-  -- first occurence for each statement
-  SELECT
-    distinct on (queryid, userid)
-    queryid,
-    userid,
-    ts,
-    calls,
-    total_exec_time,
-    shared_blks_read,
-    shared_blks_hit,
-    shared_blks_dirtied,
-    shared_blks_written,
-    local_blks_read,
-    local_blks_hit,
-    local_blks_dirtied,
-    local_blks_written,
-    temp_blks_read,
-    temp_blks_written,
-    blk_read_time,
-    blk_write_time
-  FROM
-    (
-      (
-        SELECT
-          distinct on (queryid, userid)
-          queryid,
-          userid,
-          (record).*
-        FROM
-          (
-            SELECT
-              distinct on (queryid, userid)
-              queryid,
-              userid,
-              unnest(records) AS record
-            FROM
-              statements.statements_history psh
-            WHERE
-              coalesce_range && tstzrange(
-                (:start) :: timestamptz,
-                (:end) :: timestamptz,
-                '[]'
-              )
-              AND agent_address = :agent_address
-              AND agent_port = :agent_port
-              AND dbid = :dbid
-              {queryidfilter}
-            order by
-              queryid,
-              userid,
-              coalesce_range
-          ) AS unnested
-        WHERE
-          tstzrange(
-            (record).ts,
-            (record).ts,
-            '[]'
-          ) <@ tstzrange(
-            (:start) :: timestamptz,
-            (:end) :: timestamptz,
-            '[]'
-          )
-        order by
-          queryid,
-          userid,
-          ts
-      )
-      UNION ALL
-        (
-          SELECT
-            distinct on (queryid, userid)
-            queryid,
-            userid,
-            (record).*
-          FROM
-            statements.statements_history_current
-          WHERE
-            agent_address = :agent_address
-            AND agent_port = :agent_port
-            AND dbid = :dbid
-            AND tstzrange(
-              (record).ts,
-              (record).ts,
-              '[]'
-            ) <@ tstzrange(
-              (:start) :: timestamptz,
-              (:end) :: timestamptz,
-              '[]'
-            )
-            {queryidfilter}
-          order by
-            queryid,
-            userid,
-            ts
-        )
-    ) as h
-  order by
-    queryid,
-    userid,
-    ts
-),
-last_occurence AS (
-  -- last occurence for each statement
+BASE_QUERY_STATDATA_DATABASE = (
+    """
+WITH deltas AS (
   SELECT
-    distinct on (queryid, userid)
-    queryid,
-    userid,
-    ts,
-    calls,
-    total_exec_time,
-    shared_blks_read,
-    shared_blks_hit,
-    shared_blks_dirtied,
-    shared_blks_written,
-    local_blks_read,
-    local_blks_hit,
-    local_blks_dirtied,
-    local_blks_written,
-    temp_blks_read,
-    temp_blks_written,
-    blk_read_time,
-    blk_write_time
-  FROM
-    (
-      (
-        SELECT
-          distinct on (queryid, userid)
-          queryid,
-          userid,
-          (record).*
-        FROM
-          (
-            SELECT
-              distinct on (queryid, userid)
-              queryid,
-              userid,
-              unnest(records) AS record
-            FROM
-              statements.statements_history psh
-            WHERE
-              coalesce_range && tstzrange(
-                (:start) :: timestamptz,
-                (:end) :: timestamptz,
-                '[]'
-              )
-              AND agent_address = :agent_address
-              AND agent_port = :agent_port
-              AND dbid = :dbid
-              {queryidfilter}
-            order by
-              queryid,
-              userid,
-              coalesce_range desc
-          ) AS unnested
-        WHERE
-          tstzrange(
-            (record).ts,
-            (record).ts,
-            '[]'
-          ) <@ tstzrange(
-            (:start) :: timestamptz,
-            (:end) :: timestamptz,
-            '[]'
-          )
-        order by
-          queryid,
-          userid,
-          ts desc
-      )
-      UNION ALL
-        (
-          SELECT
-            distinct on (queryid, userid)
-            queryid,
-            userid,
-            (record).*
-          FROM
-            statements.statements_history_current
-          WHERE
-            agent_address = :agent_address
-            AND agent_port = :agent_port
-            AND dbid = :dbid
-            AND tstzrange(
-              (record).ts,
-              (record).ts,
-              '[]'
-            ) <@ tstzrange(
-              (:start) :: timestamptz,
-              (:end) :: timestamptz,
-              '[]'
-            )
-            {queryidfilter}
-          order by
-            queryid,
-            userid,
-            ts desc
-        )
-    ) as h
-  order by
     queryid,
     userid,
-    ts desc
+"""
+    + SUM_DELTAS
+    + """
+  FROM statements.statements_deltas
+  WHERE agent_address = :agent_address
+    AND agent_port = :agent_port
+    AND dbid = :dbid
+    AND ts <@ tstzrange(:start, :end, '(]')
+    {queryidfilter}
+  GROUP BY queryid, userid
+  HAVING sum(calls) > 0
 )
 SELECT
   query,
   statements.queryid::text,
   rolname,
   statements.userid::text,
-  (lo.calls - fo.calls) AS calls,
-  (lo.total_exec_time - fo.total_exec_time) AS total_exec_time,
-  (lo.total_exec_time - fo.total_exec_time) /
-    (lo.calls - fo.calls) AS mean_time,
-  (
-    lo.shared_blks_read - fo.shared_blks_read
-  ) AS shared_blks_read,
-  (
-    lo.shared_blks_hit - fo.shared_blks_hit
-  ) AS shared_blks_hit,
-  (
-    lo.shared_blks_dirtied - fo.shared_blks_dirtied
-  ) AS shared_blks_dirtied,
-  (
-    lo.shared_blks_written - fo.shared_blks_written
-  ) AS shared_blks_written,
-  (
-    lo.local_blks_read - fo.local_blks_read
-  ) AS local_blks_read,
-  (
-    lo.local_blks_hit - fo.local_blks_hit
-  ) AS local_blks_hit,
-  (
-    lo.local_blks_dirtied - fo.local_blks_dirtied
-  ) AS local_blks_dirtied,
-  (
-    lo.local_blks_written - fo.local_blks_written
-  ) AS local_blks_written,
-  (
-    lo.temp_blks_read - fo.temp_blks_read
-  ) AS temp_blks_read,
-  (
-    lo.temp_blks_written - fo.temp_blks_written
-  ) AS temp_blks_written,
-  (
-    lo.blk_read_time - fo.blk_read_time
-  ) AS blk_read_time,
-  (
-    lo.blk_write_time - fo.blk_write_time
-  ) AS blk_write_time
-FROM
-  first_occurence AS fo
-  JOIN last_occurence AS lo
-    ON fo.queryid = lo.queryid
-    AND fo.userid = lo.userid
-  JOIN statements.statements
-    ON statements.queryid = fo.queryid
-    AND statements.userid = fo.userid
+  deltas.calls,
+  deltas.total_exec_time,
+  deltas.mean_time,
+  deltas.shared_blks_read,
+  deltas.shared_blks_hit,
+  deltas.shared_blks_dirtied,
+  deltas.shared_blks_written,
+  deltas.local_blks_read,
+  deltas.local_blks_hit,
+  deltas.local_blks_dirtied,
+  deltas.local_blks_written,
+  deltas.temp_blks_read,
+  deltas.temp_blks_written,
+  deltas.blk_read_time,
+  deltas.blk_write_time
+FROM deltas
+JOIN statements.statements
+  ON statements.queryid = deltas.queryid
+  AND statements.userid = deltas.userid
   AND agent_address = :agent_address
   AND agent_port = :agent_port
-  AND dbid = :dbid
-WHERE (lo.calls - fo.calls) > 0;
+  AND dbid = :dbid;
 """
+)
 
 
 @blueprint.instance_route(r"/statements/data/([0-9]*)/([-]?[0-9]*)/([0-9]*)", json=True)
@@ -423,26 +215,6 @@ def json_data(request, dbid, queryid=None, userid=None):
     return jsonify(dict(datname=datname, data=statements))
 
 
-def get_diffs_forstatdata():
-    return [
-        diff("calls"),
-        diff("total_exec_time").label("total_exec_time"),
-        (diff("total_exec_time") / diff("calls")).label("mean_time"),
-        diff("shared_blks_read"),
-        diff("shared_blks_hit"),
-        diff("shared_blks_dirtied"),
-        diff("shared_blks_written"),
-        diff("local_blks_read"),
-        diff("local_blks_hit"),
-        diff("local_blks_dirtied"),
-        diff("local_blks_written"),
-        diff("temp_blks_read"),
-        diff("temp_blks_written"),
-        diff("blk_read_time"),
-        diff("blk_write_time"),
-    ]
-
-
 BASE_QUERY_STATDATA_SAMPLE_INSTANCE = text("""
     (
       SELECT *
@@ -473,7 +245,7 @@ BASE_QUERY_STATDATA_SAMPLE_INSTANCE = text("""
             SELECT (record).*
             FROM (
               SELECT psh.dbid, psh.coalesce_range, unnest(records) AS record
-              FROM statements.statements_history_db psh
+              FROM statements.statements_history_db_all psh
               WHERE coalesce_range && tstzrange(:start, :end,'[]')
               AND    agent_address = :agent_address
               AND    agent_port = :agent_port
@@ -510,7 +282,7 @@ BASE_QUERY_STATDATA_SAMPLE_DATABASE = text("""
           SELECT (record).*
           FROM (
             SELECT psh.dbid, psh.coalesce_range, unnest(records) AS record
-            FROM statements.statements_history_db psh
+            FROM statements.statements_history_db_all psh
             WHERE coalesce_range && tstzrange(:start, :end,'[]')
             AND    dbid = :dbid
             AND    agent_address = :agent_address
@@ -534,56 +306,66 @@ BASE_QUERY_STATDATA_SAMPLE_DATABASE = text("""
     ) by_db
 """)
 
+# History stores only entries whose counters changed. Chart of a statement
+# sums its deltas in up to :samples buckets of the range, each delta covering
+# the snapshot interval ending at ts. Buckets last whole minutes to match
+# snapshots interval.
 BASE_QUERY_STATDATA_SAMPLE_QUERY = text("""
-    (
-      SELECT *
-      FROM (
-        SELECT
-          row_number() OVER (ORDER BY ts) AS number,
-          count(*) OVER (PARTITION BY 1) AS total,
-          *
-        FROM (
-          SELECT (record).*
-          FROM (
-            SELECT psh.dbid, psh.coalesce_range, unnest(records) AS record
-            FROM statements.statements_history psh
-            WHERE coalesce_range && tstzrange(:start, :end,'[]')
-            AND dbid = :dbid
-            AND queryid = :queryid
-            AND userid = :userid
-            AND agent_address = :agent_address
-            AND agent_port = :agent_port
-          ) AS unnested
-          WHERE tstzrange((record).ts, (record).ts, '[]')
-                <@ tstzrange(:start, :end, '[]')
-
-          UNION ALL
-
-          SELECT (record).*
-          FROM statements.statements_history_current
-          WHERE tstzrange((record).ts, (record).ts, '[]')
-            <@ tstzrange(:start, :end, '[]')
-          AND dbid = :dbid
-          AND queryid = :queryid
-          AND userid = :userid
-          AND agent_address = :agent_address
-          AND agent_port = :agent_port
-        ) AS statements_history
-      ) AS sh
-      WHERE number % ( int8larger((total)/(:samples +1),1) ) = 0
-    ) by_db
+    SELECT
+      extract(epoch FROM CAST(:start AS TIMESTAMPTZ)) + bucket * width AS ts,
+      sum(calls) / width AS calls,
+      sum(total_exec_time) / greatest(sum(calls), 1.0) AS avg_runtime,
+      sum(total_exec_time) / width AS load,
+      sum(shared_blks_read + local_blks_read + temp_blks_read) / width
+        AS total_blks_read,
+      sum(shared_blks_hit + local_blks_hit) / width AS total_blks_hit
+    FROM (
+      SELECT
+        d.*,
+        r.width,
+        ceil(extract(epoch FROM d.ts - CAST(:start AS TIMESTAMPTZ)) / r.width)
+          AS bucket
+      FROM statements.statements_deltas AS d
+      CROSS JOIN (
+        SELECT 60 * greatest(ceil(extract(epoch FROM
+          coalesce(CAST(:end AS TIMESTAMPTZ), now()) - CAST(:start AS TIMESTAMPTZ)
+        ) / :samples / 60), 1) AS width
+      ) AS r
+      WHERE d.agent_address = :agent_address
+      AND d.agent_port = :agent_port
+      AND d.dbid = :dbid
+      AND d.queryid = :queryid
+      AND d.userid = :userid
+      AND d.ts <@ tstzrange(:start, :end, '(]')
+    ) AS deltas
+    GROUP BY bucket, width
+    HAVING sum(calls) > 0
+    ORDER BY bucket
 """)
 
 
 def getstatdata_sample(request, mode, start, end, dbid=None, queryid=None, userid=None):
+    params = dict(
+        agent_address=request.instance.agent_address,
+        agent_port=request.instance.agent_port,
+        samples=50,
+        start=start,
+        end=end,
+    )
+
     if mode == "instance":
         base_query = BASE_QUERY_STATDATA_SAMPLE_INSTANCE
 
     elif mode == "db":
         base_query = BASE_QUERY_STATDATA_SAMPLE_DATABASE
+        params["dbid"] = dbid
 
     elif mode == "query":
-        base_query = BASE_QUERY_STATDATA_SAMPLE_QUERY
+        params.update(dict(dbid=dbid, queryid=queryid, userid=userid))
+        rows = request.db_session.execute(
+            BASE_QUERY_STATDATA_SAMPLE_QUERY, params
+        ).fetchall()
+        return [dict(row) for row in rows]
 
     ts = column("ts")
     biggest = Biggest(ts)
@@ -641,20 +423,6 @@ def getstatdata_sample(request, mode, start, end, dbid=None, queryid=None, useri
         .order_by(c.ts)
     )
 
-    params = dict(
-        agent_address=request.instance.agent_address,
-        agent_port=request.instance.agent_port,
-        samples=50,
-        start=start,
-        end=end,
-    )
-
-    if mode == "db" or mode == "query":
-        params["dbid"] = dbid
-    if mode == "query":
-        params["queryid"] = queryid
-        params["userid"] = userid
-
     rows = request.db_session.execute(query, params).fetchall()
     return [dict(row) for row in rows]
 
@@ -717,98 +485,199 @@ def statements(request):
     )
 
 
-def add_statement(session, instance, data):
+# statements_history_record fields, with pg_stat_statements columns providing
+# them, newest first.
+COUNTERS = [
+    ("calls", ("calls",)),
+    ("total_exec_time", ("total_exec_time", "total_time")),
+    ("rows", ("rows",)),
+    ("shared_blks_hit", ("shared_blks_hit",)),
+    ("shared_blks_read", ("shared_blks_read",)),
+    ("shared_blks_dirtied", ("shared_blks_dirtied",)),
+    ("shared_blks_written", ("shared_blks_written",)),
+    ("local_blks_hit", ("local_blks_hit",)),
+    ("local_blks_read", ("local_blks_read",)),
+    ("local_blks_dirtied", ("local_blks_dirtied",)),
+    ("local_blks_written", ("local_blks_written",)),
+    ("temp_blks_read", ("temp_blks_read",)),
+    ("temp_blks_written", ("temp_blks_written",)),
+    # DEPRECATED: Columns renamed in Postgres 17.
+    ("blk_read_time", ("shared_blk_read_time", "blk_read_time")),
+    ("blk_write_time", ("shared_blk_write_time", "blk_write_time")),
+    ("total_plan_time", ("total_plan_time",)),
+    ("wal_records", ("wal_records",)),
+    ("wal_fpi", ("wal_fpi",)),
+    ("wal_bytes", ("wal_bytes",)),
+]
+
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def get_counters(statement):
+    values = []
+    for _, columns in COUNTERS:
+        for name in columns:
+            if name in statement:
+                values.append(statement[name])
+                break
+        else:
+            values.append(None)
+    return values
+
+
+def sum_by_database(statements):
+    # Totals by database for agents not computing them.
+    databases = {}
+    for statement in statements:
+        key = statement["dbid"], statement["datname"]
+        total = databases.setdefault(key, [None] * len(COUNTERS))
+        for i, value in enumerate(get_counters(statement)):
+            if value is not None:
+                total[i] = value if total[i] is None else total[i] + value
+
+    return [
+        dict(dbid=dbid, datname=datname, **dict(zip((c for c, _ in COUNTERS), total)))
+        for (dbid, datname), total in databases.items()
+    ]
+
+
+def format_copy_row(values):
+    # Format values as a line of COPY text format.
+    return (
+        "\t".join(
+            "\\N" if v is None else str(v).translate(COPY_ESCAPES) for v in values
+        )
+        + "\n"
+    )
+
+
+def add_statement(session, instance, data, pull_duration=None):
+    start = monotonic()
     agent_id = f"{instance.agent_address}:{instance.agent_port}"
-    if not data.get("data"):
+    # Incremental snapshot without changes still updates totals by database.
+    if not data.get("data") and data.get("full", True):
         logger.info("No statement data from %s.", agent_id)
         return
 
+    databases = data.get("databases")
+    if databases is None:
+        databases = sum_by_database(data["data"])
+
+    prefix = [instance.agent_address, instance.agent_port, data["snapshot_datetime"]]
+    statements = io.StringIO()
+    for statement in data["data"]:
+        statements.write(
+            format_copy_row(
+                prefix
+                + [
+                    statement["userid"],
+                    statement["rolname"],
+                    statement["dbid"],
+                    statement["datname"],
+                    statement["queryid"],
+                    # Agent sends text of new statements only.
+                    statement.get("query"),
+                ]
+                + get_counters(statement)
+                # Since Postgres 14, a statement has an entry per level.
+                + [statement.get("toplevel")]
+            )
+        )
+    statements.seek(0)
+
+    totals = io.StringIO()
+    for database in databases:
+        totals.write(
+            format_copy_row(
+                prefix
+                + [database["dbid"], database["datname"]]
+                + get_counters(database)
+            )
+        )
+    totals.seek(0)
+
     conn = session.connection().connection
     cur = conn.cursor()
     cur.execute("SET search_path TO statements")
-    for statement in data.get("data"):
-        query = """
-            INSERT INTO statements_src_tmp
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        cur.execute(
-            query,
-            (
-                instance.agent_address,
-                instance.agent_port,
-                data["snapshot_datetime"],
-                statement["userid"],
-                statement["rolname"],
-                statement["dbid"],
-                statement["datname"],
-                statement["queryid"],
-                statement["query"],
-                statement["calls"],
-                statement["total_exec_time"]
-                if "total_exec_time" in statement
-                else statement["total_time"],
-                statement["rows"],
-                statement["shared_blks_hit"],
-                statement["shared_blks_read"],
-                statement["shared_blks_dirtied"],
-                statement["shared_blks_written"],
-                statement["local_blks_hit"],
-                statement["local_blks_read"],
-                statement["local_blks_dirtied"],
-                statement["local_blks_written"],
-                statement["temp_blks_read"],
-                statement["temp_blks_written"],
-                # DEPRECATED: Column renamed in Postgres 17.
-                statement["shared_blk_read_time"]
-                if "shared_blk_read_time" in statement
-                else statement["blk_read_time"],
-                statement["shared_blk_write_time"]
-                # DEPRECATED: Column renamed in Postgres 17.
-                if "shared_blk_write_time" in statement
-                else statement["blk_write_time"],
-                statement["total_plan_time"]
-                if "total_plan_time" in statement
-                else None,
-                statement["wal_records"] if "wal_records" in statement else None,
-                statement["wal_fpi"] if "wal_fpi" in statement else None,
-                statement["wal_bytes"] if "wal_bytes" in statement else None,
-            ),
-        )
-    query = """SELECT process_statements(%s, %s)"""
-    cur.execute(query, (instance.agent_address, instance.agent_port))
+    cur.copy_expert("COPY statements_src_tmp FROM STDIN", statements)
+    cur.copy_expert("COPY statements_src_db_tmp FROM STDIN", totals)
+    query = """SELECT process_statements(%s, %s, %s, %s)"""
+    cur.execute(
+        query,
+        (
+            instance.agent_address,
+            instance.agent_port,
+            data.get("cursor"),
+            data.get("full", True),
+        ),
+    )
+    query = """
+        UPDATE metas
+        SET pull_duration = %s, ingest_duration = %s
+        WHERE agent_address = %s AND agent_port = %s;
+    """
+    cur.execute(
+        query,
+        (
+            pull_duration,
+            monotonic() - start,
+            instance.agent_address,
+            instance.agent_port,
+        ),
+    )
     conn.commit()
 
 
 @workers.schedule(id="statements_pull_data", redo_interval=60)  # 1m
 @workers.register(pool_size=1)
 def pull_data_worker(app):
+    """Schedule statements pull batches of instances with statements plugin."""
     engine = worker_engine(app.config.repository)
-    session_factory = sessionmaker(bind=engine)
-    Session = scoped_session(session_factory)
-    worker_session = Session()
-    instances = worker_session.query(Instance)
+    with engine.connect() as conn:
+        res = conn.execute(
+            "SELECT agent_address, agent_port FROM application.plugins"
+            " WHERE plugin_name = 'statements' ORDER BY 1, 2"
+        )
+        rows = res.fetchall()
 
-    if not instances:
+    if not rows:
         logger.info("No instances to pull data from.")
         return
 
-    for instance in instances:
-        plugin_names = [plugin.plugin_name for plugin in instance.plugins]
-
-        if "statements" not in plugin_names:
-            logger.debug("Skipping instance %s. Plugin disabled.", instance)
-            continue
+    for batch in grouper(16, rows):
+        batch = [tuple(row) for row in batch if row]
+        logger.debug("Scheduling statements pull for %s agents.", len(batch))
+        statements_pull_batch.defer(app, batch=batch)
+
+
+@workers.register(pool_size=20)
+def statements_pull_batch(app, batch):
+    # Pull agents of the batch concurrently, like monitoring collector_batch.
+    # Threads mostly wait for agents. A thread holds a repository connection
+    # only to read cursor and to ingest snapshot, thus connections are bounded
+    # by a small engine pool.
+    concurrency = min(len(batch), app.config.statements.pull_concurrency)
+    engine = worker_engine(
+        app.config.repository, pool_size=2, max_overflow=0, pool_timeout=120
+    )
+    session_factory = sessionmaker(bind=engine)
 
-        # FIXME should be done in parallel
+    def pull(agent):
+        session = session_factory()
         try:
-            pull_data_for_instance(app, worker_session, instance)
+            instance = Instance.get(*agent).with_session(session).first()
+            if instance is None:
+                logger.debug("Skipping unknown instance %s:%s.", *agent)
+                return
+            pull_data_for_instance(app, session, instance)
         except Exception:
-            logger.exception(
-                "Failed to pull data from %s:%s",
-                instance.agent_address,
-                instance.agent_port,
-            )
+            logger.exception("Failed to pull data from %s:%s", *agent)
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="statements") as executor:
+        for _ in executor.map(pull, batch):
+            pass
 
 
 @workers.register(pool_size=1)
@@ -835,12 +704,30 @@ def pull_data_for_instance(app, session, instance):
     client = TemboardAgentClient.factory(
         app.config, instance.agent_address, instance.agent_port
     )
+    cur = session.connection().connection.cursor()
+    cur.execute(
+        "SELECT cursor FROM statements.metas"
+        " WHERE agent_address = %s AND agent_port = %s",
+        (instance.agent_address, instance.agent_port),
+    )
+    row = cur.fetchone()
+    url = "/statements"
+    if row and row[0]:
+        url += "?cursor=%s" % row[0]
+    # Release repository connection while waiting for agent.
+    session.rollback()
+
+    start = monotonic()
+    pull_duration = None
     try:
-        response = client.get("/statements")
+        response = client.get(url)
         response.raise_for_status()
-        add_statement(session, instance, response.json())
+        data = response.json()
+        pull_duration = monotonic() - start
+        add_statement(session, instance, data, pull_duration=pull_duration)
         logger.debug("Successfully pulled statements data for %s.", agent_id)
     except Exception as e:
+        session.rollback()
         error = "Error while fetching statements from instance: "
         if hasattr(e, "read"):
             error += json.loads(e.read())["error"]
@@ -868,10 +755,18 @@ def pull_data_for_instance(app, session, instance):
 
         query = """
             UPDATE metas
-            SET error = %s
+            SET error = %s, pull_duration = %s
             WHERE agent_address = %s AND agent_port = %s;
         """
-        cur.execute(query, (error, instance.agent_address, instance.agent_port))
+        cur.execute(
+            query,
+            (
+                error,
+                pull_duration or monotonic() - start,
+                instance.agent_address,
+                instance.agent_port,
+            ),
+        )
         session.connection().connection.commit()
 
 
@@ -904,12 +799,31 @@ def statements_purge_worker(app):
         raise
 
 
-def to_epoch(column):
-    return extract("epoch", column).label(column.name)
+@workers.schedule(id="statements_compact", redo_interval=60 * 60)  # 1h
+@workers.register(pool_size=1)
+def statements_compact_worker(app):
+    """Background worker packing closed statements history ranges by columns.
+    Ranges are packed by batches, each in its own transaction, until history
+    tables are empty.
+    """
+    engine = worker_engine(app.config.repository)
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            conn.execute("SET LOCAL search_path TO statements")
+            rows = conn.execute(
+                "SELECT tblname, nb_rows FROM statements_compact()"
+            ).fetchall()
+        count = sum(nb_rows for _, nb_rows in rows)
+        if not count:
+            break
+        total += count
+        logger.debug("Packed %s statements history ranges.", count)
+    logger.info("Packed %s statements history ranges.", total)
 
 
-def diff(var):
-    return (func.max(column(var)) - func.min(column(var))).label(var)
+def to_epoch(column):
+    return extract("epoch", column).label(column.name)
 
 
 def total_measure_interval(column):
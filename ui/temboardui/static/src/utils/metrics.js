@@ -0,0 +1,24 @@
+import $ from "jquery";
+
+// Pending batches of metrics by query string.
+const batches = {};
+
+function fetchMetricData(url, metric, params) {
+  // Charts requesting data for the same range in the same tick share one
+  // request to the batch endpoint.
+  let batch = batches[params];
+  if (!batch) {
+    batch = batches[params] = { metrics: [], deferred: $.Deferred() };
+    setTimeout(function () {
+      delete batches[params];
+      $.get(url + params + "&metrics=" + batch.metrics.join(","))
+        .done(batch.deferred.resolve)
+        .fail(batch.deferred.reject);
+    });
+  }
+  batch.metrics.push(metric);
+  // With noerror=1, error is an empty body.
+  return batch.deferred.then((data) => (data && data[metric]) || "");
+}
+
+export { fetchMetricData };
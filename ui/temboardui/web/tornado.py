@@ -2,15 +2,18 @@ import functools
 import json
 import logging
 import os
+import re
+from concurrent.futures import Future
 from csv import writer as CSVWriter
 from io import StringIO
 
 from temboardtoolkit.perf import PerfCounters
 from temboardtoolkit.utils import JSONEncoder, utcnow
 from tornado import web as tornadoweb
-from tornado.concurrent import run_on_executor
+from tornado.concurrent import chain_future, run_on_executor
 from tornado.escape import json_decode, json_encode, url_escape
 from tornado.gen import coroutine
+from tornado.ioloop import IOLoop
 from tornado.template import Loader as TemplateLoader
 from tornado.web import Application as TornadoApplication
 from tornado.web import HTTPError, RequestHandler
@@ -48,6 +51,14 @@ def serialize_querystring(query):
     )
 
 
+def etag_matches(request, etag):
+    # Tells whether client already has the response tagged etag, according to
+    # If-None-Match header.
+    header = request.headers.get("If-None-Match", "")
+    tags = re.findall(r'\*|(?:W/)?"[^"]*"', header)
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+
 class Response:
     def __init__(self, status_code=200, headers=None, secure_cookies=None, body=""):
         self.status_code = status_code
@@ -108,6 +119,50 @@ def csvify(data, status_code=200):
     )
 
 
+class ResponseStream:
+    # File-like object sending response body while callable is running.
+    #
+    # Data is buffered up to chunk_size, then headers and chunk are sent to
+    # client. write() waits for client to consume chunk, bounding memory of
+    # large responses. close() returns the Response to return from callable.
+
+    def __init__(self, handler, status_code=200, headers=None, chunk_size=65536):
+        self.handler = handler
+        self.response = Response(status_code=status_code, headers=headers)
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.size = 0
+        self.started = False
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self.size:
+            return
+        chunk = b"".join(self.buffer)
+        self.buffer[:] = []
+        self.size = 0
+        if not self.started:
+            self.handler.run_threadsafe(self.handler.set_headers, self.response)
+            self.started = True
+        self.handler.run_threadsafe(self.handler.write_chunk, chunk)
+
+    def close(self):
+        if self.started:
+            self.flush()
+        else:
+            # Small response, send it at once.
+            self.response.body = b"".join(self.buffer)
+        return self.response
+
+
 def jsonify(data, status_code=200):
     return Response(
         status_code=status_code,
@@ -137,6 +192,7 @@ class CallableHandler(RequestHandler):
         # Thus, we bind executor to request object.
         self.request.executor = self.executor
         self.request.handler = self
+        self.io_loop = IOLoop.current()
         self.SUPPORTED_METHODS = methods or ["GET"]
 
     def get_current_user(self):
@@ -166,7 +222,26 @@ class CallableHandler(RequestHandler):
     post = get
     delete = get
 
-    def write_response(self, response):
+    def run_threadsafe(self, func, *args):
+        # Execute func in IO loop from executor thread and wait for its
+        # result.
+        future = Future()
+
+        def callback():
+            try:
+                result = func(*args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                if result is None:
+                    future.set_result(None)
+                else:
+                    chain_future(result, future)
+
+        self.io_loop.add_callback(callback)
+        return future.result()
+
+    def set_headers(self, response):
         self.set_status(response.status_code)
         for k, v in list(response.headers.items()):
             if not isinstance(v, list):
@@ -175,7 +250,20 @@ class CallableHandler(RequestHandler):
             for v1 in v:
                 self.add_header(k, v1)
 
-        self.finish(response.body)
+    def write_chunk(self, chunk):
+        self.write(chunk)
+        return self.flush()
+
+    def write_response(self, response):
+        if self._headers_written:
+            # Body has been streamed by ResponseStream. Too late to send
+            # another response, even an error.
+            self.finish()
+            return
+
+        self.set_headers(response)
+        # 304 and 204 responses must not have body, even empty.
+        self.finish(response.body or None)
 
 
 class Error404Handler(RequestHandler):
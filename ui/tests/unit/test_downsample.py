@@ -0,0 +1,33 @@
+def test_lttb():
+    from temboardui.plugins.monitoring.downsample import lttb
+
+    values = [(x, 0) for x in range(100)]
+    values[42] = (42, 100)
+    selected = lttb(values, 10)
+
+    assert 10 == len(selected)
+    assert [0, 99] == [selected[0], selected[-1]]
+    # Peak is kept.
+    assert 42 in selected
+    # Nothing to reduce.
+    assert [0, 1, 2] == lttb(values[:3], 10)
+
+
+def test_downsample_timeserie():
+    from temboardui.plugins.monitoring.downsample import downsample_timeserie
+
+    lines = ["date,a,b"]
+    for i in range(50):
+        lines.append("2024-01-01 00:%02d:00+00,%s,%s" % (i, i, "" if i % 2 else 0))
+    data = "\n".join(lines) + "\n"
+
+    out = downsample_timeserie(data, 5).splitlines()
+
+    assert "date,a,b" == out[0]
+    assert lines[1] == out[1]
+    assert lines[-1] == out[-1]
+    assert len(out) - 1 <= 10
+    # Whole rows are kept.
+    assert set(out) <= set(lines)
+
+    assert data == downsample_timeserie(data, 100)
@@ -0,0 +1,177 @@
+import pytest
+
+
+def test_group_metric_rows(caplog):
+    from temboardui.plugins.monitoring.tools import group_metric_rows
+
+    points = [
+        (
+            1,
+            10,
+            {
+                "db_size": [
+                    {"datetime": "2024-01-01 00:00:00 +0000", "dbname": "a", "size": 1},
+                    {"datetime": "2024-01-01 00:00:00 +0000", "dbname": "b"},
+                ],
+                "loadavg": [
+                    {
+                        "datetime": "2024-01-01 00:00:00 +0000",
+                        "load1": 1.0,
+                        "load5": 0.5,
+                        "load15": 0.1,
+                    }
+                ],
+                "replication_lag": [],
+                "probe_durations": {"db_size": 0.1},
+            },
+            None,
+        ),
+        (
+            1,
+            10,
+            {
+                "db_size": [
+                    {"datetime": "2024-01-01 00:01:00 +0000", "dbname": "a", "size": 2}
+                ]
+            },
+            None,
+        ),
+    ]
+
+    tables = group_metric_rows(points)
+
+    assert sorted(tables) == ["db_size", "loadavg"]
+    # Incomplete point is skipped.
+    assert "Missing point size for db_size." in caplog.text
+    assert tables["db_size"] == [
+        ("2024-01-01 00:00:00 +0000", 10, "a", (None, 1)),
+        ("2024-01-01 00:01:00 +0000", 10, "a", (None, 2)),
+    ]
+    # Host metrics reference host_id.
+    assert tables["loadavg"] == [
+        ("2024-01-01 00:00:00 +0000", 1, (None, 1.0, 0.5, 0.1))
+    ]
+
+
+def test_insert_metrics(mocker):
+    from temboardui.plugins.monitoring.tools import insert_metrics
+
+    insert_rows = mocker.patch(
+        "temboardui.plugins.monitoring.model.db.insert_metric_rows"
+    )
+    flag_late = mocker.patch("temboardui.plugins.monitoring.model.db.flag_late_points")
+    points = [
+        (1, 10, {"db_size": [{"datetime": "x", "dbname": "a", "size": 1}]}, None),
+        (1, 10, {"db_size": [{"datetime": "y", "dbname": "a", "size": 2}]}, None),
+    ]
+
+    assert 2 == insert_metrics(mocker.Mock(name="session"), points)
+    # One statement per table for all points.
+    assert 1 == insert_rows.call_count
+    # Inserted datetimes are checked against aggregation watermark.
+    _, datetimes = flag_late.call_args[0]
+    assert {"db_size": {"x", "y"}} == datetimes
+
+
+def test_zoom_level():
+    from datetime import datetime, timedelta, timezone
+
+    from temboardui.plugins.monitoring.chartdata import tiers, zoom_level
+
+    assert ["5m", "30m", "1h", "6h", "1d"] == tiers("1d,5m,30m,6h,1h")
+    assert ["20m", "8h", "24h"] == tiers("24h,20m,8h")
+    for invalid in "7m", "90m", "5h", "48h", "2d", "5s":
+        with pytest.raises(ValueError):
+            tiers(invalid)
+    end = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    old = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    ladder = [(p, old) for p in tiers("5m,30m,1h,6h,1d")]
+
+    # Short range reads raw points.
+    assert zoom_level(end - timedelta(hours=6), end, ladder) is None
+    assert "5m" == zoom_level(end - timedelta(days=2), end, ladder)
+    assert "1h" == zoom_level(end - timedelta(days=25), end, ladder)
+    assert "6h" == zoom_level(end - timedelta(days=25), end, ladder, points=100)
+    assert "1d" == zoom_level(end - timedelta(days=365), end, ladder)
+    # Without 1d for the range, fallback to coarsest covering tier.
+    ladder[-1] = ("1d", end - timedelta(days=1))
+    assert "6h" == zoom_level(end - timedelta(days=365), end, ladder)
+
+
+def test_align_start():
+    from datetime import datetime, timezone
+
+    from temboardui.plugins.monitoring.chartdata import align_start
+
+    utc = timezone.utc
+    start = datetime(2024, 6, 1, 13, 47, 23, tzinfo=utc)
+    assert datetime(2024, 6, 1, 13, 47, tzinfo=utc) == align_start(start, None)
+    assert datetime(2024, 6, 1, 13, 45, tzinfo=utc) == align_start(start, "5m")
+    assert datetime(2024, 6, 1, 12, tzinfo=utc) == align_start(start, "6h")
+    # Sliding range shares start until next bucket.
+    later = datetime(2024, 6, 1, 13, 49, 59)
+    assert align_start(start, "5m") == align_start(later, "5m")
+
+
+def test_get_metrics_data_csv_shares_expansion(mocker):
+    from datetime import datetime, timedelta, timezone
+
+    from temboardui.plugins.monitoring.chartdata import get_metrics_data_csv
+
+    session = mocker.Mock(name="session")
+    cur = session.connection.return_value.connection.cursor.return_value
+    cur.fetchall.return_value = []
+    cur.mogrify.side_effect = lambda q, args: (q % args).encode("utf-8")
+    cur.copy_expert.side_effect = lambda sql, sink: sink.write("date\n")
+
+    end = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    data = get_metrics_data_csv(
+        session,
+        ["wal_files_size", "wal_files_count", "cpu"],
+        end - timedelta(hours=1),
+        end,
+        1,
+        2,
+    )
+
+    assert sorted(data) == ["cpu", "wal_files_count", "wal_files_size"]
+    # metric_wal_files is expanded once for both wal_files metrics.
+    (create,) = [
+        c.args[0] for c in cur.execute.call_args_list if "TEMPORARY" in c.args[0]
+    ]
+    assert "metric_wal_files" in create
+    copies = [c.args[0] for c in cur.copy_expert.call_args_list]
+    assert 2 == sum("expanded_0" in sql for sql in copies)
+    assert "expand_data_by_host_id('metric_cpu'" in copies[2]
+
+
+def test_evaluate_checks():
+    from temboardui.plugins.monitoring.tools import evaluate_checks
+
+    def point(dt, *values):
+        return [
+            dict(datetime=dt, name=name, key=key, value=v, warning=2, critical=4)
+            for name, key, v in values
+        ]
+
+    checks = dict(load1=1, cpu_core=2)
+    states = {(1, ""): "OK", (2, "cpu0"): "OK", (2, "cpu1"): "OK"}
+    last_changes = {(1, ""): "OK", (2, "cpu0"): "OK"}
+    ppdatas = [
+        point("t1", ("load1", "", 3), ("cpu_core", "cpu0", 1)),
+        point("t2", ("load1", "", 5)),
+        point("t3", ("load1", "", 5), ("cpu_core", "cpu0", 1)),
+    ]
+
+    changes, notifications = evaluate_checks(checks, states, last_changes, ppdatas)
+
+    # cpu1 is purged, load1 goes critical.
+    assert {(1, ""): "CRITICAL", (2, "cpu0"): "OK"} == states
+    assert [
+        ("t1", 1, "WARNING", "", 3, 2, 4),
+        ("t2", 1, "CRITICAL", "", 5, 2, 4),
+    ] == changes
+    # cpu_core was UNDEF at t2, because unchecked.
+    assert [("WARNING", "OK"), ("CRITICAL", "WARNING"), ("OK", "UNDEF")] == [
+        (n["state"], n["prev_state"]) for n in notifications
+    ]
@@ -9,3 +9,17 @@ def test_pivot():
     out_ = StringIO()
     pivot_timeserie(in_, index="i", key="k", value="v", output=out_)
     assert out_.getvalue() == expected
+
+
+def test_pivot_writer_chunks():
+    from temboardui.plugins.monitoring.pivot import PivotWriter
+
+    in_ = "i,k,v\n1,é,1\n1,b,2\n2,é,3\n4,b,5\n100,z,100\n".encode("utf-8")
+    expected = "i,é,b,z\n1,1,2,\n2,3,,\n4,,5,\n100,,,100\n"
+    out_ = StringIO()
+    writer = PivotWriter(index="i", key="k", value="v", output=out_, max_size=8)
+    # Split input in the middle of lines and characters.
+    for i in range(0, len(in_), 5):
+        writer.write(in_[i : i + 5])
+    writer.close()
+    assert out_.getvalue() == expected
@@ -0,0 +1,90 @@
+def test_format_copy_row():
+    from temboardui.plugins.statements import format_copy_row
+
+    assert "1\t\\N\tSELECT\\n\\t'a\\\\b'\n" == format_copy_row(
+        [1, None, "SELECT\n\t'a\\b'"]
+    )
+
+
+def test_sum_by_database():
+    from temboardui.plugins.statements import get_counters, sum_by_database
+
+    statements = [
+        dict(dbid=1, datname="a", calls=1, total_time=2.5, blk_read_time=1),
+        dict(dbid=1, datname="a", calls=2, total_time=1.0, blk_read_time=0),
+        dict(dbid=2, datname="b", calls=3, total_time=1.0, blk_read_time=2),
+    ]
+    databases = sum_by_database(statements)
+
+    assert [1, 2] == [d["dbid"] for d in databases]
+    assert 3 == databases[0]["calls"]
+    assert 3.5 == databases[0]["total_exec_time"]
+    assert databases[0]["wal_bytes"] is None
+    counters = get_counters(databases[1])
+    assert [3, 1.0] == counters[:2]
+    assert 2 == counters[13]
+
+
+def test_add_statement_toplevel(mocker):
+    from temboardui.plugins.statements import add_statement
+
+    session = mocker.Mock(name="session")
+    cur = session.connection.return_value.connection.cursor.return_value
+    copied = {}
+    cur.copy_expert.side_effect = lambda sql, f: copied.setdefault(
+        sql.split()[1], f.read()
+    )
+    instance = mocker.Mock(agent_address="0.0.0.0", agent_port=2345)
+    statement = dict(userid=10, rolname="r", dbid=1, datname="db", queryid=42, calls=1)
+    data = dict(
+        snapshot_datetime="2024-06-01T12:00:00+00:00",
+        # Same statement executed at top level and in a function.
+        data=[
+            dict(statement, query="SELECT 1", toplevel=True),
+            dict(statement, query="SELECT 1", toplevel=False),
+        ],
+    )
+
+    add_statement(session, instance, data)
+
+    lines = copied["statements_src_tmp"].splitlines()
+    assert ["True", "False"] == [line.split("\t")[-1] for line in lines]
+    # Totals by database sum both entries.
+    (total,) = copied["statements_src_db_tmp"].splitlines()
+    assert "2" == total.split("\t")[5]
+
+
+def test_pull_batch(mocker):
+    from temboardui.plugins.statements import statements_pull_batch
+
+    worker_engine = mocker.patch("temboardui.plugins.statements.worker_engine")
+    mocker.patch("temboardui.plugins.statements.Instance")
+    pull = mocker.patch("temboardui.plugins.statements.pull_data_for_instance")
+    pull.side_effect = [None, Exception("timeout"), None]
+    app = mocker.Mock(name="app")
+    app.config.statements.pull_concurrency = 2
+
+    # Failure of an agent does not prevent pulling others.
+    statements_pull_batch(app, [("a", 1), ("b", 2), ("c", 3)])
+    assert 3 == pull.call_count
+    # Repository connections don't grow with concurrency.
+    pull.side_effect = None
+    app.config.statements.pull_concurrency = 16
+    statements_pull_batch(app, [("a", 1)])
+    assert 2 == worker_engine.call_args.kwargs["pool_size"]
+
+
+def test_compact_worker(mocker):
+    from temboardui.plugins.statements import statements_compact_worker
+
+    engine = mocker.patch("temboardui.plugins.statements.worker_engine").return_value
+    conn = engine.begin.return_value.__enter__.return_value
+    conn.execute.return_value.fetchall.side_effect = [
+        [("statements_history_packed", 1000), ("statements_history_db_packed", 10)],
+        [("statements_history_packed", 5), ("statements_history_db_packed", 0)],
+        [("statements_history_packed", 0), ("statements_history_db_packed", 0)],
+    ]
+
+    # Pack batches until history is empty.
+    statements_compact_worker(mocker.Mock(name="app"))
+    assert 3 == engine.begin.call_count
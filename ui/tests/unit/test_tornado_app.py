@@ -131,3 +131,17 @@ def test_make_error(mocker):
 
     assert not response.body
     assert 200 == response.status_code
+
+
+def test_etag_matches(mocker):
+    from temboardui.web.tornado import etag_matches
+
+    request = mocker.Mock(name="request", headers={})
+    assert not etag_matches(request, '"a"')
+
+    request.headers["If-None-Match"] = '"b", W/"a"'
+    assert etag_matches(request, '"a"')
+    assert not etag_matches(request, '"c"')
+
+    request.headers["If-None-Match"] = "*"
+    assert etag_matches(request, '"c"')